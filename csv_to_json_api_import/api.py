@@ -0,0 +1,54 @@
+"""Base URLs and response cache upkeep shared by the blocking and asyncio Snyk API clients
+
+Imports no HTTP library, so neither client pulls in the other's.
+"""
+
+from urllib.parse import quote
+
+from csv_to_json_api_import.constants import *
+
+class SnykApi:
+    """Where a client sends its requests, and which cached responses its calls make stale
+
+    Base of snyk.SnykClient and snyk_async.AsyncSnykClient, which set self.cache to their
+    response cache or None.
+    """
+
+    def __init__(self, api_url=None):
+        if api_url is None:
+            self.api_url = SNYK_API_BASE_URL
+            self.rest_url = SNYK_REST_API_BASE_URL
+            self.v1_url = SNYK_V1_API_BASE_URL
+        else:
+            # any other host, e.g. a local stand-in, serves both APIs under one base URL
+            self.api_url = api_url.rstrip('/')
+            self.rest_url = f"{self.api_url}/rest"
+            self.v1_url = f"{self.api_url}/v1"
+
+    def next_url(self, link):
+        """Absolute URL of a REST API pagination link, links may or may not include the /rest prefix"""
+        if link.startswith('http'):
+            return link
+        if link.startswith('/rest/'):
+            return f"{self.api_url}{link}"
+
+        return f"{self.rest_url}{link}"
+
+    def invalidate(self, path, contains=None):
+        """Drop cached responses of URLs starting with the REST API path that contain contains"""
+        if self.cache is not None:
+            self.cache.invalidate(f"{self.rest_url}{path}", contains)
+
+    def invalidate_moved_projects(self, source_org, target_org, target_id=None):
+        """Drop the cached project lists that moves from source_org to target_org make stale"""
+        self.invalidate(f"/orgs/{source_org}/projects", None if target_id is None else f"target_id={target_id}")
+        self.invalidate(f"/orgs/{target_org}/projects")
+
+    def invalidate_deleted_target(self, org_id, target_id):
+        """Drop the cached target lists and project lists that deleting the target makes stale"""
+        self.invalidate(f"/orgs/{org_id}/targets")
+        self.invalidate(f"/orgs/{org_id}/projects", f"target_id={target_id}")
+
+    def invalidate_org_lookup(self, group_id, org_name):
+        """Drop the cached lookup of an org that wasn't found, so it is found once create-orgs creates it"""
+        self.invalidate(f"/groups/{group_id}/orgs", f"name={quote(org_name, safe='')}")
@@ -0,0 +1,2 @@
+"""Local Snyk API stand-in and benchmarks for the migration commands
+"""
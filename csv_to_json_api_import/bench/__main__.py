@@ -0,0 +1,4 @@
+from csv_to_json_api_import.bench import benchmark
+
+if __name__ == "__main__":
+    benchmark.run()
@@ -0,0 +1,293 @@
+"""Benchmark the migration commands against the local Snyk API stand-in
+
+Usage:
+
+    python -m csv_to_json_api_import.bench migrate --rows 1000 --rows 10000 --migrate-arg=--concurrency=8
+    python -m csv_to_json_api_import.bench serve --csv-path ./example.csv
+    python -m csv_to_json_api_import.bench startup --rows 1000000
+"""
+
+# ===== IMPORTS =====
+
+import csv
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+import typer
+from rich import print
+from rich.table import Table
+from typing_extensions import Annotated
+
+from csv_to_json_api_import.bench.fake_snyk import FAKE_GROUP_ID, FAKE_SOURCE_ORG, PAGE_SIZE_DEFAULT, FakeSnyk, serve
+
+# ===== CONSTANTS =====
+
+ASSETS_PER_ORG = 20
+
+BENCH_ROWS_DEFAULT = [1000]
+
+STARTUP_ROWS_DEFAULT = [1000000]
+STARTUP_RUNS_DEFAULT = 5
+
+# modules that org-json and --help shouldn't need to import
+NETWORK_MODULES = ('requests', 'httpx', 'sqlite3')
+
+# ===== GLOBALS =====
+
+app = typer.Typer(add_completion=False)
+
+# ===== METHODS =====
+
+def write_synthetic_csv(csv_path, rows):
+    """Write a CSV in the asset export format, rows are grouped ASSETS_PER_ORG to an asset like real exports"""
+    with open(csv_path, 'w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(["Tech Org", "Asset ID", "Asset Name", "Repo URL", "Project Name", "Repo Count"])
+
+        for index in range(rows):
+            asset = index // ASSETS_PER_ORG
+            repo = f"bench_org/repo_{index}"
+            csv_writer.writerow(["", str(1000 + asset), f"Asset {asset}", f"https://github.com/{repo}", repo, 1])
+
+def run_command(api_url, args):
+    """Run a CLI command in a fresh interpreter against api_url, returns the seconds it took"""
+    command = [sys.executable, '-m', 'csv_to_json_api_import', '--api-url', api_url] + args
+
+    start = time.monotonic()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+    return time.monotonic() - start
+
+def measure_command(args, cwd=None):
+    """Run a CLI command in a fresh interpreter, returns the seconds it took and its peak RSS in bytes"""
+    command = [sys.executable, '-m', 'csv_to_json_api_import'] + args
+
+    start = time.monotonic()
+    process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.DEVNULL)
+    # wait4 gives the resource usage of this child alone, unlike getrusage(RUSAGE_CHILDREN)
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.monotonic() - start
+
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+    return seconds, peak_rss
+
+def imported_modules(args):
+    """Top level modules a CLI command imports, from the -X importtime report"""
+    command = [sys.executable, '-X', 'importtime', '-m', 'csv_to_json_api_import'] + args
+    output = subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True).stderr
+
+    return {line.rsplit('|', 1)[1].strip().split('.')[0] for line in output.splitlines() if line.startswith('import time:') and '|' in line}
+
+def report(results):
+    table = Table(title="Benchmark results")
+
+    for column in ["Command", "Rows", "Seconds", "Rows/sec", "API calls/row", "p50 ms", "p99 ms"]:
+        table.add_column(column, justify="right", no_wrap=True)
+
+    for result in results:
+        table.add_row(
+            result['command'],
+            str(result['rows']),
+            f"{result['seconds']:.2f}",
+            f"{result['rows'] / result['seconds']:.1f}",
+            f"{result['calls_total'] / result['rows']:.2f}",
+            f"{result['latency_p50'] * 1000:.1f}",
+            f"{result['latency_p99'] * 1000:.1f}")
+
+    print(table)
+
+@app.command('migrate')
+def migrate(
+    rows:
+        Annotated[
+            List[int],
+            typer.Option(
+                help="Number of CSV rows to benchmark with, can be given more than once")] = BENCH_ROWS_DEFAULT,
+    projects_per_target:
+        Annotated[
+            int,
+            typer.Option(
+                help="Number of projects in every target")] = 2,
+    latency:
+        Annotated[
+            float,
+            typer.Option(
+                help="Average seconds the stand-in takes to answer each call")] = 0.01,
+    throttle_rate:
+        Annotated[
+            float,
+            typer.Option(
+                help="Fraction of calls answered with a 429")] = 0.0,
+    retry_after:
+        Annotated[
+            int,
+            typer.Option(
+                help="Retry-After seconds sent with injected 429s")] = 1,
+    page_size:
+        Annotated[
+            int,
+            typer.Option(
+                help="Maximum page size served by list endpoints")] = PAGE_SIZE_DEFAULT,
+    migrate_args:
+        Annotated[
+            List[str],
+            typer.Option(
+                '--migrate-arg',
+                help="Extra argument passed to migrate-projects, e.g. --migrate-arg=--concurrency=8")] = None,
+    rate_limit:
+        Annotated[
+            float,
+            typer.Option(
+                help="Client side rate limit passed to the commands, 0 for no limit")] = 0):
+    """Benchmark migrate-projects followed by extract-remaining-targets on synthetic CSVs"""
+
+    results = []
+
+    for row_count in rows:
+        fake = FakeSnyk(latency=latency, throttle_rate=throttle_rate, retry_after=retry_after, page_size=page_size)
+
+        with tempfile.TemporaryDirectory() as work_dir:
+            csv_path = os.path.join(work_dir, 'bench.csv')
+            write_synthetic_csv(csv_path, row_count)
+            fake.load_csv(csv_path, projects_per_target=projects_per_target)
+
+            server = serve(fake)
+
+            try:
+                seconds = run_command(server.url, [
+                    'migrate-projects', 'bench-token', FAKE_GROUP_ID, FAKE_SOURCE_ORG,
+                    f'--csv-path={csv_path}',
+                    f'--output-csv-path={os.path.join(work_dir, "errored.csv")}',
+                    f'--journal-path={os.path.join(work_dir, "journal.jsonl")}',
+                    f'--rate-limit={rate_limit}'] + (migrate_args or []))
+                results.append({'command': 'migrate-projects', 'rows': row_count, 'seconds': seconds, **fake.stats()})
+
+                fake.reset_stats()
+
+                seconds = run_command(server.url, [
+                    'extract-remaining-targets', 'bench-token', FAKE_SOURCE_ORG,
+                    f'--csv-path={csv_path}',
+                    f'--output-csv-path={os.path.join(work_dir, "remaining.csv")}',
+                    f'--rate-limit={rate_limit}'])
+                results.append({'command': 'extract-remaining-targets', 'rows': row_count, 'seconds': seconds, **fake.stats()})
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    report(results)
+
+@app.command('startup')
+def startup(
+    rows:
+        Annotated[
+            List[int],
+            typer.Option(
+                help="Number of CSV rows to run org-json on, can be given more than once")] = STARTUP_ROWS_DEFAULT,
+    runs:
+        Annotated[
+            int,
+            typer.Option(
+                help="Number of times to start the CLI, the median is reported")] = STARTUP_RUNS_DEFAULT):
+    """Benchmark CLI startup, and the time and peak memory of org-json on synthetic CSVs"""
+
+    table = Table(title="Startup and org-json results")
+
+    for column in ["Command", "Rows", "Seconds", "Rows/sec", "Peak RSS MB"]:
+        table.add_column(column, justify="right", no_wrap=True)
+
+    for command in (['--help'], ['org-json', '--help']):
+        samples = [measure_command(command) for _ in range(runs)]
+
+        table.add_row(
+            ' '.join(command),
+            "-",
+            f"{statistics.median(seconds for seconds, _ in samples):.3f}",
+            "-",
+            f"{max(peak_rss for _, peak_rss in samples) / 2**20:.1f}")
+
+    for row_count in rows:
+        with tempfile.TemporaryDirectory() as work_dir:
+            csv_path = os.path.join(work_dir, 'bench.csv')
+            write_synthetic_csv(csv_path, row_count)
+
+            seconds, peak_rss = measure_command(['org-json', FAKE_GROUP_ID, FAKE_SOURCE_ORG, f'--csv-path={csv_path}'], cwd=work_dir)
+
+            table.add_row(
+                'org-json',
+                str(row_count),
+                f"{seconds:.2f}",
+                f"{row_count / seconds:.1f}",
+                f"{peak_rss / 2**20:.1f}")
+
+    print(table)
+
+    network_modules = sorted(imported_modules(['org-json', '--help']).intersection(NETWORK_MODULES))
+    print(f"Network modules imported by org-json: {', '.join(network_modules) or 'none'}")
+
+@app.command('serve')
+def serve_fake(
+    csv_path:
+        Annotated[
+            str,
+            typer.Option(
+                help="CSV file to create source org targets and destination orgs from")] = None,
+    port:
+        Annotated[
+            int,
+            typer.Option(
+                help="Port to listen on")] = 8080,
+    projects_per_target:
+        Annotated[
+            int,
+            typer.Option(
+                help="Number of projects in every target")] = 2,
+    latency:
+        Annotated[
+            float,
+            typer.Option(
+                help="Average seconds the stand-in takes to answer each call")] = 0.0,
+    throttle_rate:
+        Annotated[
+            float,
+            typer.Option(
+                help="Fraction of calls answered with a 429")] = 0.0,
+    page_size:
+        Annotated[
+            int,
+            typer.Option(
+                help="Maximum page size served by list endpoints")] = PAGE_SIZE_DEFAULT):
+    """Run the stand-in in the foreground, point the CLI at it with --api-url"""
+
+    fake = FakeSnyk(latency=latency, throttle_rate=throttle_rate, page_size=page_size)
+
+    if csv_path is not None:
+        fake.load_csv(csv_path, projects_per_target=projects_per_target)
+
+    server = serve(fake, port=port)
+
+    print(f"Serving a fake Snyk API on {server.url}, group: {FAKE_GROUP_ID}, source org: {FAKE_SOURCE_ORG}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        print(fake.stats())
+
+def run():
+    """Run the benchmark typer CLI app
+    """
+    app()
@@ -0,0 +1,318 @@
+"""Local stand-in for the parts of the Snyk API used by the migration commands
+
+Serves the REST targets, projects and group orgs endpoints and the v1 project move and org
+creation endpoints from in-memory state, with configurable latency, 429 injection, injected
+failures and page sizes. Every call is counted and timed so a benchmark can report calls per
+row and latency percentiles.
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from csv_to_json_api_import.metrics import percentile
+from csv_to_json_api_import.rows import read_rows, truncate_org_name
+
+FAKE_GROUP_ID   = 'fake-group'
+FAKE_SOURCE_ORG = 'fake-source-org'
+
+PAGE_SIZE_DEFAULT = 100
+
+class FakeSnyk:
+    """In-memory state of one group: its orgs, their targets and projects, plus call statistics"""
+
+    def __init__(self, latency=0.0, throttle_rate=0.0, retry_after=1, page_size=PAGE_SIZE_DEFAULT):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.page_size = page_size
+
+        # org id -> org name
+        self.orgs = {FAKE_SOURCE_ORG: 'Source Org'}
+        # target id -> {'org', 'name', 'created'}
+        self.targets = {}
+        # project id -> {'org', 'target'}
+        self.projects = {}
+
+        # indexes so every call costs about the same whatever the size of the org,
+        # dicts are used as insertion ordered sets
+        self.org_targets = {FAKE_SOURCE_ORG: {}}
+        self.targets_by_name = {}
+        self.target_projects = {}
+
+        # endpoint -> (HTTP status, offset of the first failing page, query parameter or None)
+        self.failures = {}
+
+        self.calls = {}
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    def fail(self, endpoint, status, offset=0, param=None):
+        """Answer calls to endpoint with status, list calls only from offset items in, e.g. to fail the second page
+
+        With param, only calls with that query parameter fail, e.g. the displayName lookups of list_targets.
+        """
+        with self.lock:
+            self.failures[endpoint] = (status, offset, param)
+
+    def add_org(self, name):
+        org_id = str(uuid.uuid4())
+        self.orgs[org_id] = truncate_org_name(name)
+        self.org_targets[org_id] = {}
+        return org_id
+
+    def add_target(self, org_id, name, projects=1):
+        target_id = str(uuid.uuid4())
+        self.targets[target_id] = {
+            'org': org_id,
+            'name': name,
+            'created': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        }
+        self.org_targets[org_id][target_id] = None
+        self.targets_by_name.setdefault((org_id, name), {})[target_id] = None
+        self.target_projects[target_id] = {}
+
+        for _ in range(projects):
+            self.add_project(target_id)
+
+        return target_id
+
+    def add_project(self, target_id):
+        project_id = str(uuid.uuid4())
+        self.projects[project_id] = {'org': self.targets[target_id]['org'], 'target': target_id}
+        self.target_projects[target_id][project_id] = None
+        return project_id
+
+    def delete_target(self, target_id):
+        target = self.targets.pop(target_id)
+        del self.org_targets[target['org']][target_id]
+        del self.targets_by_name[(target['org'], target['name'])][target_id]
+
+    def load_csv(self, csv_path, projects_per_target=2, create_orgs=True):
+        """Create a source org target for every CSV row and, optionally, every destination org"""
+        org_names = set(self.orgs.values())
+
+        for row in read_rows(csv_path):
+            self.add_target(FAKE_SOURCE_ORG, row.target_name, projects_per_target)
+
+            org_name = truncate_org_name(row.org_name)
+            if create_orgs and org_name not in org_names:
+                self.add_org(org_name)
+                org_names.add(org_name)
+
+        return self
+
+    def record(self, endpoint, seconds):
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            self.latencies.append(seconds)
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            calls = dict(self.calls)
+
+        return {
+            'calls': calls,
+            'calls_total': sum(calls.values()),
+            'latency_p50': percentile(latencies, 50),
+            'latency_p99': percentile(latencies, 99)
+        }
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls = {}
+            self.latencies = []
+
+class FakeSnykHandler(BaseHTTPRequestHandler):
+    """Routes requests to the FakeSnyk instance attached to the server"""
+
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body are written separately, without this every keep-alive response
+    # waits out the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self, method):
+        fake = self.server.fake
+        start = time.monotonic()
+
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length)) if length else {}
+
+        endpoint, handler = self._route(method, parts)
+
+        if fake.latency > 0:
+            time.sleep(random.uniform(0.5, 1.5) * fake.latency)
+
+        failure = fake.failures.get(endpoint)
+
+        if handler is None:
+            self._send(404, {'errors': [{'detail': 'Not found'}]})
+        elif failure is not None and int(query.get('starting_after', 0)) >= failure[1] and (failure[2] is None or failure[2] in query):
+            self._send(failure[0], {'errors': [{'detail': 'Injected failure'}]})
+        elif fake.throttle_rate > 0 and random.random() < fake.throttle_rate:
+            self._send(429, {'errors': [{'detail': 'Too many requests'}]}, {'Retry-After': str(fake.retry_after)})
+        else:
+            with fake.lock:
+                status, payload = handler(fake, parts, query, body)
+            self._send(status, payload)
+
+        fake.record(endpoint, time.monotonic() - start)
+
+    def _route(self, method, parts):
+        if method == 'GET' and parts[:2] == ['rest', 'orgs'] and len(parts) == 4 and parts[3] == 'targets':
+            return 'list_targets', _list_targets
+        if method == 'GET' and parts[:2] == ['rest', 'orgs'] and len(parts) == 4 and parts[3] == 'projects':
+            return 'list_projects', _list_projects
+        if method == 'GET' and parts[:2] == ['rest', 'groups'] and len(parts) == 4 and parts[3] == 'orgs':
+            return 'list_orgs', _list_orgs
+        if method == 'DELETE' and parts[:2] == ['rest', 'orgs'] and len(parts) == 5 and parts[3] == 'targets':
+            return 'delete_target', _delete_target
+        if method == 'POST' and parts == ['v1', 'org']:
+            return 'create_org', _create_org
+        if method == 'PUT' and parts[:2] == ['v1', 'org'] and len(parts) == 6 and parts[5] == 'move':
+            return 'move_project', _move_project
+
+        return 'unknown', None
+
+    def _send(self, status, payload, headers=None):
+        content = b'' if payload is None else json.dumps(payload).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        self.wfile.write(content)
+
+def _page(fake, path, query, ids, item):
+    """Return one page of items and the pagination links, the cursor is a plain offset"""
+    limit = min(int(query.get('limit', 10)), fake.page_size)
+    offset = int(query.get('starting_after', 0))
+
+    page = list(islice(ids, offset, offset + limit + 1))
+
+    links = {}
+    if len(page) > limit:
+        links['next'] = f"{path}?{urlencode({**query, 'starting_after': offset + limit})}"
+
+    return {'data': [item(item_id) for item_id in page[:limit]], 'links': links}
+
+def _list_targets(fake, parts, query, body):
+    org_id = parts[2]
+
+    if 'displayName' in query:
+        target_ids = fake.targets_by_name.get((org_id, query['displayName']), {})
+    else:
+        target_ids = fake.org_targets.get(org_id, {})
+
+    if 'created_gte' in query:
+        target_ids = [target_id for target_id in target_ids if fake.targets[target_id]['created'] >= query['created_gte']]
+
+    def target(target_id):
+        return {
+            'id': target_id,
+            'type': 'target',
+            'attributes': {
+                'displayName': fake.targets[target_id]['name'],
+                'created_at': fake.targets[target_id]['created']
+            }
+        }
+
+    return 200, _page(fake, f"/rest/orgs/{org_id}/targets", query, target_ids, target)
+
+def _list_projects(fake, parts, query, body):
+    org_id = parts[2]
+
+    if 'target_id' in query:
+        project_ids = fake.target_projects.get(query['target_id'], {})
+    else:
+        project_ids = fake.projects
+
+    project_ids = [project_id for project_id in project_ids if fake.projects[project_id]['org'] == org_id]
+
+    def project(project_id):
+        return {'id': project_id, 'type': 'project', 'attributes': {}}
+
+    return 200, _page(fake, f"/rest/orgs/{org_id}/projects", query, project_ids, project)
+
+def _list_orgs(fake, parts, query, body):
+    group_id = parts[2]
+
+    org_ids = [org_id for org_id, name in fake.orgs.items() if 'name' not in query or query['name'] in name]
+
+    def org(org_id):
+        return {'id': org_id, 'type': 'org', 'attributes': {'name': fake.orgs[org_id]}}
+
+    return 200, _page(fake, f"/rest/groups/{group_id}/orgs", query, org_ids, org)
+
+def _delete_target(fake, parts, query, body):
+    target_id = parts[4]
+
+    if target_id not in fake.targets:
+        return 404, {'errors': [{'detail': 'Target not found'}]}
+
+    fake.delete_target(target_id)
+    return 204, None
+
+def _move_project(fake, parts, query, body):
+    source_org, project_id = parts[2], parts[4]
+
+    project = fake.projects.get(project_id)
+    if project is None or project['org'] != source_org:
+        return 404, {'message': 'Project not found'}
+    if body.get('targetOrgId') not in fake.orgs:
+        return 403, {'message': 'Not allowed'}
+
+    del fake.target_projects[project['target']][project_id]
+    project['org'] = body['targetOrgId']
+    project['target'] = None
+    return 200, {'originOrg': source_org, 'destinationOrg': body['targetOrgId']}
+
+def _create_org(fake, parts, query, body):
+    if not body.get('name') or body.get('groupId') != FAKE_GROUP_ID:
+        return 400, {'message': 'Invalid request'}
+    if 'sourceOrgId' in body and body['sourceOrgId'] not in fake.orgs:
+        return 404, {'message': 'Source org not found'}
+
+    org_id = fake.add_org(body['name'])
+    return 201, {'id': org_id, 'name': fake.orgs[org_id], 'group': {'id': FAKE_GROUP_ID}}
+
+def serve(fake, host='127.0.0.1', port=0):
+    """Start serving fake in a background thread, returns the server, its URL is server.url"""
+    server = ThreadingHTTPServer((host, port), FakeSnykHandler)
+    server.daemon_threads = True
+    server.fake = fake
+    server.url = f"http://{host}:{server.server_address[1]}"
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
@@ -0,0 +1,105 @@
+"""Opt-in on-disk cache of Snyk API GET responses, shared by repeated runs
+"""
+
+import sqlite3
+import threading
+import time
+
+from csv_to_json_api_import.constants import RESPONSE_CACHE_TTL_SECONDS
+
+RESPONSE_CACHE_MAX_ENTRIES   = 100000
+
+# how many stores between checks of the cache size, and how full it is left after eviction
+RESPONSE_CACHE_EVICT_EVERY   = 1000
+RESPONSE_CACHE_EVICT_TO      = 0.9
+
+class ResponseCache:
+    """SQLite table of successful GET response bodies keyed by URL
+
+    Entries older than ttl seconds are ignored and dropped when read. Every hit refreshes the
+    entry's last use, and once there are more than max_entries the least recently used are
+    evicted. Calls that change state invalidate the entries they make stale by URL prefix, so
+    a dry run followed by the real run and extract-remaining-targets mostly read local data
+    without ever reading data the run itself changed. WAL mode lets the workers of a sharded
+    run share one file.
+    """
+
+    def __init__(self, path, ttl=RESPONSE_CACHE_TTL_SECONDS, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, body BLOB, stored REAL, used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_used ON responses (used)')
+
+    def get(self, url):
+        """Return the cached body of url, or None if there is no fresh entry"""
+        now = time.time()
+
+        with self.lock:
+            entry = self.db.execute('SELECT body, stored FROM responses WHERE url = ?', (url,)).fetchone()
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            body, stored = entry
+
+            if now - stored > self.ttl:
+                self.db.execute('DELETE FROM responses WHERE url = ?', (url,))
+                self.misses += 1
+                return None
+
+            self.db.execute('UPDATE responses SET used = ? WHERE url = ?', (now, url))
+            self.hits += 1
+
+            return body
+
+    def put(self, url, body):
+        now = time.time()
+
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO responses (url, body, stored, used) VALUES (?, ?, ?, ?)', (url, body, now, now))
+            self.stores += 1
+
+            if self.stores % RESPONSE_CACHE_EVICT_EVERY == 0:
+                self._evict()
+
+    def invalidate(self, prefix, contains=None):
+        """Drop every entry whose URL starts with prefix and, if given, contains contains"""
+        # a range scan of the primary key instead of LIKE, which would need escaping
+        query = 'DELETE FROM responses WHERE url >= ? AND url < ?'
+        params = [prefix, prefix + '\uffff']
+
+        if contains is not None:
+            query += ' AND instr(url, ?) > 0'
+            params.append(contains)
+
+        with self.lock:
+            self.db.execute(query, params)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self.lock:
+            self._evict()
+            self.db.close()
+
+    def _evict(self):
+        (entries,) = self.db.execute('SELECT COUNT(*) FROM responses').fetchone()
+
+        if entries > self.max_entries:
+            keep = int(self.max_entries * RESPONSE_CACHE_EVICT_TO)
+            self.db.execute(
+                'DELETE FROM responses WHERE url IN (SELECT url FROM responses ORDER BY used LIMIT ?)',
+                (entries - keep,))
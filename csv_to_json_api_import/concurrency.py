@@ -0,0 +1,144 @@
+"""Adaptive limit on the number of project moves in flight
+"""
+
+import asyncio
+import threading
+import time
+
+from csv_to_json_api_import.constants import ADAPTIVE_CONCURRENCY_MAX
+
+# a congestion signal multiplies the limit by this, successes add 1 / limit each
+ADAPTIVE_DECREASE_FACTOR      = 0.5
+# move latency above this multiple of the lowest latency seen counts as congestion
+ADAPTIVE_LATENCY_TOLERANCE    = 2.0
+# weight of the newest latency in the moving average
+ADAPTIVE_LATENCY_SMOOTHING    = 0.2
+ADAPTIVE_HISTORY_MAX          = 1000
+
+class AdaptiveLimit:
+    """AIMD controller of how many calls may be in flight at once
+
+    Starts at initial and grows by one for every limit calls that complete while the API is
+    healthy, probing for spare capacity. A 429, 5xx or transport error anywhere in the run, as
+    counted by the shared retry policy, or a moving average latency over
+    ADAPTIVE_LATENCY_TOLERANCE times the best seen, halves it instead. Calls that were already
+    in flight when the limit was cut don't cut it again, so one 429 storm costs a single halving.
+    Every change of the whole number limit is kept in the history for the run summary.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=ADAPTIVE_CONCURRENCY_MAX, retry_policy=None):
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        self.retry_policy = retry_policy
+
+        self.in_flight = 0
+        self.latency = None
+        self.best_latency = None
+        self.congestion_seen = 0 if retry_policy is None else retry_policy.congestion_events
+        self.last_cut = 0.0
+        self.cuts = {'congestion': 0, 'latency': 0}
+
+        self.started = time.monotonic()
+        self.history = [(0.0, int(self.limit), 'start')]
+        self.condition = threading.Condition()
+        self.async_waiters = []
+
+    def acquire(self):
+        """Block until a call may start, returns the start time to pass to release"""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+
+            self.in_flight += 1
+            return time.monotonic()
+
+    async def acquire_async(self):
+        """Wait without blocking the event loop until a call may start, see acquire"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            with self.condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return time.monotonic()
+
+                waiter = loop.create_future()
+                self.async_waiters.append((loop, waiter))
+
+            await waiter
+
+    def release(self, started, status):
+        """Record the outcome of a call started at started, status None when it got no response"""
+        now = time.monotonic()
+
+        with self.condition:
+            self.in_flight -= 1
+
+            congested = status is None or status == 429 or status >= 500
+
+            if self.retry_policy is not None:
+                congestion_events = self.retry_policy.congestion_events
+                congested = congested or congestion_events > self.congestion_seen
+                self.congestion_seen = congestion_events
+
+            if not congested:
+                self._record_latency(now - started)
+
+            if congested:
+                self._cut(started, now, 'congestion')
+            elif self.latency > self.best_latency * ADAPTIVE_LATENCY_TOLERANCE:
+                self._cut(started, now, 'latency')
+            else:
+                self._set(min(self.maximum, self.limit + 1 / self.limit), now, 'increase')
+
+            self.condition.notify_all()
+            waiters, self.async_waiters = self.async_waiters, []
+
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'limit': int(self.limit),
+                'min': self.minimum,
+                'max': self.maximum,
+                'cuts': dict(self.cuts),
+                'history': [{'seconds': round(seconds, 3), 'limit': limit, 'reason': reason} for seconds, limit, reason in self.history]
+            }
+
+    def _record_latency(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += ADAPTIVE_LATENCY_SMOOTHING * (latency - self.latency)
+
+        if self.best_latency is None or self.latency < self.best_latency:
+            self.best_latency = self.latency
+
+    def _cut(self, started, now, reason):
+        # calls sent before the last cut saw the old limit
+        if started < self.last_cut:
+            return
+
+        self.last_cut = now
+        self.cuts[reason] += 1
+
+        # let the average recover from the slow calls instead of cutting on it again
+        self.latency = self.best_latency
+
+        self._set(max(self.minimum, self.limit * ADAPTIVE_DECREASE_FACTOR), now, reason)
+
+    def _set(self, limit, now, reason):
+        changed = int(limit) != int(self.limit)
+        self.limit = limit
+
+        if changed:
+            if len(self.history) >= ADAPTIVE_HISTORY_MAX:
+                del self.history[1]
+            self.history.append((now - self.started, int(limit), reason))
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
@@ -1,10 +1,29 @@
-
-
 SNYK_V1_API_BASE_URL                = 'https://snyk.io/api/v1'
 SNYK_REST_API_BASE_URL              = 'https://api.snyk.io/rest'
 SNYK_API_BASE_URL                   = 'https://api.snyk.io'
 SNYK_REST_API_VERSION               = '2024-01-04~beta'
 SNYK_API_TIMEOUT_DEFAULT            = 300
+SNYK_API_POOL_SIZE_DEFAULT          = 10
 
 SNYK_API_RATE_LIMIT_BACKOFF_SECONDS = 65
-MAX_RETRIES                         = 5
\ No newline at end of file
+SNYK_API_RATE_LIMIT_DEFAULT         = 25
+MAX_RETRIES                         = 5
+RETRY_BACKOFF_BASE_SECONDS          = 1
+RETRY_BACKOFF_MAX_SECONDS           = 60
+RETRY_BUDGET_RATIO                  = 0.1
+RETRY_BUDGET_MIN                    = 100
+
+CIRCUIT_BREAKER_THRESHOLD           = 10
+CIRCUIT_BREAKER_COOLDOWN_SECONDS    = 30
+CIRCUIT_BREAKER_MAX_SECONDS         = 300
+
+# endpoints the async and pipeline backends limit the in-flight calls to separately
+SNYK_API_ENDPOINTS                  = ('targets', 'projects', 'orgs', 'move', 'delete')
+
+RESPONSE_CACHE_TTL_SECONDS          = 3600
+
+ADAPTIVE_CONCURRENCY_MAX            = 64
+
+TARGET_INDEX_REFRESH_SECONDS        = 60
+
+ORG_NAME_MAX_LENGTH                 = 60
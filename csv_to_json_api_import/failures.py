@@ -0,0 +1,70 @@
+"""Buffered, thread-safe writer for CSV rows that failed to migrate
+"""
+
+import csv
+import os
+import threading
+import time
+
+FAILURE_COLUMNS = ["Failure Reason", "HTTP Status"]
+
+FAILURE_FLUSH_ROWS    = 100
+FAILURE_FLUSH_SECONDS = 5
+
+class FailureSink:
+    """Collects failed rows and appends them to a CSV file in batches
+
+    Each row is written with its original fields followed by the failure reason and the HTTP
+    status of the call that failed (empty when there wasn't one). Buffered rows are written
+    every FAILURE_FLUSH_ROWS rows or FAILURE_FLUSH_SECONDS seconds, whichever comes first, and
+    on close. The header is only written when the file is new, so a failure file can be used
+    as the input CSV of a retry run. The failure columns of such an input, matched in any case,
+    are dropped from its rows, so they only get the reason and status of the retry.
+    """
+
+    def __init__(self, path, header, flush_rows=FAILURE_FLUSH_ROWS, flush_seconds=FAILURE_FLUSH_SECONDS):
+        failure_columns = {column.lower() for column in FAILURE_COLUMNS}
+
+        self.path = path
+        # indexes of the input columns written out
+        self.columns = [index for index, column in enumerate(header) if column.strip().lower() not in failure_columns]
+        self.header = [header[index] for index in self.columns] + FAILURE_COLUMNS
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+
+        self.buffer = []
+        self.total = 0
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, row, reason, status=None):
+        with self.lock:
+            values = [row.values[index] if index < len(row.values) else '' for index in self.columns]
+            self.buffer.append(values + [reason, '' if status is None else status])
+            self.total += 1
+
+            if len(self.buffer) >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_seconds:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+
+    def _flush(self):
+        if self.buffer:
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+
+            with open(self.path, 'a', newline='') as output_csv_file:
+                output_csv_writer = csv.writer(output_csv_file)
+
+                if new_file:
+                    output_csv_writer.writerow(self.header)
+
+                output_csv_writer.writerows(self.buffer)
+
+            self.buffer = []
+
+        self.last_flush = time.monotonic()
@@ -0,0 +1,140 @@
+"""Append-only on-disk journal of completed migration work, used to resume crashed runs
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+JOURNAL_SYNC_EVERY   = 100
+JOURNAL_SYNC_SECONDS = 5
+
+EVENT_MOVE   = 'move'
+EVENT_DELETE = 'delete'
+
+class Journal:
+    """JSON lines journal of project moves and target deletions
+
+    Each completed move or deletion is appended as one line. Lines are flushed and fsync'd in
+    batches, every JOURNAL_SYNC_EVERY records or JOURNAL_SYNC_SECONDS seconds, whichever comes
+    first, and on close. A crash can lose the last unsynced batch, which only means that work
+    is redone on resume. Each batch goes to the file in a single O_APPEND write, so the worker
+    processes of a sharded run can share one journal without interleaving lines. Loading an
+    existing journal keeps sets of deleted targets and moved projects so resumed work can be
+    skipped with a set lookup. Every record names the source org, and only the records of
+    source_org are loaded, since target names are only unique within an org.
+    """
+
+    def __init__(self, path, source_org, sync_every=JOURNAL_SYNC_EVERY, sync_seconds=JOURNAL_SYNC_SECONDS):
+        self.path = path
+        self.source_org = source_org
+        self.sync_every = sync_every
+        self.sync_seconds = sync_seconds
+
+        self.deleted_targets = set()
+        self.moved_projects = set()
+        # targets with at least one project moved
+        self.moved_targets = set()
+
+        self.fd = None
+        self.unsynced = []
+        self.last_sync = time.monotonic()
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Read the outcomes recorded by previous runs from the source org"""
+        if not os.path.exists(self.path):
+            return self
+
+        with open(self.path, 'r', encoding='utf-8') as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a partially written last line from a crash
+                    continue
+
+                if record.get('source_org') != self.source_org:
+                    continue
+
+                if record['event'] == EVENT_MOVE:
+                    self.moved_projects.add(record['project'])
+                    self.moved_targets.add(record['target'])
+                elif record['event'] == EVENT_DELETE:
+                    self.deleted_targets.add(record['target'])
+
+        return self
+
+    def is_target_deleted(self, target_name):
+        return target_name in self.deleted_targets
+
+    def is_project_moved(self, project_id):
+        return project_id in self.moved_projects
+
+    def is_target_started(self, target_name):
+        """Whether any of the target's projects were moved, by this run or a previous one"""
+        return target_name in self.moved_targets
+
+    def record_move(self, target_name, target_id, project_id, org_id):
+        self.moved_projects.add(project_id)
+        self.moved_targets.add(target_name)
+        self._append({
+            'event': EVENT_MOVE,
+            'target': target_name,
+            'target_id': target_id,
+            'project': project_id,
+            'org': org_id
+        })
+
+    def record_moves(self, target_name, target_id, project_ids, org_id):
+        """Record a batch of moves of one target's projects, appended together"""
+        self.moved_projects.update(project_ids)
+        self.moved_targets.add(target_name)
+        self._append(*[{
+            'event': EVENT_MOVE,
+            'target': target_name,
+            'target_id': target_id,
+            'project': project_id,
+            'org': org_id
+        } for project_id in project_ids])
+
+    def record_delete(self, target_name, target_id):
+        self.deleted_targets.add(target_name)
+        self._append({
+            'event': EVENT_DELETE,
+            'target': target_name,
+            'target_id': target_id
+        })
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                self._sync()
+                os.close(self.fd)
+                self.fd = None
+
+    def _append(self, *records):
+        now = datetime.now(timezone.utc).isoformat()
+        lines = []
+
+        for record in records:
+            record['source_org'] = self.source_org
+            record['time'] = now
+            lines.append(json.dumps(record) + '\n')
+
+        with self.lock:
+            if self.fd is None:
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+            self.unsynced.extend(lines)
+
+            if len(self.unsynced) >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_seconds:
+                self._sync()
+
+    def _sync(self):
+        if self.unsynced:
+            os.write(self.fd, ''.join(self.unsynced).encode('utf-8'))
+            os.fsync(self.fd)
+            self.unsynced = []
+        self.last_sync = time.monotonic()
@@ -0,0 +1,111 @@
+"""Logging for every command, written by a background thread so API workers never wait on output
+"""
+
+import json
+import logging
+import queue
+import sys
+from datetime import datetime, timezone
+from enum import Enum
+from logging.handlers import QueueHandler, QueueListener
+
+LOGGER_NAME = 'csv_to_json_api_import'
+
+class LogLevel(str, Enum):
+    DEBUG = "debug"
+    INFO = "info"
+    WARNING = "warning"
+    ERROR = "error"
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the time, level, logger, process and message
+
+    Fields passed as extra={'fields': {...}} are added to the object, so e.g. a project ID or
+    HTTP status can be filtered on without parsing the message.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.process,
+            'message': record.getMessage()
+        }
+
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+
+        return json.dumps(entry, default=str)
+
+class ConsoleHandler(logging.StreamHandler):
+    """Writes plain messages to sys.stdout as it is when the record is written
+
+    Looking up sys.stdout each time means messages go through a live progress bar's redirection
+    and show above the bar.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(logging.Formatter('%(message)s'))
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting the message to the listener thread
+
+    The arguments of a log call are strings and numbers that aren't changed afterwards, so the
+    record can be queued as it is instead of being formatted by the thread that logged it.
+    """
+
+    def prepare(self, record):
+        return record
+
+def setup_logging(level=LogLevel.INFO, log_file=None, console_level=None):
+    """Send the package's log records through a queue to a writer thread, returns the listener
+
+    Logging a record only puts it on the queue; the listener thread formats and writes it to
+    stdout and, when log_file is given, as JSON lines to that file. console_level, e.g.
+    WARNING while a progress bar shows the run, raises the level for stdout only. The
+    listener has to be stopped at exit to write out the queued records.
+    """
+    file_level = logging.getLevelName(LogLevel(level).name)
+    console_level = file_level if console_level is None else logging.getLevelName(LogLevel(console_level).name)
+
+    console = ConsoleHandler()
+    console.setLevel(console_level)
+    handlers = [console]
+
+    if log_file is not None:
+        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
+        file_handler.setLevel(file_level)
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(min(handler.level for handler in handlers))
+    logger.handlers = [_DeferredQueueHandler(log_queue)]
+    logger.propagate = False
+
+    listener.start()
+
+    return listener
+
+def set_console_level(listener, level):
+    """Change the level of stdout output while running, e.g. once a progress bar starts"""
+    for handler in listener.handlers:
+        if isinstance(handler, ConsoleHandler):
+            handler.setLevel(logging.getLevelName(LogLevel(level).name))
+
+    # records no handler writes are dropped before they are queued
+    logging.getLogger(LOGGER_NAME).setLevel(min(handler.level for handler in listener.handlers))
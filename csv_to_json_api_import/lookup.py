@@ -0,0 +1,159 @@
+"""In-memory lookup tables that replace per-row Snyk API queries
+"""
+
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from csv_to_json_api_import import snyk
+from csv_to_json_api_import.constants import TARGET_INDEX_REFRESH_SECONDS
+from csv_to_json_api_import.rows import truncate_org_name
+
+log = logging.getLogger(__name__)
+
+class TargetIndex:
+    """displayName -> target ID index of every target in an org
+
+    The index is built with one paginated walk of the org's targets. When refresh is enabled a
+    name that is not in the index triggers an incremental walk of only the targets created since
+    the last walk, at most once every TARGET_INDEX_REFRESH_SECONDS.
+    """
+
+    def __init__(self, client, org_id, refresh=True):
+        self.client = client
+        self.org_id = org_id
+        self.refresh_enabled = refresh
+
+        self.targets = {}
+        self.last_walk = None
+        self.last_walk_time = 0.0
+        self.lock = threading.Lock()
+
+    def build(self):
+        """Walk every target in the org and index them by displayName
+
+        Raises snyk.IncompleteListing if the walk fails part way.
+        """
+        self._walk(None)
+
+        log.debug("Indexed %d targets in org %s", len(self.targets), self.org_id)
+
+        return self
+
+    def get(self, target_name):
+        """Return the ID of the target with the given displayName, or None if there isn't one"""
+        target_id = self.targets.get(target_name)
+
+        if target_id is None and self.refresh_enabled:
+            with self.lock:
+                target_id = self.targets.get(target_name)
+
+                if target_id is None and time.monotonic() - self.last_walk_time >= TARGET_INDEX_REFRESH_SECONDS:
+                    try:
+                        self._walk(self.last_walk)
+                    except snyk.IncompleteListing:
+                        # the next refresh walks again from the same point
+                        pass
+
+                    target_id = self.targets.get(target_name)
+
+        if target_id is None:
+            log.warning("Did not find a target with name: %s", target_name)
+
+        return target_id
+
+    def _walk(self, created_gte):
+        walk_started = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        # set first so a failed walk isn't retried any sooner than a completed one
+        self.last_walk_time = time.monotonic()
+
+        for page in snyk.iter_target_pages(self.client, self.org_id, created_gte=created_gte):
+            for target in page:
+                # keep the first match, same as the displayName filter did
+                self.targets.setdefault(target['attributes']['displayName'], target['id'])
+
+        self.last_walk = walk_started
+
+class OrgResolver:
+    """Org name -> org ID map of every org in a group
+
+    The map is filled with one paginated walk of the group's orgs, or from an org cache file
+    written by create-orgs. A name that is not in the map is looked up on its own once; if it
+    still can't be found that is remembered, so it is never queried again.
+    """
+
+    def __init__(self, client, group_id):
+        self.client = client
+        self.group_id = group_id
+
+        self.orgs = {}
+        self.missing = set()
+        self.lock = threading.Lock()
+
+    def build(self):
+        """Walk every org in the group and map them by name
+
+        Raises snyk.IncompleteListing if the walk fails part way.
+        """
+        for page in snyk.iter_org_pages(self.client, self.group_id):
+            self._add(page)
+
+        log.debug("Resolved %d orgs in group %s", len(self.orgs), self.group_id)
+
+        return self
+
+    def load_cache(self, path):
+        """Fill the map from an org cache file instead of walking the group"""
+        with open(path, 'r', encoding='utf-8') as cache_file:
+            cache = json.load(cache_file)
+
+        if cache['group_id'] != self.group_id:
+            raise ValueError(f"{path} caches the orgs of group {cache['group_id']}, not {self.group_id}")
+
+        self.orgs.update(cache['orgs'])
+
+        log.debug("Loaded %d orgs in group %s from %s", len(self.orgs), self.group_id, path)
+
+        return self
+
+    def write_cache(self, path):
+        with open(path, 'w', encoding='utf-8') as cache_file:
+            cache_file.write(json.dumps({'group_id': self.group_id, 'orgs': self.orgs}, indent=4))
+
+    def add(self, org_name, org_id):
+        with self.lock:
+            self.orgs[truncate_org_name(org_name)] = org_id
+            self.missing.discard(truncate_org_name(org_name))
+
+    def get(self, org_name):
+        """Return the ID of the org with the given name, or None if there isn't one"""
+        org_name = truncate_org_name(org_name)
+
+        org_id = self.orgs.get(org_name)
+
+        if org_id is None and org_name not in self.missing:
+            with self.lock:
+                org_id = self.orgs.get(org_name)
+
+                if org_id is None and org_name not in self.missing:
+                    try:
+                        for page in snyk.iter_org_pages(self.client, self.group_id, org_name=org_name):
+                            self._add(page)
+                    except snyk.IncompleteListing:
+                        # not remembered as missing, the lookup failed rather than found nothing
+                        return self.orgs.get(org_name)
+
+                    org_id = self.orgs.get(org_name)
+
+                    if org_id is None:
+                        log.warning("Did not find an org with name: %s", org_name)
+                        self.missing.add(org_name)
+                        self.client.invalidate_org_lookup(self.group_id, org_name)
+
+        return org_id
+
+    def _add(self, orgs):
+        for org in orgs:
+            self.orgs.setdefault(truncate_org_name(org['attributes']['name']), org['id'])
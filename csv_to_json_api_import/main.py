@@ -5,32 +5,50 @@
 
 import csv
 import json
-from datetime import datetime
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import List
 
 import typer
-from rich import print
 from typing_extensions import Annotated
 
-from csv_to_json_api_import import snyk
+# the API clients and what only API calls need are imported by the commands that use them, so
+# org-json and --help start without the network stack
+from csv_to_json_api_import.constants import (
+    ADAPTIVE_CONCURRENCY_MAX, ORG_NAME_MAX_LENGTH, RESPONSE_CACHE_TTL_SECONDS, SNYK_API_ENDPOINTS,
+    SNYK_API_POOL_SIZE_DEFAULT, SNYK_API_RATE_LIMIT_DEFAULT)
+from csv_to_json_api_import.log import LogLevel, set_console_level, setup_logging
+from csv_to_json_api_import.rows import column_indexes, make_row, read_header, read_rows, truncate_org_name
 
 # ===== CONSTANTS =====
 
-UNKNOWN_ORG_NAME = "Unknown Asset ID"
-
 ORGS_JSON_OUTPUT_FILE = "new-orgs.json"
 
-# csv file columns
-COL_TECH_ORG        = 0
-COL_ASSET_ID        = 1
-COL_ASSET_NAME      = 2
-COL_REPO_URL        = 3
-COL_TARGET_NAME     = 4
-COL_REPO_COUNT      = 5
+ORG_CACHE_FILE = "org-cache.json"
+
+MIGRATION_JOURNAL_FILE = "migration-journal.jsonl"
+
+MIGRATION_PLAN_FILE = "migration.plan"
+
+# written next to the extract-remaining-targets output, to update it incrementally next time
+EXTRACT_STATE_SUFFIX = ".state.json"
+
+# plans older than this may miss projects added since, running one prints a warning
+PLAN_STALE_HOURS = 24
+
+class Backend(str, Enum):
+    THREADS  = "threads"
+    ASYNC    = "async"
+    PIPELINE = "pipeline"
 
 # ===== GLOBALS =====
 
 app = typer.Typer(add_completion=False)
-state = {"verbose": False}
+state = {"verbose": False, "api_url": None, "log_level": LogLevel.INFO, "log_listener": None}
+
+log = logging.getLogger(__name__)
 
 # ===== METHODS =====
 
@@ -55,55 +73,317 @@ def org_json(
                 help='Path to CSV file that will be used to created JSON org structure',
                 envvar='CSV_PATH')]):
 
-    new_orgs = []
-    output_json = { "orgs": [] }
+    _check_csv(csv_path)
 
-    with open(csv_path, 'r') as csv_file:
-        csv_reader = csv.reader(csv_file)
+    orgs_written = _write_orgs_json(ORGS_JSON_OUTPUT_FILE, _iter_new_orgs(csv_path, group_id, template_org))
 
-        # skip the header
-        next(csv_reader, None)
+    log.info("Wrote %s orgs to %s", orgs_written, ORGS_JSON_OUTPUT_FILE)
 
-        for row in csv_reader:
+    return
 
-            if state['verbose']:
-                print(row)
+def _iter_new_orgs(csv_path, group_id, template_org):
+    """Lazily yield the org object of every distinct destination org in the CSV, in order of first use"""
+    org_names = set()
 
-            new_org_name = ''
+    for row in read_rows(csv_path):
+        log.debug("%s", row)
 
-            if row[COL_ASSET_ID] == '' or row[COL_ASSET_NAME] == '':
-                new_org_name = UNKNOWN_ORG_NAME
-            else:
-                new_org_name = row[COL_ASSET_ID] + '_' + row[COL_ASSET_NAME]
+        new_org_name = row.org_name
 
-            if len(new_org_name) > 60:
-                print(f"Org name too long: {new_org_name}")
-                new_org_name = new_org_name[:60]
-                print(f"Shortening to: {new_org_name}")
+        if len(new_org_name) > ORG_NAME_MAX_LENGTH:
+            log.info("Org name too long: %s", new_org_name)
+            new_org_name = truncate_org_name(new_org_name)
+            log.info("Shortening to: %s", new_org_name)
 
-            if new_org_name not in new_orgs:
-                new_orgs.append(new_org_name)
+        if new_org_name in org_names:
+            continue
 
-        for org in new_orgs:
-            new_org_object = {
-                "name": org,
-                "groupId": group_id,
-                "sourceOrgId": template_org
-            }
+        org_names.add(new_org_name)
 
-            output_json["orgs"].append(new_org_object)
+        new_org_object = {
+            "name": new_org_name,
+            "groupId": group_id,
+            "sourceOrgId": template_org
+        }
 
-    if state['verbose']:
-        print(output_json)
+        log.debug("%s", new_org_object)
 
-    with open(ORGS_JSON_OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        f.write(json.dumps(output_json, indent=4))
-        f.close()
+        yield new_org_object
 
-    return
+def _write_orgs_json(path, orgs):
+    """Write {"orgs": [...]} one org at a time as orgs are yielded, returns how many were written
+
+    The output is the same as json.dumps with indent=4, without holding the whole list in memory.
+    """
+    orgs_written = 0
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{\n    "orgs": [')
+
+        for org in orgs:
+            f.write(',\n' if orgs_written else '\n')
+            f.write('        ' + json.dumps(org, indent=4).replace('\n', '\n        '))
+            orgs_written += 1
+
+        f.write('\n    ]\n}' if orgs_written else ']\n}')
+
+    return orgs_written
+
+@app.command('create-orgs')
+def create_orgs(
+    snyk_token:
+        Annotated[
+            str,
+            typer.Argument(
+                help='Snyk API token',
+                envvar='SNYK_TOKEN')],
+    group_id:
+        Annotated[
+            str,
+            typer.Argument(
+                help='Group ID in Snyk',
+                envvar='GROUP_ID')],
+    template_org:
+        Annotated[
+            str,
+            typer.Argument(
+                help='Org in Snyk to copy integrations from',
+                envvar='TEMPLATE_ORG')],
+    csv_path:
+        Annotated[
+            str,
+            typer.Option(
+                help='Path to CSV file to read the destination orgs from',
+                envvar='CSV_PATH')],
+    org_cache:
+        Annotated[
+            str,
+            typer.Option(
+                help="File to write the name to ID map of every org in the group to, for migrate-projects --org-cache")] = ORG_CACHE_FILE,
+    dry_run:
+        Annotated[
+            bool,
+            typer.Option(
+                help="Print the orgs that would be created only")] = False,
+    concurrency:
+        Annotated[
+            int,
+            typer.Option(
+                help="Number of orgs to create in parallel")] = 1,
+    pool_size:
+        Annotated[
+            int,
+            typer.Option(
+                help="Number of keep-alive connections to hold open to the Snyk API")] = SNYK_API_POOL_SIZE_DEFAULT,
+    rate_limit:
+        Annotated[
+            float,
+            typer.Option(
+                help="Maximum Snyk API requests per second across all workers, 0 for no limit")] = SNYK_API_RATE_LIMIT_DEFAULT):
+    """Create the CSV's destination orgs that don't exist in the group yet"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from csv_to_json_api_import import snyk
+    from csv_to_json_api_import.lookup import OrgResolver
+
+    start_time = datetime.now()
+
+    if concurrency < 1:
+        raise typer.BadParameter('must be at least 1', param_hint='--concurrency')
+
+    _check_csv(csv_path)
+
+    # insertion ordered set of org names, named the same way as org-json
+    org_names = {truncate_org_name(row.org_name): None for row in read_rows(csv_path)}
+
+    client = snyk.SnykClient(snyk_token, pool_size=pool_size, rate_limit=rate_limit, api_url=state['api_url'])
+
+    log.info("Fetching orgs in group %s", group_id)
+    try:
+        orgs = OrgResolver(client, group_id).build()
+    except snyk.IncompleteListing as e:
+        client.close()
+        # orgs that weren't listed would be created again, and creating an org isn't idempotent
+        log.error("Could not fetch every org in group %s, no orgs were created, %s", group_id, e)
+        raise typer.Exit(code=1)
+
+    missing_orgs = [org_name for org_name in org_names if org_name not in orgs.orgs]
+
+    log.info("%s orgs in %s, %s already exist, %s to create", len(org_names), csv_path, len(org_names) - len(missing_orgs), len(missing_orgs))
+
+    def create_org(org_name):
+        if dry_run:
+            log.info("Would create org: %s", org_name)
+            return False
+
+        org_id = snyk.create_org(client, group_id, org_name, template_org, verbose=state['verbose'])
+
+        if org_id is not None:
+            orgs.add(org_name, org_id)
+
+        return org_id is not None
+
+    try:
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='create') as create_pool:
+                created = list(create_pool.map(create_org, missing_orgs))
+        else:
+            created = [create_org(org_name) for org_name in missing_orgs]
+    finally:
+        client.close()
+
+    orgs_created = sum(created)
+
+    if not dry_run:
+        orgs.write_cache(org_cache)
+        log.info("Wrote %s orgs to %s", len(orgs.orgs), org_cache)
+
+    log.info("Finished, created %s of %s orgs, took %s", orgs_created, len(missing_orgs), datetime.now() - start_time)
+
+    if not dry_run and orgs_created < len(missing_orgs):
+        raise typer.Exit(code=1)
+
+@app.command('plan')
+def plan_migration(
+    snyk_token:
+        Annotated[
+            str,
+            typer.Argument(
+                help='Snyk API token',
+                envvar='SNYK_TOKEN')],
+    group_id:
+        Annotated[
+            str,
+            typer.Argument(
+                help='Group ID in Snyk',
+                envvar='GROUP_ID')],
+    source_org:
+        Annotated[
+            str,
+            typer.Argument(
+                help='Org in Snyk to move projects out of',
+                envvar='SOURCE_ORG')],
+    csv_path:
+        Annotated[
+            str,
+            typer.Option(
+                help='Path to CSV file to plan the migration of',
+                envvar='CSV_PATH')],
+    plan_path:
+        Annotated[
+            str,
+            typer.Option(
+                '--plan',
+                help="File to write the plan to, run it with migrate-projects --plan")] = MIGRATION_PLAN_FILE,
+    concurrency:
+        Annotated[
+            int,
+            typer.Option(
+                help="Number of targets to list the projects of in parallel")] = 1,
+    pool_size:
+        Annotated[
+            int,
+            typer.Option(
+                help="Number of keep-alive connections to hold open to the Snyk API")] = SNYK_API_POOL_SIZE_DEFAULT,
+    rate_limit:
+        Annotated[
+            float,
+            typer.Option(
+                help="Maximum Snyk API requests per second across all workers, 0 for no limit")] = SNYK_API_RATE_LIMIT_DEFAULT,
+    org_cache:
+        Annotated[
+            str,
+            typer.Option(
+                help="Load the group's org name to ID map from a file written by create-orgs instead of fetching it")] = None):
+    """Resolve every row's target, projects and destination org into a plan file"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from csv_to_json_api_import import snyk
+    from csv_to_json_api_import.lookup import OrgResolver, TargetIndex
+    from csv_to_json_api_import.pipeline import map_bounded
+    from csv_to_json_api_import.plan import Plan, write_plan
+
+    start_time = datetime.now()
+
+    if concurrency < 1:
+        raise typer.BadParameter('must be at least 1', param_hint='--concurrency')
+
+    _check_csv(csv_path)
+
+    client = snyk.SnykClient(snyk_token, pool_size=pool_size, rate_limit=rate_limit, api_url=state['api_url'])
+
+    orgs = OrgResolver(client, group_id)
+
+    if org_cache is not None:
+        log.info("Loading orgs in group %s from %s", group_id, org_cache)
+        try:
+            orgs.load_cache(org_cache)
+        except ValueError as e:
+            raise typer.BadParameter(str(e), param_hint='--org-cache')
+
+    def list_projects(row):
+        target_id = targets.get(row.target_name)
+
+        if target_id is None:
+            return None, []
+
+        project_ids = snyk.get_projects_from_target(client, source_org, target_id)
+
+        # a plan is only run as it was compiled, so it can't leave projects out
+        if project_ids is None:
+            raise snyk.IncompleteListing(f"the projects of target {row.target_name}", client.last_status())
+
+        return target_id, project_ids
+
+    row_pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='plan') if concurrency > 1 else None
+
+    # destination org name -> planned rows, in CSV order of each org's first row
+    groups = {}
+
+    try:
+        log.info("Indexing targets in org %s", source_org)
+        targets = TargetIndex(client, source_org, refresh=False).build()
+
+        if org_cache is None:
+            log.info("Fetching orgs in group %s", group_id)
+            orgs.build()
+
+        # results come back in completion order, the line number puts them back in CSV order
+        listed = map_bounded(row_pool, lambda item: list_projects(item[1]), enumerate(read_rows(csv_path)), concurrency * 2)
+
+        for (_, row), (target_id, project_ids) in sorted(listed, key=lambda result: result[0][0]):
+            groups.setdefault(truncate_org_name(row.org_name), []).append((row.target_name, target_id, project_ids, row.values))
+
+        org_ids = {org_name: orgs.get(org_name) for org_name in groups}
+    except snyk.IncompleteListing as e:
+        log.error("Could not compile a plan, %s", e)
+        raise typer.Exit(code=1)
+    finally:
+        if row_pool is not None:
+            row_pool.shutdown()
+
+        client.close()
+
+    meta = {
+        'group_id': group_id,
+        'source_org': source_org,
+        'csv_path': csv_path,
+        'compiled': start_time.isoformat()
+    }
+
+    write_plan(plan_path, meta, read_header(csv_path), [(org_name, org_ids[org_name], rows) for org_name, rows in groups.items()])
+
+    plan = Plan(plan_path)
+    try:
+        _print_plan(plan)
+    finally:
+        plan.close()
+
+    log.info("Finished, plan written to %s, took %s", plan_path, datetime.now() - start_time)
 
 @app.command('migrate-projects')
 def migrate_projects(
+    ctx: typer.Context,
     snyk_token:
         Annotated[
             str,
@@ -126,13 +406,13 @@ def migrate_projects(
         Annotated[
             str,
             typer.Option(
-                help='Path to CSV file that will be used to created JSON org structure',
-                envvar='CSV_PATH')],
+                help='Path to CSV file that will be used to created JSON org structure, not needed with --plan',
+                envvar='CSV_PATH')] = None,
     skip_lines:
         Annotated[
             int,
             typer.Option(
-                help='Number of lines to skip ahead in the csv file')] = 0,
+                help='Number of lines to skip ahead in the csv file, prefer --shard or --resume to split or restart a run')] = 0,
     dry_run:
         Annotated[
             bool,
@@ -142,90 +422,513 @@ def migrate_projects(
         Annotated[
             str,
             typer.Option(
-                help="File to output errored entries to")] = None):
+                help="File to output errored entries to")] = None,
+    concurrency:
+        Annotated[
+            int,
+            typer.Option(
+                help="Number of CSV rows (and project moves within a row) to process in parallel")] = 1,
+    pool_size:
+        Annotated[
+            int,
+            typer.Option(
+                help="Number of keep-alive connections to hold open to the Snyk API")] = SNYK_API_POOL_SIZE_DEFAULT,
+    target_index:
+        Annotated[
+            bool,
+            typer.Option(
+                help="Index all source org targets up front instead of looking up each row's target by name")] = True,
+    refresh_target_index:
+        Annotated[
+            bool,
+            typer.Option(
+                help="Fetch newly created targets when a row's target is not in the index")] = True,
+    prefetch_orgs:
+        Annotated[
+            bool,
+            typer.Option(
+                help="Map all group org names to IDs up front instead of looking up each row's org by name")] = True,
+    org_cache:
+        Annotated[
+            str,
+            typer.Option(
+                help="Load the group's org name to ID map from a file written by create-orgs instead of fetching it")] = None,
+    rate_limit:
+        Annotated[
+            float,
+            typer.Option(
+                help="Maximum Snyk API requests per second across all workers, 0 for no limit")] = SNYK_API_RATE_LIMIT_DEFAULT,
+    journal_path:
+        Annotated[
+            str,
+            typer.Option(
+                help="File to record completed project moves and target deletions to")] = MIGRATION_JOURNAL_FILE,
+    resume:
+        Annotated[
+            bool,
+            typer.Option(
+                help="Skip work already recorded as completed in the journal")] = False,
+    response_cache:
+        Annotated[
+            str,
+            typer.Option(
+                help="SQLite file to cache GET responses in across runs, e.g. a dry run then the real run. Moves and deletions drop the entries they make stale")] = None,
+    response_cache_ttl:
+        Annotated[
+            int,
+            typer.Option(
+                help="Seconds a cached response stays fresh")] = RESPONSE_CACHE_TTL_SECONDS,
+    metrics_json:
+        Annotated[
+            str,
+            typer.Option(
+                help="File to write API call counts, statuses, retries and latencies to as JSON at exit")] = None,
+    progress:
+        Annotated[
+            bool,
+            typer.Option(
+                help="Show a live progress bar with rows/sec and ETA")] = False,
+    backend:
+        Annotated[
+            Backend,
+            typer.Option(
+                help="Run API calls on a thread pool, on an asyncio event loop (requires httpx), or as a pipeline with a thread pool per API call")] = Backend.THREADS,
+    endpoint_limit:
+        Annotated[
+            List[str],
+            typer.Option(
+                help="Async and pipeline backends only, maximum in-flight calls to one endpoint as NAME=N, NAME is one of: " + ', '.join(SNYK_API_ENDPOINTS) + ". Defaults to --concurrency")] = None,
+    adaptive_moves:
+        Annotated[
+            bool,
+            typer.Option(
+                help="Tune the number of project moves in flight while running, starting from --concurrency (or the move endpoint limit), raising it while the API keeps up and halving it on 429s, 5xx responses or slowdowns")] = False,
+    max_move_concurrency:
+        Annotated[
+            int,
+            typer.Option(
+                help="With --adaptive-moves, the most project moves to have in flight")] = ADAPTIVE_CONCURRENCY_MAX,
+    batch_moves:
+        Annotated[
+            bool,
+            typer.Option(
+                help="Threads backend only, move each row's projects as one batch, printing a summary per batch instead of lines per project")] = False,
+    verify:
+        Annotated[
+            bool,
+            typer.Option(
+                help="List every target's projects again after moving them, to check it is empty before deleting it, always on with --plan")] = False,
+    verify_sample:
+        Annotated[
+            float,
+            typer.Option(
+                help="Fraction of targets to list again after moving their projects, between 0 and 1")] = 0.0,
+    defer_deletes:
+        Annotated[
+            bool,
+            typer.Option(
+                help="Delete emptied targets in a cleanup phase after all rows are migrated")] = False,
+    shard:
+        Annotated[
+            str,
+            typer.Option(
+                help="Only migrate the rows of shard I out of N, given as I/N. Rows are partitioned by a stable hash of their destination org")] = None,
+    shards:
+        Annotated[
+            int,
+            typer.Option(
+                help="Run N worker processes, one per shard, and merge their results")] = 1,
+    shard_tokens_file:
+        Annotated[
+            str,
+            typer.Option(
+                help="With --shards, file of Snyk API tokens, one per line, handed out to the workers in turn. --rate-limit applies per token")] = None,
+    summary_json:
+        Annotated[
+            str,
+            typer.Option(
+                help="File to write the row and project totals to as JSON at exit")] = None,
+    plan_path:
+        Annotated[
+            str,
+            typer.Option(
+                '--plan',
+                help="Run a plan compiled by the plan command instead of reading the CSV, no lookups are made. With --dry-run the plan is printed")] = None):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    from csv_to_json_api_import import migrate, snyk
+    from csv_to_json_api_import.concurrency import AdaptiveLimit
+    from csv_to_json_api_import.failures import FailureSink
+    from csv_to_json_api_import.journal import Journal
+    from csv_to_json_api_import.lookup import OrgResolver, TargetIndex
+    from csv_to_json_api_import.metrics import Metrics
+    from csv_to_json_api_import.pipeline import map_bounded
+    from csv_to_json_api_import.shards import parse_shard, read_tokens, run_shards, shard_of
 
     start_time = datetime.now()
     projects_migrated_total = 0
+    rows_resumed = 0
+    rows_failed = 0
+    rows_total = 0
 
-    with open(csv_path) as csv_file:
-        csv_reader = csv.reader(csv_file)
+    if concurrency < 1:
+        raise typer.BadParameter('must be at least 1', param_hint='--concurrency')
 
-        # skip the header
-        next(csv_reader, None)
+    if csv_path is None and plan_path is None:
+        raise typer.BadParameter('is required without --plan', param_hint='--csv-path')
 
-        if skip_lines != 0:
-            print(f"Skipping ahead {skip_lines} lines")
-            for _ in range(skip_lines):
-                next(csv_reader, None)
+    if plan_path is None:
+        _check_csv(csv_path)
 
-        for row in csv_reader:
+    if plan_path is not None and backend != Backend.THREADS:
+        raise typer.BadParameter('plans run on the threads backend', param_hint='--backend')
 
-            # get target id using asset name
-            target_id = snyk.get_target_id_from_name(snyk_token, source_org, row[COL_TARGET_NAME], verbose=state['verbose'])
+    if batch_moves and backend != Backend.THREADS:
+        raise typer.BadParameter('batches run on the threads backend', param_hint='--backend')
 
-            if state['verbose']:
-                print(f"Name: {row[COL_ASSET_NAME]}, Target ID: {target_id}")
+    if max_move_concurrency < 1:
+        raise typer.BadParameter('must be at least 1', param_hint='--max-move-concurrency')
 
-            if target_id is not None:
-                # get projects using target id as a filter
+    endpoint_limits = _parse_endpoint_limits(endpoint_limit, concurrency)
 
-                project_ids = snyk.get_projects_from_target(snyk_token, source_org, target_id)
+    shard_index, shard_count = 1, 1
 
-                if state['verbose']:
-                    print(f"Project IDs for {row[COL_TARGET_NAME]}: {project_ids}")
+    if shard is not None:
+        try:
+            shard_index, shard_count = parse_shard(shard)
+        except ValueError as e:
+            raise typer.BadParameter(str(e), param_hint='--shard')
 
-                if len(project_ids) > 0:
-                    # get org id of destination org
-                    org_name = ''
+    if shards > 1:
+        if shard is not None:
+            raise typer.BadParameter('cannot be combined with --shard', param_hint='--shards')
 
-                    if row[COL_ASSET_ID] == '' or row[COL_ASSET_NAME] == '':
-                        org_name = UNKNOWN_ORG_NAME
-                    else:
-                        org_name = row[COL_ASSET_ID] + '_' + row[COL_ASSET_NAME]
+        tokens = read_tokens(shard_tokens_file) if shard_tokens_file is not None else [snyk_token]
 
-                    if len(org_name) > 60:
-                        org_name = org_name[:60]
+        summary = run_shards(ctx, shards, tokens, group_id, source_org, rate_limit, output_csv_path, metrics_json)
 
-                    org_id = snyk.get_organization_id_from_name(snyk_token, group_id, org_name, verbose=state['verbose'])
+        log.info("Finished %s of %s shards, total projects migrated: %s, rows errored: %s, took %s", shards - len(summary['failed_shards']), shards, summary['projects_migrated'], summary['rows_failed'], datetime.now() - start_time)
 
-                    if org_id is not None:
-                        print(f"Org ID: {org_id}, Org Name: '{org_name}'")
+        if summary_json is not None:
+            _write_summary(summary_json, summary)
 
-                        num_errors = 0
-                        # move all projects to destination org
-                        for project_id in project_ids:
-                            if not snyk.move_project_to_org(snyk_token, source_org, org_id, project_id, verbose=state['verbose'], dry_run=dry_run):
-                                num_errors += 1
-                            else:
-                                projects_migrated_total += 1
+        if summary['failed_shards']:
+            raise typer.Exit(code=1)
 
-                        # clean up empty project
-                        if num_errors == 0 and not dry_run:
-                            if (len(snyk.get_projects_from_target(snyk_token, source_org, target_id)) == 0):
-                                snyk.delete_target(snyk_token, source_org, target_id, verbose=state['verbose'])
-                            else:
-                                if (output_csv_path is not None):
-                                    with open(output_csv_path, 'a') as output_csv_file:
-                                        output_csv_writer = csv.writer(output_csv_file)
-                                        output_csv_writer.writerow(row)
-                        else:
-                            if (output_csv_path is not None):
-                                with open(output_csv_path, 'a') as output_csv_file:
-                                    output_csv_writer = csv.writer(output_csv_file)
-                                    output_csv_writer.writerow(row)
+        return
 
-                    else:
-                        print(f"Could not retrieve Org ID for: {org_name}")
+    plan = None
 
-            else:
-                print(f"Could not get Target ID for: {row[COL_TARGET_NAME]}")
+    if plan_path is not None:
+        plan = _open_plan(plan_path, group_id, source_org)
+
+        if dry_run:
+            _print_plan(plan)
+            plan.close()
+            return
+
+    metrics = Metrics() if metrics_json is not None else None
+
+    client = snyk.SnykClient(snyk_token, pool_size=pool_size, rate_limit=rate_limit, api_url=state['api_url'], metrics=metrics, cache=_response_cache(response_cache, response_cache_ttl))
+
+    targets = None
+
+    if plan is not None:
+        log.info("Running plan %s: %s rows, %s projects, %s destination orgs", plan_path, plan.row_count, plan.project_count, plan.group_count)
+    elif target_index:
+        log.info("Indexing targets in org %s", source_org)
+        try:
+            targets = TargetIndex(client, source_org, refresh=refresh_target_index).build()
+        except snyk.IncompleteListing as e:
+            log.error("Could not index the targets of org %s, %s", source_org, e)
+            raise typer.Exit(code=1)
+
+    orgs = None
+
+    if org_cache is not None:
+        log.info("Loading orgs in group %s from %s", group_id, org_cache)
+        try:
+            orgs = OrgResolver(client, group_id).load_cache(org_cache)
+        except ValueError as e:
+            raise typer.BadParameter(str(e), param_hint='--org-cache')
+    elif prefetch_orgs and plan is None:
+        log.info("Fetching orgs in group %s", group_id)
+        try:
+            orgs = OrgResolver(client, group_id).build()
+        except snyk.IncompleteListing as e:
+            log.error("Could not fetch the orgs of group %s, %s", group_id, e)
+            raise typer.Exit(code=1)
+
+    # nothing is recorded in a dry run, the journal file is only created on the first record
+    journal = Journal(journal_path, source_org)
+
+    if resume:
+        journal.load()
+        log.info("Resuming from %s: %s targets and %s projects already migrated", journal_path, len(journal.deleted_targets), len(journal.moved_projects))
+
+    move_limit = None
+
+    # nothing is sent in a dry run, so there is nothing to tune
+    if adaptive_moves and not dry_run:
+        initial_moves = concurrency if backend == Backend.THREADS else endpoint_limits['move']
+        move_limit = AdaptiveLimit(initial_moves, maximum=max_move_concurrency, retry_policy=client.retry_policy)
+
+        # the limit gates the moves, the workers only have to cover its maximum
+        endpoint_limits['move'] = move_limit.maximum
+
+    row_pool = None
+    move_pool = None
+
+    if concurrency > 1 and backend == Backend.THREADS:
+        row_pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='row')
+
+    if backend == Backend.THREADS and (concurrency > 1 or move_limit is not None):
+        move_pool = ThreadPoolExecutor(max_workers=concurrency if move_limit is None else move_limit.maximum, thread_name_prefix='move')
+
+    if skip_lines != 0:
+        log.info("Skipping ahead %s lines", skip_lines)
+
+    if shard_count > 1:
+        log.info("Migrating shard %s of %s", shard_index, shard_count)
+
+    migration = migrate.Migration(
+        group_id=group_id,
+        source_org=source_org,
+        dry_run=dry_run,
+        targets=targets,
+        orgs=orgs,
+        journal=journal,
+        # a plan's project lists may be out of date, so its targets are always listed again
+        # before they are deleted
+        verify_sample=1.0 if verify or plan is not None else verify_sample,
+        deletions=[] if defer_deletes else None,
+        move_limit=move_limit,
+        batch_moves=batch_moves,
+        verbose=state['verbose'],
+        api_url=state['api_url'])
+
+    def migrate_row(item):
+        row, planned = item
+        return migrate.migrate_row(client, migration, row, move_pool, planned)
+
+    def read_items():
+        """(row, planned row) pairs, planned rows are None without a plan"""
+        if plan is None:
+            for row in read_rows(csv_path, skip_lines=skip_lines):
+                yield row, None
+        else:
+            indexes = column_indexes(plan.header, plan_path)
+            for planned in plan.rows():
+                yield make_row(planned.values, indexes), planned
+
+    def shard_rows():
+        for item in read_items():
+            if shard_count == 1 or shard_of(item[0], shard_count) == shard_index:
+                yield item
+
+    def pending_items():
+        nonlocal rows_resumed
+
+        for item in shard_rows():
+            if resume and journal.is_target_deleted(item[0].target_name):
+                rows_resumed += 1
+                continue
+
+            yield item
+
+    def pending_rows():
+        return (row for row, _ in pending_items())
+
+    failures = None
+
+    if output_csv_path is not None:
+        failures = FailureSink(output_csv_path, read_header(csv_path) if plan is None else plan.header)
+
+    progress_bar = None
+
+    if progress:
+        progress_bar = migrate.progress_bar()
+        progress_task = progress_bar.add_task(
+            "Migrating",
+            total=sum(1 for row, _ in shard_rows() if not (resume and journal.is_target_deleted(row.target_name))),
+            projects=0)
+        progress_bar.start()
+        # the bar is the live summary, only warnings are written above it
+        set_console_level(state['log_listener'], LogLevel.WARNING)
+
+    pipeline_stats = None
+
+    def record_result(row, projects_migrated, failure):
+        nonlocal projects_migrated_total, rows_failed, rows_total
+
+        projects_migrated_total += projects_migrated
+        rows_total += 1
+
+        if failure is not None:
+            rows_failed += 1
+            if failures is not None:
+                failures.add(row, *failure)
+
+        if progress_bar is not None:
+            progress_bar.update(progress_task, advance=1, projects=projects_migrated_total)
+
+    try:
+        if backend == Backend.ASYNC:
+            asyncio.run(migrate.migrate_rows_async(
+                snyk_token, migration, pending_rows(), concurrency, endpoint_limits, client, record_result))
+        elif backend == Backend.PIPELINE:
+            pipeline_stats = migrate.migrate_rows_pipelined(client, migration, pending_rows(), endpoint_limits, record_result)
+        else:
+            for (row, _), (projects_migrated, failure) in map_bounded(row_pool, migrate_row, pending_items(), concurrency * 2):
+                record_result(row, projects_migrated, failure)
+
+        if migration.deletions:
+            log.info("Cleaning up %s emptied targets", len(migration.deletions))
+
+            cleanup_pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='cleanup') if concurrency > 1 else None
+            try:
+                targets_deleted, delete_failures = migrate.delete_targets(client, migration, cleanup_pool)
+            finally:
+                if cleanup_pool is not None:
+                    cleanup_pool.shutdown()
+
+            # counted here rather than on the cleanup threads
+            for row, reason, status in delete_failures:
+                rows_failed += 1
+                if failures is not None:
+                    failures.add(row, reason, status)
+
+            log.info("Deleted %s of %s emptied targets", targets_deleted, len(migration.deletions))
+    finally:
+        if progress_bar is not None:
+            progress_bar.stop()
+            set_console_level(state['log_listener'], state['log_level'])
+
+        if failures is not None:
+            failures.close()
+
+        if row_pool is not None:
+            row_pool.shutdown()
+
+        if move_pool is not None:
+            move_pool.shutdown()
 
-            print("")
+        journal.close()
 
-    print(f"Finished, total projects migrated: {projects_migrated_total}, took {datetime.now() - start_time}")
+        if plan is not None:
+            plan.close()
+
+        pool_stats = client.pool_stats()
+        client.close()
+
+    log.info("Connection pool: %s requests, %s reused connections, %s new connections", pool_stats['requests'], pool_stats['hits'], pool_stats['misses'])
+    log.info("Rate limiter: %.1f seconds spent throttled", client.rate_limiter.throttled_seconds)
+    if pipeline_stats is not None:
+        for name, stage in pipeline_stats.items():
+            log.info("Stage %s: %s workers, %s items, %.0f%% busy, queue depth mean %.1f max %s", name, stage['workers'], stage['items'], stage['utilization'] * 100, stage['queue_depth_mean'], stage['queue_depth_max'])
+    _print_cache_stats(client)
+    retry_stats = client.retry_stats()
+    log.info("Retries: %s of %s requests, %s refused by the retry budget, circuit breaker opened %s times", retry_stats['retries'], retry_stats['requests'], retry_stats['refused'], retry_stats['circuit_opened'])
+    move_concurrency = None
+    if move_limit is not None:
+        move_concurrency = move_limit.stats()
+        log.info("Adaptive moves: ended at %s in flight (between %s and %s), %s changes, cut %s times for 429s or errors and %s times for latency", move_concurrency['limit'], move_concurrency['min'], move_concurrency['max'], len(move_concurrency['history']) - 1, move_concurrency['cuts']['congestion'], move_concurrency['cuts']['latency'])
+    if resume:
+        log.info("Skipped %s rows already completed in %s", rows_resumed, journal_path)
+    log.info("Finished, total projects migrated: %s, took %s", projects_migrated_total, datetime.now() - start_time)
+
+    if metrics is not None:
+        metrics.dump(metrics_json, client.rate_limiter.throttled_seconds, {
+            'rows': rows_total,
+            'rows_resumed': rows_resumed,
+            'projects_migrated': projects_migrated_total,
+            'connection_pool': pool_stats,
+            'retries': retry_stats,
+            'pipeline': pipeline_stats,
+            'move_concurrency': move_concurrency
+        })
+        log.info("Metrics written to %s", metrics_json)
+
+    if summary_json is not None:
+        _write_summary(summary_json, {
+            'shard': f"{shard_index}/{shard_count}",
+            'rows': rows_total,
+            'rows_resumed': rows_resumed,
+            'rows_failed': rows_failed,
+            'projects_migrated': projects_migrated_total,
+            'move_concurrency': move_concurrency
+        })
 
     return
 
+def _check_csv(csv_path):
+    """Fail the command with a usage error unless the CSV has every column a row is made from"""
+    try:
+        column_indexes(read_header(csv_path), csv_path)
+    except ValueError as e:
+        raise typer.BadParameter(str(e), param_hint='--csv-path')
+
+def _response_cache(path, ttl):
+    if path is None:
+        return None
+
+    from csv_to_json_api_import.cache import ResponseCache
+
+    return ResponseCache(path, ttl=ttl)
+
+def _print_cache_stats(client):
+    if client.cache is not None:
+        cache_stats = client.cache.stats()
+        log.info("Response cache: %s hits, %s misses", cache_stats['hits'], cache_stats['misses'])
+
+def _open_plan(plan_path, group_id, source_org):
+    from csv_to_json_api_import.plan import Plan
+
+    try:
+        plan = Plan(plan_path)
+    except ValueError as e:
+        raise typer.BadParameter(str(e), param_hint='--plan')
+
+    if plan.meta['group_id'] != group_id or plan.meta['source_org'] != source_org:
+        plan.close()
+        raise typer.BadParameter(f"{plan_path} was compiled for group {plan.meta['group_id']} and source org {plan.meta['source_org']}", param_hint='--plan')
+
+    compiled = datetime.fromisoformat(plan.meta['compiled'])
+    if datetime.now() - compiled > timedelta(hours=PLAN_STALE_HOURS):
+        log.warning("Plan %s was compiled %s, projects added since then are not moved and their targets are kept", plan_path, compiled)
+
+    return plan
+
+def _print_plan(plan):
+    missing_targets = 0
+
+    for planned in plan.rows():
+        if not planned.target_id:
+            missing_targets += 1
+
+    for group in plan.groups():
+        log.info("Org: '%s', Org ID: %s, %s rows, %s projects", group.org_name, group.org_id or 'NOT FOUND', group.rows, group.projects)
+
+    log.info("Plan compiled %s from %s: %s rows, %s projects to move into %s orgs, %s targets not found", plan.meta['compiled'], plan.meta['csv_path'], plan.row_count, plan.project_count, plan.group_count, missing_targets)
+
+def _write_summary(path, summary):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(summary, indent=4))
+
+def _parse_endpoint_limits(endpoint_limit, default):
+    endpoint_limits = {endpoint: default for endpoint in SNYK_API_ENDPOINTS}
+
+    for limit in endpoint_limit or []:
+        endpoint, _, value = limit.partition('=')
+
+        if endpoint not in endpoint_limits or not value.isdigit() or int(value) < 1:
+            raise typer.BadParameter(f"expected NAME=N with NAME one of {', '.join(SNYK_API_ENDPOINTS)}, got '{limit}'", param_hint='--endpoint-limit')
+
+        endpoint_limits[endpoint] = int(value)
+
+    return endpoint_limits
+
 @app.command('extract-remaining-targets')
 def extract_remaining_targets(
     snyk_token:
@@ -250,31 +953,202 @@ def extract_remaining_targets(
         Annotated[
             str,
             typer.Option(
-                help="File to output remaining entries to")] = None):
+                help="File to output remaining entries to")] = None,
+    pool_size:
+        Annotated[
+            int,
+            typer.Option(
+                help="Number of keep-alive connections to hold open to the Snyk API")] = SNYK_API_POOL_SIZE_DEFAULT,
+    rate_limit:
+        Annotated[
+            float,
+            typer.Option(
+                help="Maximum Snyk API requests per second across all workers, 0 for no limit")] = SNYK_API_RATE_LIMIT_DEFAULT,
+    stream_targets:
+        Annotated[
+            bool,
+            typer.Option(
+                help="Index the CSV rows and write matches as each page of targets arrives, instead of collecting all target names first")] = False,
+    response_cache:
+        Annotated[
+            str,
+            typer.Option(
+                help="SQLite file to cache GET responses in across runs, e.g. a dry run then the real run. Moves and deletions drop the entries they make stale")] = None,
+    response_cache_ttl:
+        Annotated[
+            int,
+            typer.Option(
+                help="Seconds a cached response stays fresh")] = RESPONSE_CACHE_TTL_SECONDS,
+    metrics_json:
+        Annotated[
+            str,
+            typer.Option(
+                help="File to write API call counts, statuses, retries and latencies to as JSON at exit")] = None,
+    journal_path:
+        Annotated[
+            str,
+            typer.Option(
+                help="Journal written by migrate-projects, used to update the previous output without scanning the whole org")] = MIGRATION_JOURNAL_FILE,
+    full:
+        Annotated[
+            bool,
+            typer.Option(
+                help="Scan every target in the source org instead of updating the previous output incrementally")] = False):
+    from csv_to_json_api_import import snyk
+    from csv_to_json_api_import.metrics import Metrics
+
+    _check_csv(csv_path)
+
+    metrics = Metrics() if metrics_json is not None else None
+
+    client = snyk.SnykClient(snyk_token, pool_size=pool_size, rate_limit=rate_limit, api_url=state['api_url'], metrics=metrics, cache=_response_cache(response_cache, response_cache_ttl))
+
+    remaining_total = 0
+
+    state_path = f"{output_csv_path}{EXTRACT_STATE_SUFFIX}"
+    scan_started = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    remaining_targets = None
+
+    try:
+        if not full:
+            remaining_targets = _incremental_remaining_targets(client, source_org, csv_path, output_csv_path, state_path, journal_path)
+
+        # the previous output has been read, it can be overwritten now
+        with open(output_csv_path, 'w', newline='') as output_csv_file:
+            output_csv_writer = csv.writer(output_csv_file)
+            output_csv_writer.writerow(read_header(csv_path))
+
+            if remaining_targets is not None:
+                for row in read_rows(csv_path):
+                    if row.target_name in remaining_targets:
+                        output_csv_writer.writerow(row.values)
+                        remaining_total += 1
+            elif stream_targets:
+                # target name -> rows, rows are removed once written so each is only written once
+                rows_by_target = {}
+                for row in read_rows(csv_path):
+                    rows_by_target.setdefault(row.target_name, []).append(row)
+
+                for page in snyk.iter_target_pages(client, source_org, verbose=state['verbose']):
+                    for target in page:
+                        for row in rows_by_target.pop(target['attributes']['displayName'], ()):
+                            output_csv_writer.writerow(row.values)
+                            remaining_total += 1
+            else:
+                target_names = set()
+                for page in snyk.iter_target_pages(client, source_org, verbose=state['verbose']):
+                    target_names.update(target['attributes']['displayName'] for target in page)
+
+                for row in read_rows(csv_path):
+                    if row.target_name in target_names:
+                        output_csv_writer.writerow(row.values)
+                        remaining_total += 1
+    except snyk.IncompleteListing as e:
+        client.close()
+
+        # the output may be missing targets, so the next run scans the whole org again
+        if os.path.exists(state_path):
+            os.remove(state_path)
+
+        log.error("Could not list the remaining targets, %s", e)
+        raise typer.Exit(code=1)
+
+    client.close()
+
+    with open(state_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'source_org': source_org, 'csv_path': os.path.abspath(csv_path), 'scanned': scan_started}, indent=4))
+
+    _print_cache_stats(client)
+    log.info("Finished, %s remaining targets written to %s", remaining_total, output_csv_path)
 
-    targets = snyk.get_all_non_empty_targets(snyk_token, source_org)
+    if metrics is not None:
+        metrics.dump(metrics_json, client.rate_limiter.throttled_seconds, {'remaining': remaining_total, 'incremental': remaining_targets is not None})
+        log.info("Metrics written to %s", metrics_json)
 
-    with open(output_csv_path, 'w') as output_csv_file:
-        output_csv_writer = csv.writer(output_csv_file)
-        output_csv_writer.writerow(["Tech Org","Asset ID","Asset Name","Repo URL","Project Name","Repo Count"])
+def _incremental_remaining_targets(client, source_org, csv_path, output_csv_path, state_path, journal_path):
+    """Work out the remaining targets from the previous output instead of scanning the org
 
-    with open(csv_path) as csv_file:
-        csv_reader = csv.reader(csv_file)
+    Starts from the targets in the previous output, drops those the journal records as
+    deleted, and looks up only the ones with moves but no deletion recorded, whose deletion
+    may have been lost in a crash. Targets whose lookup fails are kept. Targets created since the previous scan are added with one
+    walk of just the new targets. Returns the set of remaining target names, or None when a
+    full scan is needed because there is no previous output for this org and CSV file.
+    """
+    from csv_to_json_api_import import snyk
+    from csv_to_json_api_import.journal import Journal
+
+    if not os.path.exists(output_csv_path) or not os.path.exists(state_path):
+        log.info("No previous output in %s, scanning every target in org %s", output_csv_path, source_org)
+        return None
+
+    with open(state_path, 'r', encoding='utf-8') as f:
+        previous = json.load(f)
+
+    if previous['source_org'] != source_org:
+        log.info("%s lists targets of org %s, scanning every target in org %s", output_csv_path, previous['source_org'], source_org)
+        return None
+
+    if previous['csv_path'] != os.path.abspath(csv_path):
+        log.info("%s was made from %s, scanning every target in org %s", output_csv_path, previous['csv_path'], source_org)
+        return None
+
+    previous_targets = {row.target_name for row in read_rows(output_csv_path)}
+
+    journal = Journal(journal_path, source_org).load()
+
+    remaining_targets = previous_targets - journal.deleted_targets
+    uncertain_targets = remaining_targets & journal.moved_targets
+
+    log.info("Updating %s scanned %s: %s targets, %s since deleted, %s to check", output_csv_path, previous['scanned'], len(previous_targets), len(previous_targets) - len(remaining_targets), len(uncertain_targets))
+
+    for target_name in uncertain_targets:
+        if snyk.get_target_id_from_name(client, source_org, target_name, verbose=state['verbose']) is not None:
+            continue
+
+        # only a successful lookup that found nothing means the target is gone, a failed one
+        # keeps it so it is checked again by the next run
+        if client.last_status() == 200:
+            remaining_targets.discard(target_name)
+        else:
+            log.warning("Could not check whether target %s still exists, keeping it", target_name)
 
-        # skip the header
-        next(csv_reader, None)
+    for page in snyk.iter_target_pages(client, source_org, created_gte=previous['scanned'], verbose=state['verbose']):
+        remaining_targets.update(target['attributes']['displayName'] for target in page)
 
-        for row in csv_reader:
-            for target in targets:
-                if (row[COL_TARGET_NAME] == target['attributes']['displayName']):
-                    with open(output_csv_path, 'a') as output_csv_file:
-                        output_csv_writer = csv.writer(output_csv_file)
-                        output_csv_writer.writerow(row)
+    return remaining_targets
 
 @app.callback()
-def main(verbose: bool = False):
+def main(
+    ctx: typer.Context,
+    verbose: bool = False,
+    log_level:
+        Annotated[
+            LogLevel,
+            typer.Option(
+                help="Least severe messages to output, --verbose is the same as debug")] = LogLevel.INFO,
+    log_file:
+        Annotated[
+            str,
+            typer.Option(
+                help="File to append messages to as JSON lines, with the same level")] = None,
+    api_url:
+        Annotated[
+            str,
+            typer.Option(
+                help="Base URL of the Snyk API, e.g. a local stand-in for benchmarking",
+                envvar='SNYK_API_URL',
+                hidden=True)] = None):
     if verbose:
         state['verbose'] = True
+        log_level = LogLevel.DEBUG
+
+    state['api_url'] = api_url
+    state['log_level'] = log_level
+
+    # messages are written by a background thread, which writes out what is queued on exit
+    state['log_listener'] = setup_logging(log_level, log_file)
+    ctx.call_on_close(state['log_listener'].stop)
 
 def run():
     """Run the defined typer CLI app
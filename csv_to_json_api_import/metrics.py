@@ -0,0 +1,190 @@
+"""Latency and throughput instrumentation for calls to the Snyk API
+"""
+
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+
+# name of the instrumented coroutine function an asyncio task is in, tasks share one thread so
+# the thread-local name can't be used for them
+_task_function = contextvars.ContextVar('task_function', default='unknown')
+
+class Metrics:
+    """Thread-safe counters for every instrumented API function
+
+    Records, per function, the number of calls, a histogram of the HTTP statuses of the requests
+    it made, how many of those requests were retries and the latency of each call. Time spent
+    sleeping outside of the rate limiter, e.g. waiting to retry a 403, is totalled separately.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.statuses = {}
+        self.retries = {}
+        self.latencies = {}
+        self.request_latencies = []
+        self.sleep_seconds = 0.0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+        self.local = threading.local()
+
+    def record_call(self, name, seconds):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def record_request(self, status, seconds, name=None):
+        name = name or self.current()
+
+        with self.lock:
+            histogram = self.statuses.setdefault(name, {})
+            histogram[status] = histogram.get(status, 0) + 1
+            self.request_latencies.append(seconds)
+
+    def record_retry(self, name=None):
+        name = name or self.current()
+
+        with self.lock:
+            self.retries[name] = self.retries.get(name, 0) + 1
+
+    def record_sleep(self, seconds):
+        with self.lock:
+            self.sleep_seconds += seconds
+
+    def current(self):
+        """Name of the instrumented function the calling thread is in"""
+        return getattr(self.local, 'name', 'unknown')
+
+    def current_task(self):
+        """Name of the instrumented coroutine function the calling asyncio task is in"""
+        return _task_function.get()
+
+    def summary(self, throttled_seconds=0.0):
+        with self.lock:
+            functions = {}
+
+            for name, latencies in self.latencies.items():
+                latencies = sorted(latencies)
+                functions[name] = {
+                    'calls': self.calls[name],
+                    'retries': self.retries.get(name, 0),
+                    'statuses': {str(status): count for status, count in self.statuses.get(name, {}).items()},
+                    'latency_seconds': {
+                        'p50': percentile(latencies, 50),
+                        'p90': percentile(latencies, 90),
+                        'p99': percentile(latencies, 99),
+                        'max': latencies[-1],
+                        'total': sum(latencies)
+                    }
+                }
+
+            request_latencies = sorted(self.request_latencies)
+
+            return {
+                'elapsed_seconds': time.monotonic() - self.started,
+                'requests': len(request_latencies),
+                'request_latency_seconds': {
+                    'p50': percentile(request_latencies, 50),
+                    'p99': percentile(request_latencies, 99)
+                },
+                'sleep_seconds': self.sleep_seconds,
+                'throttled_seconds': throttled_seconds,
+                'functions': functions
+            }
+
+    def dump(self, path, throttled_seconds=0.0, extra=None):
+        summary = self.summary(throttled_seconds)
+        summary.update(extra or {})
+
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(summary, indent=4))
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def instrumented(fn):
+    """Record calls to an API function taking the client as its first argument
+
+    When the client has no Metrics attached the function is called straight through.
+    Generator functions are timed from the first to the last item they yield. Coroutine
+    functions are timed until they return, their requests are recorded by the async client.
+    """
+    name = fn.__name__
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def coroutine_wrapper(client, *args, **kwargs):
+            if client.metrics is None:
+                return await fn(client, *args, **kwargs)
+
+            token = _task_function.set(name)
+
+            start = time.perf_counter()
+            try:
+                return await fn(client, *args, **kwargs)
+            finally:
+                client.metrics.record_call(name, time.perf_counter() - start)
+                _task_function.reset(token)
+
+        return coroutine_wrapper
+
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def generator_wrapper(client, *args, **kwargs):
+            if client.metrics is None:
+                yield from fn(client, *args, **kwargs)
+                return
+
+            start = time.perf_counter()
+            try:
+                for item in _in_function(client.metrics, name, fn(client, *args, **kwargs)):
+                    yield item
+            finally:
+                client.metrics.record_call(name, time.perf_counter() - start)
+
+        return generator_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(client, *args, **kwargs):
+        if client.metrics is None:
+            return fn(client, *args, **kwargs)
+
+        local = client.metrics.local
+        outer = getattr(local, 'name', None)
+        local.name = name
+        local.failed = False
+
+        start = time.perf_counter()
+        try:
+            return fn(client, *args, **kwargs)
+        finally:
+            client.metrics.record_call(name, time.perf_counter() - start)
+            local.name = outer
+
+    return wrapper
+
+def _in_function(metrics, name, generator):
+    """Mark the calling thread as inside function name while the generator runs"""
+    local = metrics.local
+
+    while True:
+        outer = getattr(local, 'name', None)
+        local.name = name
+        local.failed = False
+
+        try:
+            item = next(generator)
+        except StopIteration:
+            return
+        finally:
+            local.name = outer
+
+        yield item
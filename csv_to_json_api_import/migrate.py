@@ -0,0 +1,526 @@
+"""Per-row work of migrate-projects on each backend, imported only when that command runs
+"""
+
+import asyncio
+import logging
+import random
+import threading
+from dataclasses import dataclass
+
+from rich.progress import BarColumn, MofNCompleteColumn, Progress, ProgressColumn, TextColumn, TimeRemainingColumn
+from rich.text import Text
+
+from csv_to_json_api_import import snyk, snyk_async
+from csv_to_json_api_import.concurrency import AdaptiveLimit
+from csv_to_json_api_import.journal import Journal
+from csv_to_json_api_import.lookup import OrgResolver, TargetIndex
+from csv_to_json_api_import.pipeline import Pipeline, Stage
+from csv_to_json_api_import.rows import Row, truncate_org_name
+
+log = logging.getLogger(__name__)
+
+class _RowsPerSecondColumn(ProgressColumn):
+    def render(self, task):
+        return Text(f"{task.speed or 0:.1f} rows/s")
+
+def progress_bar():
+    return Progress(
+        TextColumn("{task.description}"),
+        BarColumn(),
+        MofNCompleteColumn(),
+        _RowsPerSecondColumn(),
+        TextColumn("{task.fields[projects]} projects migrated"),
+        TextColumn("ETA"),
+        TimeRemainingColumn())
+
+@dataclass
+class Migration:
+    """Settings and state shared by every row of a migrate-projects run"""
+    group_id: str
+    source_org: str
+    dry_run: bool
+    targets: TargetIndex
+    orgs: OrgResolver
+    journal: Journal
+    # fraction of targets listed again after their moves to check they are empty
+    verify_sample: float = 0.0
+    # (row, target id) of emptied targets waiting for the cleanup phase, None to delete right away
+    deletions: list = None
+    # adaptive limit on the project moves in flight, None to leave them to the worker counts
+    move_limit: AdaptiveLimit = None
+    # move each row's projects as one batch, see _move_batch
+    batch_moves: bool = False
+    verbose: bool = False
+    # base URL of a stand-in for the Snyk API, None for the real one
+    api_url: str = None
+
+    def should_verify(self):
+        return self.verify_sample > 0 and random.random() < self.verify_sample
+
+def delete_targets(client, migration, executor):
+    """Cleanup phase, delete every target queued by the migration
+
+    Returns a tuple of (targets deleted, failures), failures has a (row, reason, HTTP status)
+    tuple for each target that could not be deleted.
+    """
+    def delete(deletion):
+        row, target_id = deletion
+
+        if snyk.delete_target(client, migration.source_org, target_id, verbose=migration.verbose):
+            migration.journal.record_delete(row.target_name, target_id)
+            return None
+
+        return (row, "target delete failed", client.last_status())
+
+    if executor is None:
+        results = map(delete, migration.deletions)
+    else:
+        results = executor.map(delete, migration.deletions)
+
+    failures = [failure for failure in results if failure is not None]
+
+    return len(migration.deletions) - len(failures), failures
+
+def migrate_row(client, migration, row, move_pool, planned=None):
+    """Move every project of the row's target to its destination org and delete the emptied target.
+
+    Returns a tuple of (projects migrated, failure), failure is None when the row succeeded or a
+    (reason, HTTP status) tuple. The target is only deleted once all of its moves have completed
+    successfully. Whether it is empty is decided from the move outcomes, it is only listed again
+    for the sampled fraction of targets the migration verifies. When the migration defers
+    deletions the target is queued for the cleanup phase instead of being deleted here. A target
+    with no projects left is cleaned up the same way when the journal has moves from it, as a
+    previous run stopped before deleting it. With a planned row its target, projects and org are
+    taken from the plan instead of looked up.
+    """
+    projects_migrated = 0
+    failure = None
+
+    # get target id using asset name
+    if planned is not None:
+        target_id = planned.target_id or None
+    elif migration.targets is not None:
+        target_id = migration.targets.get(row.target_name)
+    else:
+        target_id = snyk.get_target_id_from_name(client, migration.source_org, row.target_name, verbose=migration.verbose)
+
+    log.debug("Name: %s, Target ID: %s", row.asset_name, target_id)
+
+    if target_id is not None:
+        # get projects using target id as a filter
+
+        if planned is not None:
+            project_ids = planned.project_ids
+        else:
+            project_ids = snyk.get_projects_from_target(client, migration.source_org, target_id, cached=migration.dry_run)
+
+        log.debug("Project IDs for %s: %s", row.target_name, project_ids)
+
+        if project_ids is None:
+            # the target may have projects that weren't listed, so it is left as it is
+            failure = ("project listing failed", client.last_status())
+        elif len(project_ids) > 0:
+            # get org id of destination org
+            org_name = truncate_org_name(row.org_name)
+
+            if planned is not None:
+                org_id = planned.org_id or None
+            elif migration.orgs is not None:
+                org_id = migration.orgs.get(org_name)
+            else:
+                org_id = snyk.get_organization_id_from_name(client, migration.group_id, org_name, verbose=migration.verbose)
+
+            if org_id is not None:
+                log.info("Org ID: %s, Org Name: '%s'", org_id, org_name)
+
+                def move_project(project_id):
+                    return _move_project(client, migration, row, target_id, org_id, project_id)
+
+                # move all projects to destination org
+                if migration.batch_moves:
+                    results = _move_batch(client, migration, row, target_id, org_id, project_ids, move_pool)
+                elif move_pool is None:
+                    results = [move_project(project_id) for project_id in project_ids]
+                else:
+                    results = list(move_pool.map(move_project, project_ids))
+
+                failed_statuses = [status for moved, status in results if not moved]
+                projects_migrated = len(results) - len(failed_statuses)
+
+                failure = _cleanup_target(client, migration, row, target_id, len(results), failed_statuses)
+
+            else:
+                log.warning("Could not retrieve Org ID for: %s", org_name)
+                failure = ("org not found", None)
+
+        elif migration.journal.is_target_started(row.target_name):
+            # a previous run moved every project but stopped before deleting the target
+            failure = _cleanup_target(client, migration, row, target_id, 0, [])
+
+    else:
+        log.warning("Could not get Target ID for: %s", row.target_name)
+
+    return projects_migrated, failure
+
+def _move_project(client, migration, row, target_id, org_id, project_id):
+    """Move one project of the row's target unless the journal has it, returns (moved, HTTP status)"""
+    if _already_moved(migration, project_id):
+        return True, None
+
+    def move():
+        moved = snyk.move_project_to_org(client, migration.source_org, org_id, project_id, verbose=migration.verbose, dry_run=migration.dry_run, target_id=target_id)
+        return moved, client.last_status()
+
+    moved, status = _limit_move(migration, move)
+
+    if moved:
+        migration.journal.record_move(row.target_name, target_id, project_id, org_id)
+
+    return moved, status
+
+def _move_batch(client, migration, row, target_id, org_id, project_ids, move_pool):
+    """Move the row's projects to their org as one batch, returns a (moved, HTTP status) per project
+
+    Snyk has no bulk move, so every project is still its own request, sent on the move pool when
+    there is one. Instead of lines per project, one summary line is printed for the batch,
+    followed by a line for each project that failed. The moves are journaled in one append and
+    the cached project lists are dropped once.
+    """
+    pending = [project_id for project_id in project_ids if not migration.journal.is_project_moved(project_id)]
+    already_moved = [(True, None)] * (len(project_ids) - len(pending))
+
+    if migration.dry_run:
+        log.info("Would move %s projects of %s from org: %s to org: %s", len(pending), row.target_name, migration.source_org, org_id)
+        return [(False, None)] * len(pending) + already_moved
+
+    def move_project(project_id):
+        return _limit_move(migration, lambda: snyk.send_project_move(client, migration.source_org, org_id, project_id))
+
+    if move_pool is None:
+        results = [move_project(project_id) for project_id in pending]
+    else:
+        results = list(move_pool.map(move_project, pending))
+
+    moved = [project_id for project_id, (ok, _) in zip(pending, results) if ok]
+
+    if moved:
+        migration.journal.record_moves(row.target_name, target_id, moved, org_id)
+        client.invalidate_moved_projects(migration.source_org, org_id, target_id)
+
+    log.info("Moved %d of %d projects of %s from org: %s to org: %s, %d already moved", len(moved), len(pending), row.target_name, migration.source_org, org_id, len(already_moved),
+             extra={'fields': {'target': row.target_name, 'org': org_id, 'moved': len(moved), 'failed': len(pending) - len(moved)}})
+
+    for project_id, (ok, status) in zip(pending, results):
+        if not ok:
+            log.warning("Could not migrate project: %s, reason: %s", project_id, 'no response' if status is None else status, extra={'fields': {'project': project_id, 'status': status}})
+
+    return results + already_moved
+
+def _limit_move(migration, move):
+    """Call move under the migration's adaptive move limit, if it has one, and return its (moved, HTTP status)"""
+    if migration.move_limit is None:
+        return move()
+
+    started = migration.move_limit.acquire()
+    status = None
+
+    try:
+        moved, status = move()
+    finally:
+        migration.move_limit.release(started, status)
+
+    return moved, status
+
+def _already_moved(migration, project_id):
+    if migration.journal.is_project_moved(project_id):
+        log.info("Project already moved: %s", project_id)
+        return True
+
+    return False
+
+def _cleanup_target(client, migration, row, target_id, moves, failed_statuses):
+    """Delete the target once its moves are done, returns the row's failure or None"""
+    failure = _keep_target(migration, moves, failed_statuses)
+
+    if failure is None and migration.should_verify():
+        remaining = snyk.get_projects_from_target(client, migration.source_org, target_id, cached=False)
+        failure = _remaining_failure(remaining, client.last_status())
+
+    if failure is not None:
+        return failure
+
+    if migration.deletions is not None:
+        migration.deletions.append((row, target_id))
+    elif snyk.delete_target(client, migration.source_org, target_id, verbose=migration.verbose):
+        migration.journal.record_delete(row.target_name, target_id)
+    else:
+        return ("target delete failed", client.last_status())
+
+    return None
+
+def _keep_target(migration, moves, failed_statuses):
+    """The row's failure if its target has to be kept after its moves, None if it may be deleted"""
+    # every listed project was moved or was already gone, so the target is empty unless
+    # projects were added to it after it was listed
+    if migration.dry_run:
+        return ("dry run", None)
+    if failed_statuses:
+        return (f"{len(failed_statuses)} of {moves} project moves failed", failed_statuses[0])
+
+    return None
+
+def _remaining_failure(remaining, status):
+    """The row's failure if listing the target again found projects or failed, None if it is empty"""
+    if remaining is None:
+        return ("project listing failed", status)
+    if remaining:
+        return ("target not empty after moves", None)
+
+    return None
+
+@dataclass(slots=True)
+class _RowState:
+    """A row on its way through the pipeline backend"""
+    row: Row
+    target_id: str = None
+    project_ids: list = None
+    org_id: str = None
+    # project moves not completed yet
+    pending: int = 0
+    failed_statuses: list = None
+
+def migrate_rows_pipelined(client, migration, rows, stage_workers, record_result):
+    """Migrate rows through a pipeline with one stage per API call, returns the stages' stats
+
+    Rows go through the stages targets (look up the row's target), projects (list its projects),
+    orgs (look up the destination org), move (one item per project) and delete (delete the
+    emptied target), each with stage_workers[stage] threads. Stages overlap, so the next rows
+    are looked up while earlier rows' projects are moved and their targets deleted.
+    record_result is called with (row, projects migrated, failure) as each row completes.
+    """
+    result_lock = threading.Lock()
+    move_lock = threading.Lock()
+
+    def finish(row_state, projects_migrated, failure):
+        with result_lock:
+            record_result(row_state.row, projects_migrated, failure)
+
+    def lookup_target(row_state, emit):
+        row = row_state.row
+
+        if migration.targets is not None:
+            row_state.target_id = migration.targets.get(row.target_name)
+        else:
+            row_state.target_id = snyk.get_target_id_from_name(client, migration.source_org, row.target_name, verbose=migration.verbose)
+
+        if row_state.target_id is None:
+            log.warning("Could not get Target ID for: %s", row.target_name)
+            finish(row_state, 0, None)
+        else:
+            emit(row_state)
+
+    def list_projects(row_state, emit):
+        row_state.project_ids = snyk.get_projects_from_target(client, migration.source_org, row_state.target_id, cached=migration.dry_run)
+
+        log.debug("Project IDs for %s: %s", row_state.row.target_name, row_state.project_ids)
+
+        if row_state.project_ids is None:
+            finish(row_state, 0, ("project listing failed", client.last_status()))
+        elif row_state.project_ids:
+            emit(row_state)
+        elif migration.journal.is_target_started(row_state.row.target_name):
+            # a previous run moved every project but stopped before deleting the target
+            finish(row_state, 0, _cleanup_target(client, migration, row_state.row, row_state.target_id, 0, []))
+        else:
+            finish(row_state, 0, None)
+
+    def lookup_org(row_state, emit):
+        org_name = truncate_org_name(row_state.row.org_name)
+
+        if migration.orgs is not None:
+            row_state.org_id = migration.orgs.get(org_name)
+        else:
+            row_state.org_id = snyk.get_organization_id_from_name(client, migration.group_id, org_name, verbose=migration.verbose)
+
+        if row_state.org_id is None:
+            log.warning("Could not retrieve Org ID for: %s", org_name)
+            finish(row_state, 0, ("org not found", None))
+            return
+
+        log.info("Org ID: %s, Org Name: '%s'", row_state.org_id, org_name)
+
+        row_state.pending = len(row_state.project_ids)
+        row_state.failed_statuses = []
+
+        for project_id in row_state.project_ids:
+            emit((row_state, project_id))
+
+    def move_project(item, emit):
+        row_state, project_id = item
+
+        moved, status = _move_project(client, migration, row_state.row, row_state.target_id, row_state.org_id, project_id)
+
+        with move_lock:
+            if not moved:
+                row_state.failed_statuses.append(status)
+            row_state.pending -= 1
+            last = row_state.pending == 0
+
+        # the last move of a row passes it on to be cleaned up
+        if last:
+            emit(row_state)
+
+    def cleanup(row_state, emit):
+        moves = len(row_state.project_ids)
+        failed_statuses = row_state.failed_statuses
+
+        failure = _cleanup_target(client, migration, row_state.row, row_state.target_id, moves, failed_statuses)
+        finish(row_state, moves - len(failed_statuses), failure)
+
+    pipeline = Pipeline([
+        Stage('targets', lookup_target, stage_workers['targets']),
+        Stage('projects', list_projects, stage_workers['projects']),
+        Stage('orgs', lookup_org, stage_workers['orgs']),
+        Stage('move', move_project, stage_workers['move']),
+        Stage('delete', cleanup, stage_workers['delete'])
+    ]).start()
+
+    try:
+        pipeline.feed(_RowState(row) for row in rows)
+    finally:
+        pipeline.close()
+
+    return pipeline.stats()
+
+async def migrate_rows_async(snyk_token, migration, rows, concurrency, endpoint_limits, sync_client, record_result):
+    """Migrate rows on the asyncio backend, keeping at most concurrency rows in flight
+
+    Shares the rate limiter, retry policy, circuit breaker, response cache and metrics of the
+    blocking client, so limits hold across both and the metrics cover both. record_result is
+    called with (row, projects migrated, failure) as each row completes.
+    """
+    client = snyk_async.AsyncSnykClient(
+        snyk_token,
+        endpoint_limits,
+        rate_limiter=sync_client.rate_limiter,
+        api_url=migration.api_url,
+        retry_policy=sync_client.retry_policy,
+        breaker=sync_client.breaker,
+        cache=sync_client.cache,
+        metrics=sync_client.metrics)
+
+    pending = {}
+
+    async def drain(return_when):
+        done, _ = await asyncio.wait(pending, return_when=return_when)
+        for task in done:
+            record_result(pending.pop(task), *task.result())
+
+    try:
+        for row in rows:
+            pending[asyncio.create_task(_migrate_row_async(client, migration, row))] = row
+
+            if len(pending) >= concurrency:
+                await drain(asyncio.FIRST_COMPLETED)
+
+        if pending:
+            await drain(asyncio.ALL_COMPLETED)
+    finally:
+        await client.close()
+
+async def _migrate_row_async(client, migration, row):
+    """asyncio version of migrate_row, lookups that miss the in-memory indexes run on a worker thread"""
+    projects_migrated = 0
+    failure = None
+
+    # get target id using asset name
+    if migration.targets is not None:
+        target_id = await asyncio.to_thread(migration.targets.get, row.target_name)
+    else:
+        target_id = await snyk_async.get_target_id_from_name(client, migration.source_org, row.target_name, verbose=migration.verbose)
+
+    log.debug("Name: %s, Target ID: %s", row.asset_name, target_id)
+
+    if target_id is not None:
+        # get projects using target id as a filter
+
+        project_ids, status = await snyk_async.get_projects_from_target(client, migration.source_org, target_id, cached=migration.dry_run)
+
+        log.debug("Project IDs for %s: %s", row.target_name, project_ids)
+
+        if project_ids is None:
+            # the target may have projects that weren't listed, so it is left as it is
+            failure = ("project listing failed", status)
+        elif len(project_ids) > 0:
+            # get org id of destination org
+            org_name = truncate_org_name(row.org_name)
+
+            if migration.orgs is not None:
+                org_id = await asyncio.to_thread(migration.orgs.get, org_name)
+            else:
+                org_id = await snyk_async.get_organization_id_from_name(client, migration.group_id, org_name, verbose=migration.verbose)
+
+            if org_id is not None:
+                log.info("Org ID: %s, Org Name: '%s'", org_id, org_name)
+
+                # move all projects to destination org
+                results = await asyncio.gather(*[_move_project_async(client, migration, row, target_id, org_id, project_id) for project_id in project_ids])
+
+                failed_statuses = [status for moved, status in results if not moved]
+                projects_migrated = len(results) - len(failed_statuses)
+
+                failure = await _cleanup_target_async(client, migration, row, target_id, len(results), failed_statuses)
+
+            else:
+                log.warning("Could not retrieve Org ID for: %s", org_name)
+                failure = ("org not found", None)
+
+        elif migration.journal.is_target_started(row.target_name):
+            # a previous run moved every project but stopped before deleting the target
+            failure = await _cleanup_target_async(client, migration, row, target_id, 0, [])
+
+    else:
+        log.warning("Could not get Target ID for: %s", row.target_name)
+
+    return projects_migrated, failure
+
+async def _move_project_async(client, migration, row, target_id, org_id, project_id):
+    """asyncio version of _move_project"""
+    if _already_moved(migration, project_id):
+        return True, None
+
+    started = None if migration.move_limit is None else await migration.move_limit.acquire_async()
+    status = None
+
+    try:
+        moved, status = await snyk_async.move_project_to_org(client, migration.source_org, org_id, project_id, verbose=migration.verbose, dry_run=migration.dry_run, target_id=target_id)
+    finally:
+        if started is not None:
+            migration.move_limit.release(started, status)
+
+    if moved:
+        migration.journal.record_move(row.target_name, target_id, project_id, org_id)
+
+    return moved, status
+
+async def _cleanup_target_async(client, migration, row, target_id, moves, failed_statuses):
+    """asyncio version of _cleanup_target"""
+    failure = _keep_target(migration, moves, failed_statuses)
+
+    if failure is None and migration.should_verify():
+        failure = _remaining_failure(*await snyk_async.get_projects_from_target(client, migration.source_org, target_id, cached=False))
+
+    if failure is not None:
+        return failure
+
+    if migration.deletions is not None:
+        migration.deletions.append((row, target_id))
+        return None
+
+    deleted, status = await snyk_async.delete_target(client, migration.source_org, target_id, verbose=migration.verbose)
+
+    if not deleted:
+        return ("target delete failed", status)
+
+    migration.journal.record_delete(row.target_name, target_id)
+    return None
@@ -0,0 +1,165 @@
+"""Threaded pipeline of worker stages connected by bounded queues
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
+
+# put on a stage's queue once nothing more will be, each worker puts it back for its siblings
+_DONE = object()
+
+class Stage:
+    """A pool of worker threads processing the items of one bounded input queue
+
+    fn(item, emit) processes one item and calls emit(next_item) for every item it passes on to
+    the next stage. When the next stage's queue is full emit blocks, so a slow stage holds back
+    the ones before it instead of buffering without bound. Each stage counts the items it
+    processed, the time its workers spent busy, not counting time blocked in emit, and the
+    depth of its queue.
+    """
+
+    def __init__(self, name, fn, workers=1, queue_size=None):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size or workers * 2)
+        self.next = None
+
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.depth_total = 0
+        self.depth_max = 0
+        self.started = None
+        self.stopped = None
+
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def start(self, on_error):
+        self.started = time.monotonic()
+
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(on_error,), name=f"{self.name}-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """Wait for every queued item to be processed"""
+        self.queue.put(_DONE)
+
+        for thread in self.threads:
+            thread.join()
+
+        self.stopped = time.monotonic()
+
+    def stats(self):
+        elapsed = (self.stopped or time.monotonic()) - self.started
+
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'items': self.items,
+                'utilization': self.busy_seconds / (self.workers * elapsed) if elapsed > 0 else 0.0,
+                'queue_depth_mean': self.depth_total / self.items if self.items else 0.0,
+                'queue_depth_max': self.depth_max
+            }
+
+    def _work(self, on_error):
+        blocked = 0.0
+
+        # time spent waiting for room in the next stage's queue doesn't count as busy
+        def emit(item):
+            nonlocal blocked
+            start = time.perf_counter()
+            self.next.put(item)
+            blocked += time.perf_counter() - start
+
+        while True:
+            depth = self.queue.qsize()
+            item = self.queue.get()
+
+            if item is _DONE:
+                self.queue.put(_DONE)
+                return
+
+            blocked = 0.0
+            start = time.perf_counter()
+            try:
+                self.fn(item, emit)
+            except BaseException as e:
+                on_error(e)
+            busy = time.perf_counter() - start - blocked
+
+            with self.lock:
+                self.items += 1
+                self.busy_seconds += busy
+                self.depth_total += depth
+                self.depth_max = max(self.depth_max, depth)
+
+class Pipeline:
+    """Stages run in order, each feeding the next, all of them running at once
+
+    Items fed to the pipeline go to the first stage. close() drains the stages one after the
+    other and re-raises the first exception raised by any stage's function.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.error = None
+        self.lock = threading.Lock()
+
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next = next_stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.start(self._on_error)
+
+        return self
+
+    def feed(self, items):
+        for item in items:
+            self.stages[0].put(item)
+
+    def close(self):
+        for stage in self.stages:
+            stage.stop()
+
+        if self.error is not None:
+            raise self.error
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def _on_error(self, e):
+        with self.lock:
+            if self.error is None:
+                self.error = e
+
+def map_bounded(executor, fn, items, max_pending):
+    """Yield (item, fn(item)) pairs, keeping at most max_pending calls queued on the executor.
+
+    Results are yielded in completion order. Without an executor every item is processed
+    inline, in order.
+    """
+    if executor is None:
+        for item in items:
+            yield item, fn(item)
+        return
+
+    pending = {}
+
+    for item in items:
+        pending[executor.submit(fn, item)] = item
+
+        if len(pending) >= max_pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+
+    for future in as_completed(pending):
+        yield pending[future], future.result()
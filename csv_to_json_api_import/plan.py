@@ -0,0 +1,209 @@
+"""Compact binary migration plans, compiled once by the plan command and memory-mapped to run
+"""
+
+import json
+import mmap
+import struct
+import sys
+from array import array
+from dataclasses import dataclass
+
+PLAN_MAGIC = b'SNYKPLN1'
+
+# magic, then the byte length of the JSON metadata and the number of strings, string bytes,
+# groups, rows, projects and row values
+_HEADER = struct.Struct('<8s7I')
+
+_GROUP_FIELDS = 4
+_ROW_FIELDS   = 6
+
+@dataclass(slots=True)
+class PlanGroup:
+    """A destination org and the rows moving projects into it"""
+    org_name: str
+    org_id: str
+    rows: int
+    projects: int
+
+@dataclass(slots=True)
+class PlannedRow:
+    """A CSV row with its target and the projects to move resolved, empty IDs were not found"""
+    org_name: str
+    org_id: str
+    target_name: str
+    target_id: str
+    project_ids: list
+    values: list
+
+class _StringTable:
+    """Interns strings, each distinct string is stored once and referred to by index"""
+
+    def __init__(self):
+        self.indexes = {}
+        self.strings = []
+
+    def intern(self, value):
+        index = self.indexes.get(value)
+
+        if index is None:
+            index = self.indexes[value] = len(self.strings)
+            self.strings.append(value)
+
+        return index
+
+def write_plan(path, meta, header, groups):
+    """Write a plan file
+
+    groups is a list of (org name, org ID, rows) with rows a list of
+    (target name, target ID, project IDs, CSV values). Every string is interned, so the org,
+    asset and tech org names repeated on many rows are only stored once, and the groups, rows
+    and lists of projects and values are flat arrays of 32-bit indexes.
+    """
+    strings = _StringTable()
+    group_table = array('I')
+    row_table = array('I')
+    project_table = array('I')
+    value_table = array('I')
+
+    meta = dict(meta, header=[strings.intern(column) for column in header])
+
+    for org_name, org_id, rows in groups:
+        group_table.extend((strings.intern(org_name), strings.intern(org_id or ''), len(row_table) // _ROW_FIELDS, len(rows)))
+
+        for target_name, target_id, project_ids, values in rows:
+            row_table.extend((
+                strings.intern(target_name),
+                strings.intern(target_id or ''),
+                len(project_table),
+                len(project_ids),
+                len(value_table),
+                len(values)))
+            project_table.extend(strings.intern(project_id) for project_id in project_ids)
+            value_table.extend(strings.intern(value) for value in values)
+
+    encoded = [string.encode('utf-8') for string in strings.strings]
+    offsets = array('I', [0])
+    for string in encoded:
+        offsets.append(offsets[-1] + len(string))
+
+    meta_bytes = json.dumps(meta).encode('utf-8')
+
+    with open(path, 'wb') as plan_file:
+        plan_file.write(_HEADER.pack(
+            PLAN_MAGIC, len(meta_bytes), len(encoded), offsets[-1],
+            len(group_table) // _GROUP_FIELDS, len(row_table) // _ROW_FIELDS, len(project_table), len(value_table)))
+
+        _write_padded(plan_file, meta_bytes)
+        _write_padded(plan_file, _little_endian(offsets))
+        _write_padded(plan_file, b''.join(encoded))
+
+        for table in (group_table, row_table, project_table, value_table):
+            plan_file.write(_little_endian(table))
+
+class Plan:
+    """Read-only view of a plan file
+
+    The file is memory-mapped and its tables are read in place, so opening a plan of any size
+    is instant and only the pages that are used are read from disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as plan_file:
+            self.mmap = mmap.mmap(plan_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, meta_length, string_count, string_bytes, group_count, row_count, project_count, value_count = _HEADER.unpack_from(self.mmap)
+
+        if magic != PLAN_MAGIC:
+            self.mmap.close()
+            raise ValueError(f"{path} is not a migration plan")
+
+        self.views = []
+        offset = _HEADER.size
+
+        self.meta = json.loads(bytes(self.mmap[offset:offset + meta_length]))
+        offset += _padded(meta_length)
+
+        self.offsets, offset = self._table(offset, string_count + 1)
+        self.blob = self._view(offset, string_bytes)
+        offset += _padded(string_bytes)
+
+        self.group_table, offset = self._table(offset, group_count * _GROUP_FIELDS)
+        self.row_table, offset = self._table(offset, row_count * _ROW_FIELDS)
+        self.project_table, offset = self._table(offset, project_count)
+        self.value_table, offset = self._table(offset, value_count)
+
+        self.group_count = group_count
+        self.row_count = row_count
+        self.project_count = project_count
+
+        self.header = [self.string(index) for index in self.meta['header']]
+
+    def string(self, index):
+        return str(self.blob[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+    def groups(self):
+        for group in range(self.group_count):
+            org_name, org_id, first_row, rows = self.group_table[group * _GROUP_FIELDS:(group + 1) * _GROUP_FIELDS]
+
+            projects = sum(self.row_table[row * _ROW_FIELDS + 3] for row in range(first_row, first_row + rows))
+
+            yield PlanGroup(self.string(org_name), self.string(org_id), rows, projects)
+
+    def rows(self):
+        """Yield every planned row, grouped by destination org"""
+        for group in range(self.group_count):
+            org_name, org_id, first_row, rows = self.group_table[group * _GROUP_FIELDS:(group + 1) * _GROUP_FIELDS]
+            org_name, org_id = self.string(org_name), self.string(org_id)
+
+            for row in range(first_row, first_row + rows):
+                target_name, target_id, first_project, projects, first_value, values = self.row_table[row * _ROW_FIELDS:(row + 1) * _ROW_FIELDS]
+
+                yield PlannedRow(
+                    org_name,
+                    org_id,
+                    self.string(target_name),
+                    self.string(target_id),
+                    [self.string(index) for index in self.project_table[first_project:first_project + projects]],
+                    [self.string(index) for index in self.value_table[first_value:first_value + values]])
+
+    def close(self):
+        # views cast from another view go first
+        for view in reversed(self.views):
+            view.release()
+
+        self.mmap.close()
+
+    def _view(self, offset, length):
+        view = memoryview(self.mmap)[offset:offset + length]
+        self.views.append(view)
+        return view
+
+    def _table(self, offset, count):
+        """Array of count 32-bit unsigned ints at offset, and the offset after it"""
+        view = self._view(offset, count * 4)
+
+        if sys.byteorder == 'little':
+            table = view.cast('I')
+            self.views.append(table)
+        else:
+            table = array('I')
+            table.frombytes(view)
+            table.byteswap()
+
+        return table, offset + count * 4
+
+def _little_endian(table):
+    if sys.byteorder != 'little':
+        table = array('I', table)
+        table.byteswap()
+
+    return table.tobytes()
+
+def _padded(length):
+    return (length + 3) & ~3
+
+def _write_padded(plan_file, data):
+    plan_file.write(data)
+    plan_file.write(b'\0' * (_padded(len(data)) - len(data)))
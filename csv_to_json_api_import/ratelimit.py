@@ -0,0 +1,127 @@
+"""Client side rate limiting shared by every thread talking to the Snyk API
+"""
+
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from csv_to_json_api_import.constants import SNYK_API_RATE_LIMIT_BACKOFF_SECONDS
+
+RETRY_AFTER_HEADERS = ('Retry-After', 'RateLimit-Reset', 'X-RateLimit-Reset')
+
+# reset headers above this value are unix timestamps rather than a number of seconds
+EPOCH_THRESHOLD = 1000000000
+
+BACKOFF_BASE_SECONDS = 1
+
+class RateLimiter:
+    """Thread-safe token bucket
+
+    Every request takes one token, tokens refill at `rate` per second up to a burst of `rate`
+    tokens. When the API answers 429 the whole bucket is paused until the API says it is ready
+    again, so other threads don't burst straight back into the limit. A rate of 0 disables the
+    bucket but 429 backoff is still applied.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.throttled_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        waited = 0.0
+
+        while True:
+            delay = self._take()
+            if delay <= 0:
+                break
+
+            time.sleep(delay)
+            waited += delay
+
+        self._add_throttled(waited)
+
+    async def acquire_async(self):
+        """Wait without blocking the event loop until a request may be sent"""
+        waited = 0.0
+
+        while True:
+            delay = self._take()
+            if delay <= 0:
+                break
+
+            await asyncio.sleep(delay)
+            waited += delay
+
+        self._add_throttled(waited)
+
+    def _take(self):
+        """Take a token and return 0, or return the seconds to wait before trying again"""
+        with self.lock:
+            now = time.monotonic()
+            delay = self.blocked_until - now
+
+            if delay > 0:
+                return delay
+            if self.rate <= 0:
+                return 0
+
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+
+            return (1 - self.tokens) / self.rate
+
+    def _add_throttled(self, waited):
+        if waited > 0:
+            with self.lock:
+                self.throttled_seconds += waited
+
+    def backoff(self, response, attempt):
+        """Pause the bucket after a 429 response and return the number of seconds paused
+
+        The delay comes from the response's Retry-After or rate limit reset header when there is
+        one, otherwise it is a jittered exponential backoff based on the attempt number.
+        """
+        delay = retry_after(response)
+
+        if delay is None:
+            delay = random.uniform(0.5, 1) * min(SNYK_API_RATE_LIMIT_BACKOFF_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)
+
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            self.tokens = 0
+
+        return delay
+
+def retry_after(response):
+    """Seconds to wait as advertised by the response headers, or None if it doesn't say"""
+    for header in RETRY_AFTER_HEADERS:
+        value = response.headers.get(header)
+        if value is None:
+            continue
+
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                seconds = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                continue
+        else:
+            if seconds > EPOCH_THRESHOLD:
+                seconds = seconds - time.time()
+
+        return min(max(seconds, 0), SNYK_API_RATE_LIMIT_BACKOFF_SECONDS)
+
+    return None
@@ -0,0 +1,167 @@
+"""Retry policy and circuit breaker shared by every call to the Snyk API
+"""
+
+import logging
+import random
+import threading
+import time
+
+from csv_to_json_api_import.constants import *
+
+log = logging.getLogger(__name__)
+
+# statuses worth retrying whatever the endpoint, anything else is returned to the caller
+RETRYABLE_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+class RetryPolicy:
+    """Decides whether a failed request is retried and how long to wait first
+
+    Each request is retried at most max_retries times, waiting a full jitter exponential
+    backoff: a random delay between 0 and base_delay * 2^attempt, capped at max_delay. Retries
+    of errors, as opposed to 429s which the rate limiter already paces, also come out of a
+    budget shared by the whole run: at most budget_min plus budget_ratio of all requests made.
+    When the API degrades the budget runs out and rows fail fast instead of every worker
+    multiplying the load with its own retries.
+    """
+
+    def __init__(self, max_retries=MAX_RETRIES, base_delay=RETRY_BACKOFF_BASE_SECONDS, max_delay=RETRY_BACKOFF_MAX_SECONDS,
+                 budget_ratio=RETRY_BUDGET_RATIO, budget_min=RETRY_BUDGET_MIN):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.budget_min = budget_min
+
+        self.requests = 0
+        self.retries = 0
+        self.refused = 0
+        # 429s, 5xx responses and transport errors, watched by the adaptive move limit
+        self.congestion_events = 0
+        self.lock = threading.Lock()
+
+    def record_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def record_congestion(self):
+        with self.lock:
+            self.congestion_events += 1
+
+    def allow_retry(self, attempt, budgeted=True):
+        """Whether a request that failed on its attempt'th retry (0 for the first try) may go again"""
+        if attempt >= self.max_retries:
+            return False
+
+        with self.lock:
+            if budgeted and self.retries >= self.budget_min + self.budget_ratio * self.requests:
+                self.refused += 1
+                return False
+
+            self.retries += 1
+
+        return True
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests, 'retries': self.retries, 'refused': self.refused}
+
+class CircuitBreaker:
+    """Pauses every request to the API after too many consecutive failures
+
+    Transport errors and 5xx responses count as failures, any other response resets the count.
+    After threshold consecutive failures the circuit opens for cooldown seconds, during which
+    requests wait instead of adding to the load. The first result after the pause decides: a
+    success closes the circuit, a failure opens it again for twice as long, up to max_cooldown.
+    """
+
+    def __init__(self, threshold=CIRCUIT_BREAKER_THRESHOLD, cooldown=CIRCUIT_BREAKER_COOLDOWN_SECONDS, max_cooldown=CIRCUIT_BREAKER_MAX_SECONDS):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self.failures = 0
+        self.open_until = 0.0
+        self.current_cooldown = cooldown
+        self.half_open = False
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def wait_seconds(self):
+        """Seconds to wait before sending a request, 0 while the circuit is closed"""
+        with self.lock:
+            return max(0.0, self.open_until - time.monotonic())
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+
+            if self.half_open and time.monotonic() >= self.open_until:
+                self.half_open = False
+                self.current_cooldown = self.cooldown
+
+    def record_failure(self):
+        with self.lock:
+            now = time.monotonic()
+
+            # requests already in flight when the circuit opened
+            if now < self.open_until:
+                return
+
+            self.failures += 1
+
+            if not self.half_open and self.failures < self.threshold:
+                return
+
+            if self.half_open:
+                self.current_cooldown = min(self.max_cooldown, self.current_cooldown * 2)
+
+            self.open_until = now + self.current_cooldown
+            self.half_open = True
+            self.failures = 0
+            self.opened += 1
+            cooldown = self.current_cooldown
+
+        log.error("Snyk API keeps failing, pausing all requests for %.0f seconds", cooldown)
+
+def failure_delay(client, attempt, reason, response=None, retry_statuses=(), idempotent=True):
+    """Seconds to wait before retrying a failed request, None to give up and return it as is
+
+    client provides the retry_policy, breaker and rate_limiter. response is None when the
+    request raised a transport error, described by reason. Requests that aren't idempotent are
+    only retried after a 429, any other failure may have been processed by the API.
+    """
+    status = None if response is None else response.status_code
+
+    if status is not None and status not in RETRYABLE_STATUSES and status not in retry_statuses:
+        client.breaker.record_success()
+        return None
+
+    if status is None or status >= 500:
+        client.breaker.record_failure()
+    else:
+        client.breaker.record_success()
+
+    if status is None or status == 429 or status >= 500:
+        client.retry_policy.record_congestion()
+
+    if not idempotent and status != 429:
+        log.error("%s, not retrying a request that may have been processed", reason, extra={'fields': {'status': status}})
+        return None
+
+    if not client.retry_policy.allow_retry(attempt, budgeted=status != 429):
+        log.error("%s, giving up after %d retries", reason, attempt, extra={'fields': {'status': status}})
+        return None
+
+    if status == 429:
+        # the rate limiter pauses every worker, the request waits for its next token
+        delay = client.rate_limiter.backoff(response, attempt)
+        log.warning("To many API calls, backing off for %.1f seconds", delay, extra={'fields': {'status': status}})
+        return 0.0
+
+    delay = client.retry_policy.backoff(attempt)
+    log.warning("%s, trying again in %.1f seconds", reason, delay, extra={'fields': {'status': status}})
+
+    return delay
@@ -0,0 +1,80 @@
+"""Streaming reader for the asset CSV export shared by every command
+"""
+
+import csv
+from dataclasses import dataclass
+
+from csv_to_json_api_import.constants import ORG_NAME_MAX_LENGTH
+
+UNKNOWN_ORG_NAME = "Unknown Asset ID"
+
+# csv header -> Row field
+COLUMNS = {
+    'Tech Org':     'tech_org',
+    'Asset ID':     'asset_id',
+    'Asset Name':   'asset_name',
+    'Repo URL':     'repo_url',
+    'Project Name': 'target_name',
+    'Repo Count':   'repo_count'
+}
+
+@dataclass(slots=True)
+class Row:
+    """One line of the CSV file, values holds the original fields so the line can be written back out"""
+    tech_org: str
+    asset_id: str
+    asset_name: str
+    repo_url: str
+    target_name: str
+    repo_count: str
+    values: list
+
+    @property
+    def org_name(self):
+        """Name of the destination org for this row, before truncation"""
+        if self.asset_id == '' or self.asset_name == '':
+            return UNKNOWN_ORG_NAME
+
+        return self.asset_id + '_' + self.asset_name
+
+def truncate_org_name(org_name):
+    """Shorten an org name to the longest name Snyk accepts"""
+    return org_name[:ORG_NAME_MAX_LENGTH]
+
+def read_header(csv_path):
+    """Return the header line of the CSV file"""
+    with open(csv_path, 'r', newline='', encoding='utf-8-sig') as csv_file:
+        return next(csv.reader(csv_file), [])
+
+def read_rows(csv_path, skip_lines=0):
+    """Lazily yield a Row for every line of the CSV file after the header
+
+    Columns are matched by their header name, so their order doesn't matter and extra columns
+    are ignored. Only one line is held in memory at a time.
+    """
+    with open(csv_path, 'r', newline='', encoding='utf-8-sig') as csv_file:
+        csv_reader = csv.reader(csv_file)
+
+        indexes = column_indexes(next(csv_reader, []), csv_path)
+
+        for _ in range(skip_lines):
+            next(csv_reader, None)
+
+        for values in csv_reader:
+            if not values:
+                continue
+
+            yield make_row(values, indexes)
+
+def column_indexes(header, csv_path):
+    """Index in the header line of every column a Row is made from, header names match in any case"""
+    header = [column.strip().lower() for column in header]
+
+    missing = [column for column in COLUMNS if column.lower() not in header]
+    if missing:
+        raise ValueError(f"{csv_path} is missing the column(s): {', '.join(missing)}")
+
+    return [header.index(column.lower()) for column in COLUMNS]
+
+def make_row(values, indexes):
+    return Row(*[values[index] if index < len(values) else '' for index in indexes], values)
@@ -0,0 +1,190 @@
+"""Partitioning of the CSV rows between migrate-projects processes, and a local coordinator
+that runs every partition as its own worker process
+"""
+
+import csv
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import zlib
+from enum import Enum
+
+from csv_to_json_api_import.rows import truncate_org_name
+
+log = logging.getLogger(__name__)
+
+SHARD_LOG_FILE = "migrate-shard-{index}-of-{count}.log"
+
+# options the coordinator sets per worker instead of passing its own value through
+COORDINATOR_OPTIONS = {
+    'snyk_token', 'group_id', 'source_org', 'shard', 'shards', 'shard_tokens_file',
+    'rate_limit', 'output_csv_path', 'summary_json', 'metrics_json', 'progress'
+}
+
+def parse_shard(value):
+    """Parse a shard given as I/N, 1 <= I <= N, into the tuple (I, N)"""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f"expected I/N, e.g. 1/4, got: {value}")
+
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"shard index must be between 1 and the shard count, got: {value}")
+
+    return index, count
+
+def shard_of(row, count):
+    """1-based shard a row belongs to out of count
+
+    Rows are partitioned by a CRC32 of their destination org name, which unlike hash() is the same
+    in every process and every run, so a shard always gets the same rows and can be resumed on its
+    own. Every row of an org, including the rows that go to the "Unknown Asset ID" org, lands in
+    the same shard.
+    """
+    key = truncate_org_name(row.org_name)
+    return zlib.crc32(key.encode('utf-8')) % count + 1
+
+def command_args(ctx, skip=()):
+    """Rebuild the command line options of a click context from its parsed values"""
+    args = []
+
+    for param in ctx.command.params:
+        if param.param_type_name != 'option' or param.name in skip:
+            continue
+
+        value = ctx.params.get(param.name)
+        if value is None:
+            continue
+
+        if param.is_flag:
+            if value:
+                args.append(param.opts[0])
+            elif param.secondary_opts:
+                args.append(param.secondary_opts[0])
+        elif param.multiple:
+            for item in value:
+                args += [param.opts[0], _option_value(item)]
+        else:
+            args += [param.opts[0], _option_value(value)]
+
+    return args
+
+def read_tokens(path):
+    """One Snyk API token per line, blank lines and lines starting with # are ignored"""
+    with open(path, 'r', encoding='utf-8') as tokens_file:
+        tokens = [line.strip() for line in tokens_file if line.strip() and not line.startswith('#')]
+
+    if not tokens:
+        raise ValueError(f"no tokens in {path}")
+
+    return tokens
+
+def run_shards(ctx, count, tokens, group_id, source_org, rate_limit, output_csv_path=None, metrics_json=None):
+    """Run migrate-projects as count worker processes, one per shard, and merge their results
+
+    Worker i uses tokens[i % len(tokens)]. Workers sharing a token share its rate limit evenly,
+    so rate_limit stays the limit per token. Every worker appends to the same journal, writes
+    its errored rows to its own file, which are merged into output_csv_path once all workers
+    have exited, and its output to SHARD_LOG_FILE. Returns the merged summary.
+    """
+    prefix = [sys.executable, '-m', 'csv_to_json_api_import'] + command_args(ctx.parent) + [ctx.info_name]
+    options = command_args(ctx, skip=COORDINATOR_OPTIONS)
+
+    sharers = {}
+    for index in range(count):
+        token = tokens[index % len(tokens)]
+        sharers[token] = sharers.get(token, 0) + 1
+
+    workers = []
+
+    with tempfile.TemporaryDirectory(prefix='migrate-shards-') as work_dir:
+        for index in range(1, count + 1):
+            token = tokens[(index - 1) % len(tokens)]
+
+            worker = {
+                'index': index,
+                'log_path': SHARD_LOG_FILE.format(index=index, count=count),
+                'summary_path': os.path.join(work_dir, f"summary-{index}.json"),
+                'output_csv_path': None if output_csv_path is None else f"{output_csv_path}.shard-{index}-of-{count}"
+            }
+
+            args = options + [
+                '--shard', f"{index}/{count}",
+                '--rate-limit', str(rate_limit / sharers[token]),
+                '--summary-json', worker['summary_path']]
+
+            if worker['output_csv_path'] is not None:
+                args += ['--output-csv-path', worker['output_csv_path']]
+
+            if metrics_json is not None:
+                args += ['--metrics-json', f"{metrics_json}.shard-{index}-of-{count}"]
+
+            # the token and positional arguments go through the environment to keep the token
+            # out of the process list
+            env = dict(os.environ, SNYK_TOKEN=token, GROUP_ID=group_id, SOURCE_ORG=source_org)
+
+            with open(worker['log_path'], 'w', encoding='utf-8') as log_file:
+                worker['process'] = subprocess.Popen(prefix + args, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+            workers.append(worker)
+
+        log.info("Started %d shard workers, output is in %s", count, SHARD_LOG_FILE.format(index='N', count=count))
+
+        summary = {'shards': count, 'rows': 0, 'rows_resumed': 0, 'rows_failed': 0, 'projects_migrated': 0, 'failed_shards': []}
+
+        for worker in workers:
+            returncode = worker['process'].wait()
+
+            if returncode != 0 or not os.path.exists(worker['summary_path']):
+                log.error("Shard %d/%d failed with exit code %s, see %s", worker['index'], count, returncode, worker['log_path'])
+                summary['failed_shards'].append(worker['index'])
+                continue
+
+            with open(worker['summary_path'], 'r', encoding='utf-8') as summary_file:
+                shard_summary = json.load(summary_file)
+
+            log.info("Shard %d/%d finished: %d rows, %d projects migrated, %d rows errored", worker['index'], count, shard_summary['rows'], shard_summary['projects_migrated'], shard_summary['rows_failed'])
+
+            for key in ('rows', 'rows_resumed', 'rows_failed', 'projects_migrated'):
+                summary[key] += shard_summary[key]
+
+            # each worker tunes its own adaptive move limit
+            if shard_summary.get('move_concurrency') is not None:
+                summary.setdefault('move_concurrency', {})[worker['index']] = shard_summary['move_concurrency']
+
+    if output_csv_path is not None:
+        merge_csv_files(output_csv_path, [worker['output_csv_path'] for worker in workers])
+
+    return summary
+
+def merge_csv_files(path, shard_paths):
+    """Append the data rows of every existing shard CSV to path and remove the shard files
+
+    The header of the first shard file is written when path is new.
+    """
+    new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+
+    with open(path, 'a', newline='') as output_csv_file:
+        output_csv_writer = csv.writer(output_csv_file)
+
+        for shard_path in shard_paths:
+            if not os.path.exists(shard_path):
+                continue
+
+            with open(shard_path, 'r', newline='') as shard_csv_file:
+                shard_csv_reader = csv.reader(shard_csv_file)
+                header = next(shard_csv_reader, None)
+
+                if header is not None and new_file:
+                    output_csv_writer.writerow(header)
+                    new_file = False
+
+                output_csv_writer.writerows(shard_csv_reader)
+
+            os.remove(shard_path)
+
+def _option_value(value):
+    return str(value.value if isinstance(value, Enum) else value)
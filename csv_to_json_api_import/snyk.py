@@ -2,319 +2,410 @@
 """
 
 import json
+import logging
+import threading
 import time
 
 import requests
-from rich import print
+from requests.adapters import HTTPAdapter
 
+from csv_to_json_api_import.api import SnykApi
 from csv_to_json_api_import.constants import *
+from csv_to_json_api_import.metrics import instrumented
+from csv_to_json_api_import.ratelimit import RateLimiter
+from csv_to_json_api_import.retry import CircuitBreaker, RetryPolicy, failure_delay
+
+log = logging.getLogger(__name__)
+
+# transport errors worth retrying, timeouts included
+RETRYABLE_EXCEPTIONS = (requests.Timeout, requests.ConnectionError, requests.exceptions.ChunkedEncodingError)
+
+# project move statuses meaning the project is no longer in the source org: moved, already
+# moved away, or already in the destination
+MOVED_STATUSES = (200, 404, 409)
+
+class IncompleteListing(Exception):
+    """A page of a paginated list endpoint failed, so the items listed so far are not all of them"""
+
+    def __init__(self, listing, status):
+        super().__init__(f"could not list {listing}, reason: {'no response' if status is None else status}")
+        self.listing = listing
+        self.status = status
+
+class SnykClient(SnykApi):
+    """Keep-alive HTTP session shared by every call to the Snyk API
+
+    Connections are pooled per host, so repeated calls reuse an open TCP/TLS connection
+    instead of paying for a new handshake each time. Every request first takes a token from
+    the client's rate limiter. API functions send requests through send(), which applies the
+    client's retry policy and circuit breaker, and answers GETs from the response cache when
+    one is attached.
+    """
+
+    def __init__(self, snyk_token, pool_size=SNYK_API_POOL_SIZE_DEFAULT, rate_limit=SNYK_API_RATE_LIMIT_DEFAULT, api_url=None, metrics=None, cache=None):
+        super().__init__(api_url)
+
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.retry_policy = RetryPolicy()
+        self.breaker = CircuitBreaker()
+        self.metrics = metrics
+        self.cache = cache
+        self.local = threading.local()
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Authorization': f'token {snyk_token}'
+        })
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.adapter = adapter
+
+    def send(self, method, url, retry_statuses=(), idempotent=True, cached=True, **kwargs):
+        """Make a request, retrying it under the client's retry policy
+
+        Returns the first response that isn't worth retrying, or the last one received when the
+        retries run out. Returns None when the request never got a response. Requests that
+        create something should pass idempotent=False so they are only retried after a 429.
+        GETs passing cached=False go to the API even when the response cache has the URL.
+        """
+        cacheable = cached and method == 'GET' and self.cache is not None
+
+        if cacheable:
+            body = self.cache.get(url)
+            if body is not None:
+                self.local.status = 200
+                return _cached_response(url, body)
+
+        attempt = 0
 
-def get_target_id_from_name(snyk_token, org_id, target_name, verbose=False):
-    retry = 0
+        while True:
+            wait = self.breaker.wait_seconds()
+            if wait > 0:
+                self.sleep(wait)
 
-    target_id = None
+            self.retry_policy.record_request()
 
-    headers = {
-        'Authorization': f'token {snyk_token}'
-    }
+            try:
+                response = self.request(method, url, **kwargs)
+            except RETRYABLE_EXCEPTIONS as e:
+                response = None
+                reason = type(e).__name__
+            else:
+                reason = f"HTTP {response.status_code}"
 
-    url = f"{SNYK_REST_API_BASE_URL}/orgs/{org_id}/targets?version={SNYK_REST_API_VERSION}&displayName={requests.utils.quote(target_name, safe='')}"
+            delay = failure_delay(self, attempt, reason, response, retry_statuses, idempotent)
 
-    while True:
-        try:
-            response = requests.request(
-                'GET',
-                url,
-                headers=headers,
-                timeout=SNYK_API_TIMEOUT_DEFAULT)
-
-        except requests.ConnectTimeout:
-            retry += 1
-            if retry > MAX_RETRIES:
-                break
-            print("ERROR: ConnectionTimeout, trying again")
-        except requests.ReadTimeout:
-            retry += 1
-            if retry > MAX_RETRIES:
-                break
-            print("ERROR ReadTimeout, trying again")
-        except requests.Timeout:
-            retry += 1
-            if retry > MAX_RETRIES:
-                break
-            print("ERROR: Timeout, trying again")
-        except requests.ConnectionError:
-            retry += 1
-            if retry > MAX_RETRIES:
-                break
-            print("ERROR: ConnectionError, trying again")
-        else:
-            if response.status_code == 200:
-                response_json = json.loads(response.content)
-                if (len(response_json['data']) > 0):
-                    target_id = response_json['data'][0]['id']
-                else:
-                    print(f"Did not find a target with name: {target_name}")
-                break
-            elif response.status_code == 429:
-                print(f"To many API calls, backing off for {SNYK_API_RATE_LIMIT_BACKOFF_SECONDS} seconds")
-                time.sleep(SNYK_API_RATE_LIMIT_BACKOFF_SECONDS)
-                retry += 1
-                if retry > MAX_RETRIES:
-                    break
-            else:
-                print(f"Could not complete request {target_name}, reason: {response.status_code}")
-                break
+            if delay is None:
+                if cacheable and response is not None and response.status_code == 200:
+                    self.cache.put(url, response.content)
+                return response
+            if delay > 0:
+                self.sleep(delay)
 
-    return target_id
+            attempt += 1
 
-def get_all_non_empty_targets(snyk_token, org_id, verbose=False):
-    retry = 0
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', SNYK_API_TIMEOUT_DEFAULT)
+        self.rate_limiter.acquire()
 
-    targets = []
+        self.local.status = None
 
-    headers = {
-        'Authorization': f'token {snyk_token}'
-    }
+        if self.metrics is None:
+            response = self.session.request(method, url, **kwargs)
+        else:
+            response = self._measured_request(method, url, **kwargs)
 
-    url = f"{SNYK_REST_API_BASE_URL}/orgs/{org_id}/targets?version={SNYK_REST_API_VERSION}&limit=100"
+        self.local.status = response.status_code
 
-    while True:
+        return response
+
+    def _measured_request(self, method, url, **kwargs):
+        metrics = self.metrics
+        local = metrics.local
+
+        # any request made after a failed one within the same function call is a retry
+        if getattr(local, 'failed', False):
+            metrics.record_retry()
+
+        start = time.perf_counter()
         try:
-            response = requests.request(
-                'GET',
-                url,
-                headers=headers,
-                timeout=SNYK_API_TIMEOUT_DEFAULT)
-
-        except requests.ConnectTimeout:
-            retry += 1
-            if retry > MAX_RETRIES:
-                break
-            print("ERROR: ConnectionTimeout, trying again")
-        except requests.ReadTimeout:
-            retry += 1
-            if retry > MAX_RETRIES:
-                break
-            print("ERROR ReadTimeout, trying again")
-        except requests.Timeout:
-            retry += 1
-            if retry > MAX_RETRIES:
-                break
-            print("ERROR: Timeout, trying again")
-        except requests.ConnectionError:
-            retry += 1
-            if retry > MAX_RETRIES:
-                break
-            print("ERROR: ConnectionError, trying again")
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            local.failed = True
+            metrics.record_request(type(e).__name__, time.perf_counter() - start)
+            raise
+
+        local.failed = response.status_code in (403, 429) or response.status_code >= 500
+        metrics.record_request(response.status_code, time.perf_counter() - start)
+
+        return response
+
+    def sleep(self, seconds):
+        """Sleep outside of the rate limiter, e.g. before retrying a failed call"""
+        if self.metrics is not None:
+            self.metrics.record_sleep(seconds)
+
+        time.sleep(seconds)
+
+    def last_status(self):
+        """HTTP status of the last response received by the calling thread, None if the request failed"""
+        return getattr(self.local, 'status', None)
+
+    def retry_stats(self):
+        """Return retry counters for the run, refused retries were denied by the retry budget"""
+        return dict(self.retry_policy.stats(), circuit_opened=self.breaker.opened)
+
+    def pool_stats(self):
+        """Return connection pool counters, a hit is a request served over an already open connection"""
+        requests_total = 0
+        connections_total = 0
+
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                requests_total += pool.num_requests
+                connections_total += pool.num_connections
+
+        return {
+            'requests': requests_total,
+            'hits': requests_total - connections_total,
+            'misses': connections_total
+        }
+
+    def close(self):
+        self.session.close()
+
+        if self.cache is not None:
+            self.cache.close()
+
+def _cached_response(url, body):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response._content = body
+
+    return response
+
+@instrumented
+def get_target_id_from_name(client, org_id, target_name, verbose=False):
+    target_id = None
+
+    url = f"{client.rest_url}/orgs/{org_id}/targets?version={SNYK_REST_API_VERSION}&displayName={requests.utils.quote(target_name, safe='')}"
+
+    response = client.send('GET', url)
+
+    if response is None:
+        log.warning("Could not complete request %s, no response", target_name)
+    elif response.status_code == 200:
+        response_json = json.loads(response.content)
+        if (len(response_json['data']) > 0):
+            target_id = response_json['data'][0]['id']
         else:
-            if response.status_code == 200:
-                response_json = json.loads(response.content)
-
-                if 'data' in response_json:
-                    targets = targets + response_json['data']
-                if 'next' not in response_json['links'] or response_json['links']['next'] == '':
-                    break
-                url = f"{SNYK_REST_API_BASE_URL}{response_json['links']['next']}"
-            elif response.status_code == 429:
-                print(f"To many API calls, backing off for {SNYK_API_RATE_LIMIT_BACKOFF_SECONDS} seconds")
-                time.sleep(SNYK_API_RATE_LIMIT_BACKOFF_SECONDS)
-                retry += 1
-                if retry > MAX_RETRIES:
-                    break
-            else:
-                print(f"Could not complete request, reason: {response.status_code}")
-                break
+            log.warning("Did not find a target with name: %s", target_name)
+    else:
+        log.warning("Could not complete request %s, reason: %s", target_name, response.status_code, extra={'fields': {'status': response.status_code}})
 
-    return targets
+    return target_id
 
-def get_projects_from_target(snyk_token, org_id, target_id, verbose=False):
-    project_ids = []
-    retry = 0
+@instrumented
+def iter_target_pages(client, org_id, created_gte=None, verbose=False):
+    """Yield the targets of an org one page (up to 100 targets) at a time
 
-    headers = {
-        'Authorization': f'token {snyk_token}'
-    }
+    When created_gte is set only targets created at or after that ISO 8601 timestamp are returned.
+    Raises IncompleteListing if a page fails.
+    """
+    url = f"{client.rest_url}/orgs/{org_id}/targets?version={SNYK_REST_API_VERSION}&limit=100"
 
-    url = f"{SNYK_REST_API_BASE_URL}/orgs/{org_id}/projects?version={SNYK_REST_API_VERSION}&target_id={target_id}&limit=100"
+    if created_gte is not None:
+        url = f"{url}&created_gte={requests.utils.quote(created_gte, safe='')}"
 
-    while True:
-        response = requests.request(
-            'GET',
-            url,
-            headers=headers,
-            timeout=SNYK_API_TIMEOUT_DEFAULT)
-
-        if response.status_code == 200:
-            response_json = json.loads(response.content)
-            for project in response_json['data']:
-                project_ids.append(project['id'])
+    yield from _iter_pages(client, url)
 
-            if 'next' not in response_json['links'] or response_json['links']['next'] == '':
-                break
+@instrumented
+def get_projects_from_target(client, org_id, target_id, cached=True, verbose=False):
+    """Returns the IDs of every project of the target, or None if a page could not be listed
 
-            url = f"{SNYK_API_BASE_URL}{response_json['links']['next']}"
-            retry = 0
+    Pass cached=False when the target may be deleted based on the list, so it can't be a list
+    cached before some of its projects were added.
+    """
+    project_ids = []
 
-        elif response.status_code == 429:
-            print(f"To many API calls, backing off for {SNYK_API_RATE_LIMIT_BACKOFF_SECONDS} seconds")
-            time.sleep(SNYK_API_RATE_LIMIT_BACKOFF_SECONDS)
-            retry += 1
-            if retry > MAX_RETRIES:
-                break
-        else:
-            print(f"Could not complete request, reason: {response.status_code}")
-            break
+    url = f"{client.rest_url}/orgs/{org_id}/projects?version={SNYK_REST_API_VERSION}&target_id={target_id}&limit=100"
+
+    try:
+        for page in _iter_pages(client, url, cached):
+            for project in page:
+                project_ids.append(project['id'])
+    except IncompleteListing:
+        return None
 
     return project_ids
 
-def get_organization_id_from_name(snyk_token, group_id, org_name, verbose=False):
-    retry = 0
+@instrumented
+def get_organization_id_from_name(client, group_id, org_name, verbose=False):
     org_id = None
 
-    headers = {
-        'Authorization': f'token {snyk_token}'
-    }
+    url = f"{client.rest_url}/groups/{group_id}/orgs?version={SNYK_REST_API_VERSION}&name={requests.utils.quote(org_name, safe='')}"
 
-    url = f"{SNYK_REST_API_BASE_URL}/groups/{group_id}/orgs?version={SNYK_REST_API_VERSION}&name={requests.utils.quote(org_name, safe='')}"
+    response = client.send('GET', url)
 
-    while True:
-        response = requests.request(
-            'GET',
-            url,
-            headers=headers,
-            timeout=SNYK_API_TIMEOUT_DEFAULT)
-
-        if response.status_code == 200:
-            response_json = json.loads(response.content)
-            if (len(response_json['data']) > 0):
-                org_id = response_json['data'][0]['id']
-            else:
-                print(f"Did not find an org with name: {org_name}")
-            break
-        elif response.status_code == 429:
-            print(f"To many API calls, backing off for {SNYK_API_RATE_LIMIT_BACKOFF_SECONDS} seconds")
-            time.sleep(SNYK_API_RATE_LIMIT_BACKOFF_SECONDS)
-            retry += 1
-            if retry > MAX_RETRIES:
-                break
+    if response is None:
+        log.warning("Could not complete request %s, no response", org_name)
+    elif response.status_code == 200:
+        response_json = json.loads(response.content)
+        if (len(response_json['data']) > 0):
+            org_id = response_json['data'][0]['id']
         else:
-            print(f"Could not complete request, reason: {response.status_code}")
-            break
+            log.warning("Did not find an org with name: %s", org_name)
+            client.invalidate_org_lookup(group_id, org_name)
+    else:
+        log.warning("Could not complete request, reason: %s", response.status_code, extra={'fields': {'status': response.status_code}})
 
     return org_id
 
-def move_project_to_org(snyk_token, source_org, target_org, project_id, verbose=False, dry_run=False):
-    retry = 0
+@instrumented
+def iter_org_pages(client, group_id, org_name=None, verbose=False):
+    """Yield the orgs of a group one page (up to 100 orgs) at a time
+
+    When org_name is set only orgs matching that name are returned. Raises IncompleteListing if
+    a page fails.
+    """
+    url = f"{client.rest_url}/groups/{group_id}/orgs?version={SNYK_REST_API_VERSION}&limit=100"
+
+    if org_name is not None:
+        url = f"{url}&name={requests.utils.quote(org_name, safe='')}"
+
+    yield from _iter_pages(client, url)
+
+@instrumented
+def create_org(client, group_id, org_name, source_org_id=None, verbose=False):
+    """Create an org in the group, copying settings and integrations from source_org_id
 
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'token {snyk_token}'
+    Returns the new org's ID, or None if it could not be created.
+    """
+    url = f"{client.v1_url}/org"
+
+    payload = {
+        "name": org_name,
+        "groupId": group_id
     }
 
-    url = f"{SNYK_V1_API_BASE_URL}/org/{source_org}/project/{project_id}/move"
+    if source_org_id is not None:
+        payload["sourceOrgId"] = source_org_id
+
+    response = client.send('POST', url, idempotent=False, headers={'Content-Type': 'application/json'}, data=json.dumps(payload))
+
+    if response is None:
+        log.warning("Could not create org: %s, no response", org_name)
+    elif response.status_code in (200, 201):
+        client.invalidate(f"/groups/{group_id}/orgs")
+        org_id = json.loads(response.content)['id']
+        log.info("Created org: %s, Org ID: %s", org_name, org_id)
+        return org_id
+    else:
+        log.warning("Could not create org: %s, reason: %s", org_name, response.status_code, extra={'fields': {'status': response.status_code}})
+
+    return None
+
+@instrumented
+def move_project_to_org(client, source_org, target_org, project_id, verbose=False, dry_run=False, target_id=None):
+    """Returns whether the project is no longer in source_org
+
+    target_id, the project's target, narrows down which cached project lists are dropped.
+    """
+    if dry_run:
+        log.info("Would move project: %s from org: %s to org: %s", project_id, source_org, target_org, extra={'fields': {'project': project_id, 'org': target_org}})
+        return False
+
+    log.debug("Moving project: %s from org: %s to org: %s", project_id, source_org, target_org)
+
+    response = _send_move(client, source_org, target_org, project_id)
+
+    if response is not None and response.status_code in (200, 404):
+        client.invalidate_moved_projects(source_org, target_org, target_id)
+
+    if response is None:
+        log.warning("Could not migrate project: %s, no response", project_id, extra={'fields': {'project': project_id}})
+    elif response.status_code == 200:
+        log.info("Successfully migrated project: %s", project_id, extra={'fields': {'project': project_id, 'org': target_org}})
+        return True
+    elif response.status_code == 404:
+        log.info("Project already moved: %s", project_id, extra={'fields': {'project': project_id}})
+        return True
+    elif response.status_code == 409:
+        log.info("Project already exists in destination org: %s", project_id, extra={'fields': {'project': project_id}})
+        return True
+    else:
+        log.warning("Could not complete request, reason: %s", response.status_code, extra={'fields': {'status': response.status_code}})
+
+    return False
+
+@instrumented
+def send_project_move(client, source_org, target_org, project_id):
+    """Move one project of a batch, without printing or dropping cached responses
+
+    Returns a tuple of (moved, HTTP status), the status is None when there was no response. The
+    caller prints one summary for the batch and calls client.invalidate_moved_projects once for it.
+    """
+    response = _send_move(client, source_org, target_org, project_id)
+
+    if response is None:
+        return False, None
+
+    return response.status_code in MOVED_STATUSES, response.status_code
+
+def _send_move(client, source_org, target_org, project_id):
+    url = f"{client.v1_url}/org/{source_org}/project/{project_id}/move"
 
     payload = json.dumps({
         "targetOrgId": f"{target_org}"
     })
 
-    print(f"Moving project: {project_id} from org: {source_org} to org: {target_org}")
+    # a 403 is usually transient while the project is being changed by another request
+    return client.send('PUT', url, retry_statuses=(403,), headers={'Content-Type': 'application/json'}, data=payload)
 
-    if not dry_run:
-        while True:
-            try:
-                response = requests.request(
-                    'PUT',
-                    url,
-                    headers=headers,
-                    data=payload,
-                    timeout=SNYK_API_TIMEOUT_DEFAULT)
-
-            except requests.ConnectTimeout:
-                retry += 1
-                if retry > MAX_RETRIES:
-                    break
-                print("ERROR: ConnectionTimeout, trying again")
-            except requests.ReadTimeout:
-                retry += 1
-                if retry > MAX_RETRIES:
-                    break
-                print("ERROR ReadTimeout, trying again")
-            except requests.Timeout:
-                retry += 1
-                if retry > MAX_RETRIES:
-                    break
-                print("ERROR: Timeout, trying again")
-            else:
-                if response.status_code == 200:
-                    print(f"Successfully migrated project: {project_id}")
-                    return True
-                elif response.status_code == 403:
-                    retry += 1
-                    if retry > MAX_RETRIES:
-                        break
-                    time.sleep(5)
-                    print("Couldn't migrate project trying again")
-                elif response.status_code == 404:
-                    print(f"Project already moved: {project_id}")
-                    return True
-                elif response.status_code == 409:
-                    print("Project already exists in destination org")
-                    return True
-                elif response.status_code == 429:
-                    retry += 1
-                    if retry > MAX_RETRIES:
-                        break
-                    time.sleep(SNYK_API_RATE_LIMIT_BACKOFF_SECONDS)
-                    print(f"To many API calls, backing off for {SNYK_API_RATE_LIMIT_BACKOFF_SECONDS} seconds")
-                else:
-                    print(f"Could not complete request, reason: {response.status_code}")
-                    break
+@instrumented
+def delete_target(client, org_id, target_id, verbose=False):
+    url = f"{client.rest_url}/orgs/{org_id}/targets/{target_id}?version={SNYK_REST_API_VERSION}"
 
-    return False
+    response = client.send('DELETE', url)
 
-def delete_target(snyk_token, org_id, target_id, verbose=False):
-    retry = 0
+    if response is not None and response.status_code in (204, 404):
+        client.invalidate_deleted_target(org_id, target_id)
 
-    headers = {
-        'Authorization': f'token {snyk_token}'
-    }
+    if response is None:
+        log.warning("Could not remove target %s, no response", target_id, extra={'fields': {'target_id': target_id}})
+    elif response.status_code == 204:
+        log.info("Successfully removed target %s from org %s", target_id, org_id, extra={'fields': {'target_id': target_id}})
+        return True
+    else:
+        log.warning("Could not remove target %s, reason: %s", target_id, response.status_code, extra={'fields': {'target_id': target_id, 'status': response.status_code}})
+
+    return False
 
-    url = f"{SNYK_REST_API_BASE_URL}/orgs/{org_id}/targets/{target_id}?version={SNYK_REST_API_VERSION}"
+def _iter_pages(client, url, cached=True):
+    """Yield the data of every page of a REST API list endpoint
 
+    Raises IncompleteListing if a page fails, after the pages before it have been yielded.
+    """
     while True:
-        try:
-            response = requests.request(
-                'DELETE',
-                url,
-                headers=headers,
-                timeout=SNYK_API_TIMEOUT_DEFAULT)
-
-        except requests.ConnectTimeout:
-            retry += 1
-            if retry > MAX_RETRIES:
-                break
-            print("ERROR: ConnectionTimeout, trying again")
-        except requests.ReadTimeout:
-            retry += 1
-            if retry > MAX_RETRIES:
-                break
-            print("ERROR ReadTimeout, trying again")
-        except requests.Timeout:
-            retry += 1
-            if retry > MAX_RETRIES:
-                break
-            print("ERROR: Timeout, trying again")
-        else:
-            if response.status_code == 204:
-                print(f"Successfully removed target {target_id} from org {org_id}")
-                return True
-            elif response.status_code == 429:
-                print(f"To many API calls, backing off for {SNYK_API_RATE_LIMIT_BACKOFF_SECONDS} seconds")
-                time.sleep(SNYK_API_RATE_LIMIT_BACKOFF_SECONDS)
-                retry += 1
-                if retry > MAX_RETRIES:
-                    break
-            else:
-                print(f"Could not remove target {target_id}, reason: {response.status_code}")
-                break
+        response = client.send('GET', url, cached=cached)
+
+        if response is None:
+            log.warning("Could not complete request, no response")
+            raise IncompleteListing(url, None)
+        if response.status_code != 200:
+            log.warning("Could not complete request, reason: %s", response.status_code, extra={'fields': {'status': response.status_code}})
+            raise IncompleteListing(url, response.status_code)
+
+        response_json = json.loads(response.content)
+
+        if 'data' in response_json:
+            yield response_json['data']
+        if 'next' not in response_json['links'] or response_json['links']['next'] == '':
+            break
+
+        url = client.next_url(response_json['links']['next'])
@@ -0,0 +1,266 @@
+"""asyncio versions of the Snyk API calls made for every CSV row by migrate-projects
+
+Requires the optional httpx dependency, `poetry install --extras async`.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import quote
+
+from csv_to_json_api_import.api import SnykApi
+from csv_to_json_api_import.constants import *
+from csv_to_json_api_import.metrics import instrumented
+from csv_to_json_api_import.ratelimit import RateLimiter
+from csv_to_json_api_import.retry import CircuitBreaker, RetryPolicy, failure_delay
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+log = logging.getLogger(__name__)
+
+ENDPOINTS = SNYK_API_ENDPOINTS
+
+class AsyncSnykClient(SnykApi):
+    """httpx.AsyncClient wrapper with one concurrency semaphore per endpoint
+
+    The semaphores cap how many calls to each endpoint are in flight at once, so e.g. hundreds
+    of project moves can run concurrently while target lookups stay at a handful. Every request
+    also takes a token from the rate limiter and is retried under the retry policy and circuit
+    breaker, and GETs are answered from the response cache, all of which may be shared with a
+    SnykClient. Requests are recorded in metrics, when given, under the instrumented function
+    that made them.
+    """
+
+    def __init__(self, snyk_token, endpoint_limits, rate_limiter=None, rate_limit=SNYK_API_RATE_LIMIT_DEFAULT, api_url=None,
+                 retry_policy=None, breaker=None, cache=None, metrics=None):
+        if httpx is None:
+            raise RuntimeError("The async backend requires httpx, install it with: poetry install --extras async")
+
+        super().__init__(api_url)
+
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter(rate_limit)
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.cache = cache
+        self.metrics = metrics
+        self.semaphores = {endpoint: asyncio.Semaphore(endpoint_limits[endpoint]) for endpoint in ENDPOINTS}
+
+        max_connections = sum(endpoint_limits.values())
+        self.client = httpx.AsyncClient(
+            headers={'Authorization': f'token {snyk_token}'},
+            timeout=SNYK_API_TIMEOUT_DEFAULT,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections))
+
+    async def send(self, endpoint, method, url, retry_statuses=(), cached=True, **kwargs):
+        """Make a request, retrying it under the client's retry policy, see SnykClient.send"""
+        cacheable = cached and method == 'GET' and self.cache is not None
+
+        if cacheable:
+            body = self.cache.get(url)
+            if body is not None:
+                return httpx.Response(200, content=body, request=httpx.Request(method, url))
+
+        attempt = 0
+
+        while True:
+            wait = self.breaker.wait_seconds()
+            if wait > 0:
+                await self.sleep(wait)
+
+            self.retry_policy.record_request()
+
+            if attempt > 0 and self.metrics is not None:
+                self.metrics.record_retry(self.metrics.current_task())
+
+            try:
+                response = await self.request(endpoint, method, url, **kwargs)
+            except httpx.TransportError as e:
+                response = None
+                reason = type(e).__name__
+            else:
+                reason = f"HTTP {response.status_code}"
+
+            delay = failure_delay(self, attempt, reason, response, retry_statuses)
+
+            if delay is None:
+                if cacheable and response is not None and response.status_code == 200:
+                    self.cache.put(url, response.content)
+                return response
+            if delay > 0:
+                await self.sleep(delay)
+
+            attempt += 1
+
+    async def request(self, endpoint, method, url, **kwargs):
+        async with self.semaphores[endpoint]:
+            await self.rate_limiter.acquire_async()
+
+            if self.metrics is None:
+                return await self.client.request(method, url, **kwargs)
+
+            return await self._measured_request(method, url, **kwargs)
+
+    async def _measured_request(self, method, url, **kwargs):
+        metrics = self.metrics
+        name = metrics.current_task()
+
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            metrics.record_request(type(e).__name__, time.perf_counter() - start, name)
+            raise
+
+        metrics.record_request(response.status_code, time.perf_counter() - start, name)
+
+        return response
+
+    async def sleep(self, seconds):
+        """Sleep outside of the rate limiter, e.g. before retrying a failed call"""
+        if self.metrics is not None:
+            self.metrics.record_sleep(seconds)
+
+        await asyncio.sleep(seconds)
+
+    async def close(self):
+        await self.client.aclose()
+
+@instrumented
+async def get_target_id_from_name(client, org_id, target_name, verbose=False):
+    target_id = None
+
+    url = f"{client.rest_url}/orgs/{org_id}/targets?version={SNYK_REST_API_VERSION}&displayName={quote(target_name, safe='')}"
+
+    response = await client.send('targets', 'GET', url)
+
+    if response is None:
+        log.warning("Could not complete request %s, no response", target_name)
+    elif response.status_code == 200:
+        response_json = json.loads(response.content)
+        if (len(response_json['data']) > 0):
+            target_id = response_json['data'][0]['id']
+        else:
+            log.warning("Did not find a target with name: %s", target_name)
+    else:
+        log.warning("Could not complete request %s, reason: %s", target_name, response.status_code, extra={'fields': {'status': response.status_code}})
+
+    return target_id
+
+@instrumented
+async def get_projects_from_target(client, org_id, target_id, cached=True, verbose=False):
+    """Returns a tuple of (project IDs, HTTP status of the last response), the IDs are None if a page could not be listed"""
+    project_ids = []
+
+    url = f"{client.rest_url}/orgs/{org_id}/projects?version={SNYK_REST_API_VERSION}&target_id={target_id}&limit=100"
+
+    while True:
+        response = await client.send('projects', 'GET', url, cached=cached)
+
+        if response is None:
+            log.warning("Could not complete request, no response")
+            return None, None
+        if response.status_code != 200:
+            log.warning("Could not complete request, reason: %s", response.status_code, extra={'fields': {'status': response.status_code}})
+            return None, response.status_code
+
+        response_json = json.loads(response.content)
+        for project in response_json['data']:
+            project_ids.append(project['id'])
+
+        if 'next' not in response_json['links'] or response_json['links']['next'] == '':
+            break
+
+        url = client.next_url(response_json['links']['next'])
+
+    return project_ids, response.status_code
+
+@instrumented
+async def get_organization_id_from_name(client, group_id, org_name, verbose=False):
+    org_id = None
+
+    url = f"{client.rest_url}/groups/{group_id}/orgs?version={SNYK_REST_API_VERSION}&name={quote(org_name, safe='')}"
+
+    response = await client.send('orgs', 'GET', url)
+
+    if response is None:
+        log.warning("Could not complete request %s, no response", org_name)
+    elif response.status_code == 200:
+        response_json = json.loads(response.content)
+        if (len(response_json['data']) > 0):
+            org_id = response_json['data'][0]['id']
+        else:
+            log.warning("Did not find an org with name: %s", org_name)
+            client.invalidate_org_lookup(group_id, org_name)
+    else:
+        log.warning("Could not complete request, reason: %s", response.status_code, extra={'fields': {'status': response.status_code}})
+
+    return org_id
+
+@instrumented
+async def move_project_to_org(client, source_org, target_org, project_id, verbose=False, dry_run=False, target_id=None):
+    """Returns a tuple of (moved, HTTP status of the last response)"""
+    url = f"{client.v1_url}/org/{source_org}/project/{project_id}/move"
+
+    payload = json.dumps({
+        "targetOrgId": f"{target_org}"
+    })
+
+    if dry_run:
+        log.info("Would move project: %s from org: %s to org: %s", project_id, source_org, target_org, extra={'fields': {'project': project_id, 'org': target_org}})
+        return False, None
+
+    log.debug("Moving project: %s from org: %s to org: %s", project_id, source_org, target_org)
+
+    # a 403 is usually transient while the project is being changed by another request
+    response = await client.send(
+        'move',
+        'PUT',
+        url,
+        retry_statuses=(403,),
+        headers={'Content-Type': 'application/json'},
+        content=payload)
+
+    if response is None:
+        log.warning("Could not migrate project: %s, no response", project_id, extra={'fields': {'project': project_id}})
+        return False, None
+
+    if response.status_code in (200, 404):
+        client.invalidate_moved_projects(source_org, target_org, target_id)
+
+    if response.status_code == 200:
+        log.info("Successfully migrated project: %s", project_id, extra={'fields': {'project': project_id, 'org': target_org}})
+        return True, response.status_code
+    elif response.status_code == 404:
+        log.info("Project already moved: %s", project_id, extra={'fields': {'project': project_id}})
+        return True, response.status_code
+    elif response.status_code == 409:
+        log.info("Project already exists in destination org: %s", project_id, extra={'fields': {'project': project_id}})
+        return True, response.status_code
+
+    log.warning("Could not complete request, reason: %s", response.status_code, extra={'fields': {'status': response.status_code}})
+    return False, response.status_code
+
+@instrumented
+async def delete_target(client, org_id, target_id, verbose=False):
+    """Returns a tuple of (deleted, HTTP status of the last response)"""
+    url = f"{client.rest_url}/orgs/{org_id}/targets/{target_id}?version={SNYK_REST_API_VERSION}"
+
+    response = await client.send('delete', 'DELETE', url)
+
+    if response is None:
+        log.warning("Could not remove target %s, no response", target_id, extra={'fields': {'target_id': target_id}})
+        return False, None
+
+    if response.status_code in (204, 404):
+        client.invalidate_deleted_target(org_id, target_id)
+
+    if response.status_code == 204:
+        log.info("Successfully removed target %s from org %s", target_id, org_id, extra={'fields': {'target_id': target_id}})
+        return True, response.status_code
+
+    log.warning("Could not remove target %s, reason: %s", target_id, response.status_code, extra={'fields': {'target_id': target_id, 'status': response.status_code}})
+    return False, response.status_code
@@ -0,0 +1,59 @@
+import csv
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from csv_to_json_api_import import snyk
+from csv_to_json_api_import.bench.fake_snyk import FakeSnyk, serve
+from csv_to_json_api_import.retry import RetryPolicy
+from csv_to_json_api_import.rows import COLUMNS
+
+ROOT = Path(__file__).resolve().parent.parent
+
+CSV_ROWS = [
+    ['', '123', 'Test 1', 'https://github.com/example_org/example_repo_1', 'example_org/example_repo_1', '1'],
+    ['', '123', 'Test 1', 'https://github.com/example_org/example_repo_2', 'example_org/example_repo_2', '1'],
+    ['', '456', 'Test 2', 'https://github.com/example_org/example_repo_3', 'example_org/example_repo_3', '1']
+]
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+
+    return path
+
+def run_cli(server, args, cwd):
+    """Run the CLI against the fake server in a subprocess, returns the completed process"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT), os.environ.get('PYTHONPATH')])))
+
+    return subprocess.run(
+        [sys.executable, '-m', 'csv_to_json_api_import', '--api-url', server.url, *args],
+        cwd=cwd, env=env, capture_output=True, text=True, timeout=60)
+
+@pytest.fixture
+def csv_path(tmp_path):
+    return write_csv(tmp_path / 'assets.csv', CSV_ROWS)
+
+@pytest.fixture
+def fake():
+    return FakeSnyk()
+
+@pytest.fixture
+def server(fake):
+    server = serve(fake)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def client(server):
+    client = snyk.SnykClient('test-token', rate_limit=0, api_url=server.url)
+    # failures are retried right away
+    client.retry_policy = RetryPolicy(base_delay=0)
+    yield client
+    client.close()
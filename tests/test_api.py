@@ -0,0 +1,48 @@
+from csv_to_json_api_import.api import SnykApi
+from csv_to_json_api_import.constants import SNYK_REST_API_BASE_URL
+
+class RecordingCache:
+    def __init__(self):
+        self.invalidated = []
+
+    def invalidate(self, prefix, contains=None):
+        self.invalidated.append((prefix, contains))
+
+def _api(api_url=None):
+    api = SnykApi(api_url)
+    api.cache = RecordingCache()
+    return api
+
+def test_urls():
+    assert _api().rest_url == SNYK_REST_API_BASE_URL
+
+    api = _api('http://127.0.0.1:8080/')
+    assert (api.api_url, api.rest_url, api.v1_url) == ('http://127.0.0.1:8080', 'http://127.0.0.1:8080/rest', 'http://127.0.0.1:8080/v1')
+
+def test_next_url():
+    api = _api('http://fake')
+
+    assert api.next_url('https://api.snyk.io/rest/orgs/o/targets?starting_after=1') == 'https://api.snyk.io/rest/orgs/o/targets?starting_after=1'
+    assert api.next_url('/rest/orgs/o/targets?starting_after=1') == 'http://fake/rest/orgs/o/targets?starting_after=1'
+    assert api.next_url('/orgs/o/targets?starting_after=1') == 'http://fake/rest/orgs/o/targets?starting_after=1'
+
+def test_invalidation():
+    api = _api('http://fake')
+
+    api.invalidate_moved_projects('source', 'dest', 'target')
+    api.invalidate_deleted_target('source', 'target')
+    api.invalidate_org_lookup('group', 'a/b c')
+
+    assert api.cache.invalidated == [
+        ('http://fake/rest/orgs/source/projects', 'target_id=target'),
+        ('http://fake/rest/orgs/dest/projects', None),
+        ('http://fake/rest/orgs/source/targets', None),
+        ('http://fake/rest/orgs/source/projects', 'target_id=target'),
+        ('http://fake/rest/groups/group/orgs', 'name=a%2Fb%20c')
+    ]
+
+def test_invalidation_without_cache():
+    api = SnykApi()
+    api.cache = None
+
+    api.invalidate_moved_projects('source', 'dest')
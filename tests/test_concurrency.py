@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from csv_to_json_api_import import concurrency
+from csv_to_json_api_import.concurrency import AdaptiveLimit
+from csv_to_json_api_import.retry import RetryPolicy
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(concurrency, 'time', clock)
+    return clock
+
+def _call(limit, clock, status=200, latency=1.0):
+    started = limit.acquire()
+    clock.now += latency
+    limit.release(started, status)
+
+def test_additive_increase(clock):
+    limit = AdaptiveLimit(4, maximum=8)
+
+    # each call adds 1 / limit, so about limit calls add one
+    for _ in range(4):
+        _call(limit, clock)
+    assert 4 < limit.limit < 5
+
+    _call(limit, clock)
+    assert int(limit.limit) == 5
+
+    for _ in range(5):
+        _call(limit, clock)
+    assert int(limit.limit) == 6
+
+    assert [(entry['limit'], entry['reason']) for entry in limit.stats()['history']] == [(4, 'start'), (5, 'increase'), (6, 'increase')]
+
+def test_maximum(clock):
+    limit = AdaptiveLimit(2, maximum=3)
+
+    for _ in range(50):
+        _call(limit, clock)
+
+    assert limit.limit == 3
+
+def test_congestion_halves(clock):
+    limit = AdaptiveLimit(8)
+
+    _call(limit, clock, status=429)
+    assert limit.limit == 4
+    _call(limit, clock, status=503)
+    assert limit.limit == 2
+    _call(limit, clock, status=None)
+    assert limit.limit == 1
+    _call(limit, clock, status=429)
+    assert limit.limit == 1
+
+    assert limit.stats()['cuts'] == {'congestion': 4, 'latency': 0}
+
+def test_no_double_cut_for_calls_in_flight(clock):
+    limit = AdaptiveLimit(8)
+
+    in_flight = [limit.acquire() for _ in range(4)]
+    clock.now += 1
+
+    # the first 429 cuts the limit, the others were sent before the cut
+    for started in in_flight:
+        limit.release(started, 429)
+    assert limit.limit == 4
+
+    # a call sent after the cut cuts it again
+    _call(limit, clock, status=429)
+    assert limit.limit == 2
+    assert limit.stats()['cuts']['congestion'] == 2
+
+def test_latency_cut(clock):
+    limit = AdaptiveLimit(8, maximum=8)
+
+    for _ in range(4):
+        _call(limit, clock, latency=1.0)
+    assert limit.limit == 8
+
+    # the moving average goes over twice the best latency
+    _call(limit, clock, latency=10.0)
+    assert limit.limit == 4
+    assert limit.stats()['cuts'] == {'congestion': 0, 'latency': 1}
+
+    # the average is reset to the best, so the next fast call doesn't cut again
+    _call(limit, clock, latency=1.0)
+    assert limit.limit == 4.25
+
+def test_retry_policy_congestion(clock):
+    policy = RetryPolicy()
+    limit = AdaptiveLimit(8, retry_policy=policy)
+
+    # a 429 on any other call of the run, retried by the policy
+    policy.record_congestion()
+    _call(limit, clock, status=200)
+    assert limit.limit == 4
+
+    _call(limit, clock, status=200)
+    assert limit.limit == 4.25
+
+def test_acquire_waits_for_limit(clock):
+    limit = AdaptiveLimit(1)
+
+    async def run():
+        first = await limit.acquire_async()
+        second = asyncio.ensure_future(limit.acquire_async())
+
+        await asyncio.sleep(0.01)
+        assert not second.done()
+
+        limit.release(first, 200)
+        await asyncio.wait_for(second, 1)
+        assert limit.in_flight == 1
+
+    asyncio.run(run())
@@ -0,0 +1,33 @@
+from conftest import run_cli
+
+from csv_to_json_api_import.bench.fake_snyk import FAKE_SOURCE_ORG
+from csv_to_json_api_import.journal import Journal
+from csv_to_json_api_import.rows import read_rows
+
+def _extract(server, csv_path, cwd):
+    result = run_cli(server, [
+        'extract-remaining-targets', 'test-token', FAKE_SOURCE_ORG,
+        '--csv-path', str(csv_path), '--output-csv-path', 'remaining.csv'], cwd)
+    assert result.returncode == 0, result.stderr
+
+    return [row.target_name for row in read_rows(cwd / 'remaining.csv')]
+
+def test_incremental_keeps_targets_whose_lookup_fails(tmp_path, csv_path, fake, server):
+    fake.load_csv(csv_path)
+    target_names = [row.target_name for row in read_rows(csv_path)]
+
+    assert _extract(server, csv_path, tmp_path) == target_names
+
+    # every target had a move recorded, the first one's deletion was lost in a crash
+    journal = Journal(tmp_path / 'migration-journal.jsonl', FAKE_SOURCE_ORG)
+    for target_name in target_names:
+        target_id = next(iter(fake.targets_by_name[(FAKE_SOURCE_ORG, target_name)]))
+        journal.record_move(target_name, target_id, 'project', 'org')
+    journal.close()
+    fake.delete_target(next(iter(fake.targets_by_name[(FAKE_SOURCE_ORG, target_names[0])])))
+
+    fake.fail('list_targets', 403, param='displayName')
+    assert _extract(server, csv_path, tmp_path) == target_names
+
+    fake.failures.clear()
+    assert _extract(server, csv_path, tmp_path) == target_names[1:]
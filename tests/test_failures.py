@@ -0,0 +1,62 @@
+import csv
+
+from conftest import run_cli
+
+from csv_to_json_api_import.bench.fake_snyk import FAKE_GROUP_ID, FAKE_SOURCE_ORG
+from csv_to_json_api_import.failures import FAILURE_COLUMNS, FailureSink
+from csv_to_json_api_import.rows import COLUMNS, read_header, read_rows
+
+def _read(path):
+    with open(path, newline='', encoding='utf-8') as csv_file:
+        return list(csv.reader(csv_file))
+
+def test_failure_sink(tmp_path, csv_path):
+    path = tmp_path / 'errored.csv'
+    sink = FailureSink(path, read_header(csv_path), flush_rows=1000)
+
+    rows = list(read_rows(csv_path))
+    sink.add(rows[0], "org not found")
+    sink.add(rows[1], "target delete failed", 500)
+    sink.close()
+
+    assert _read(path) == [
+        [*COLUMNS, *FAILURE_COLUMNS],
+        [*rows[0].values, "org not found", ''],
+        [*rows[1].values, "target delete failed", '500']
+    ]
+    assert sink.total == 2
+
+def test_failure_file_as_input(tmp_path, csv_path):
+    previous = tmp_path / 'previous.csv'
+    with open(previous, 'w', newline='', encoding='utf-8') as csv_file:
+        csv.writer(csv_file).writerows([
+            ['failure reason', *COLUMNS, 'HTTP Status'],
+            ["org not found", '', '123', 'Test 1', 'url', 'org/repo', '1', '']
+        ])
+
+    path = tmp_path / 'errored.csv'
+    sink = FailureSink(path, read_header(previous))
+    sink.add(next(read_rows(previous)), "target delete failed", 403)
+    sink.close()
+
+    assert _read(path) == [
+        [*COLUMNS, *FAILURE_COLUMNS],
+        ['', '123', 'Test 1', 'url', 'org/repo', '1', "target delete failed", '403']
+    ]
+
+def test_retry_run(tmp_path, csv_path, fake, server):
+    fake.load_csv(csv_path)
+    fake.fail('delete_target', 403)
+
+    for input_path, output_path in ((csv_path, 'errored.csv'), ('errored.csv', 'errored-again.csv')):
+        result = run_cli(server, [
+            'migrate-projects', 'test-token', FAKE_GROUP_ID, FAKE_SOURCE_ORG,
+            '--csv-path', str(input_path), '--output-csv-path', output_path, '--resume'], tmp_path)
+        assert result.returncode == 0, result.stderr
+
+    errored = _read(tmp_path / 'errored-again.csv')
+
+    assert errored[0] == [*COLUMNS, *FAILURE_COLUMNS]
+    assert len(errored) == 4
+    # the retry finds the targets emptied by the first run, and fails to delete them again
+    assert {tuple(row[-2:]) for row in errored[1:]} == {("target delete failed", '403')}
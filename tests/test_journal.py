@@ -0,0 +1,146 @@
+import json
+
+import pytest
+from conftest import run_cli
+
+from csv_to_json_api_import import migrate
+from csv_to_json_api_import.bench.fake_snyk import FAKE_GROUP_ID, FAKE_SOURCE_ORG
+from csv_to_json_api_import.journal import Journal
+from csv_to_json_api_import.rows import read_rows
+
+def test_load_reads_recorded_work(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+
+    journal = Journal(path, FAKE_SOURCE_ORG)
+    journal.record_move('org/repo-1', 'target-1', 'project-1', 'org-1')
+    journal.record_moves('org/repo-2', 'target-2', ['project-2', 'project-3'], 'org-1')
+    journal.record_delete('org/repo-2', 'target-2')
+    journal.close()
+
+    loaded = Journal(path, FAKE_SOURCE_ORG).load()
+
+    assert loaded.moved_projects == {'project-1', 'project-2', 'project-3'}
+    assert loaded.moved_targets == {'org/repo-1', 'org/repo-2'}
+    assert loaded.deleted_targets == {'org/repo-2'}
+    assert loaded.is_target_deleted('org/repo-2')
+    assert not loaded.is_target_deleted('org/repo-1')
+
+def test_load_skips_other_orgs(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+
+    journal = Journal(path, 'other-org')
+    journal.record_move('org/repo-1', 'target-1', 'project-1', 'org-1')
+    journal.record_delete('org/repo-1', 'target-1')
+    journal.close()
+
+    journal = Journal(path, FAKE_SOURCE_ORG)
+    journal.record_move('org/repo-2', 'target-2', 'project-2', 'org-1')
+    journal.close()
+
+    loaded = Journal(path, FAKE_SOURCE_ORG).load()
+
+    assert loaded.moved_projects == {'project-2'}
+    assert loaded.moved_targets == {'org/repo-2'}
+    assert not loaded.deleted_targets
+
+def test_load_skips_partial_last_line(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+
+    journal = Journal(path, FAKE_SOURCE_ORG)
+    journal.record_delete('org/repo-1', 'target-1')
+    journal.close()
+
+    with open(path, 'a', encoding='utf-8') as journal_file:
+        journal_file.write('{"event": "delete", "tar')
+
+    assert Journal(path, FAKE_SOURCE_ORG).load().deleted_targets == {'org/repo-1'}
+
+def test_load_without_file(tmp_path):
+    journal = Journal(tmp_path / 'journal.jsonl', FAKE_SOURCE_ORG).load()
+
+    assert not journal.deleted_targets and not journal.moved_projects
+    # nothing is written until the first record
+    assert not (tmp_path / 'journal.jsonl').exists()
+
+def test_close_writes_unsynced_records(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+
+    journal = Journal(path, FAKE_SOURCE_ORG, sync_every=1000, sync_seconds=1000)
+    journal.record_move('org/repo-1', 'target-1', 'project-1', 'org-1')
+    assert path.read_text() == ''
+
+    journal.close()
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(record['event'], record['project']) for record in records] == [('move', 'project-1')]
+
+def test_resume_skips_moved_projects(tmp_path, csv_path, fake, client):
+    fake.load_csv(csv_path)
+    row = next(read_rows(csv_path))
+    target_id = next(iter(fake.targets_by_name[(FAKE_SOURCE_ORG, row.target_name)]))
+    moved, pending = fake.target_projects[target_id]
+
+    path = tmp_path / 'journal.jsonl'
+    journal = Journal(path, FAKE_SOURCE_ORG)
+    journal.record_move(row.target_name, target_id, moved, 'org-1')
+    journal.close()
+
+    journal = Journal(path, FAKE_SOURCE_ORG).load()
+    migration = migrate.Migration(
+        group_id=FAKE_GROUP_ID, source_org=FAKE_SOURCE_ORG, dry_run=False, targets=None, orgs=None, journal=journal)
+
+    projects_migrated, failure = migrate.migrate_row(client, migration, row, None)
+    journal.close()
+
+    assert (projects_migrated, failure) == (2, None)
+    assert fake.stats()['calls']['move_project'] == 1
+    assert fake.projects[pending]['org'] != FAKE_SOURCE_ORG
+    assert fake.projects[moved]['org'] == FAKE_SOURCE_ORG
+    assert target_id not in fake.targets
+    assert Journal(path, FAKE_SOURCE_ORG).load().moved_projects == {moved, pending}
+
+def test_resume_skips_deleted_targets(tmp_path, csv_path, fake, server):
+    fake.load_csv(csv_path)
+    row = next(read_rows(csv_path))
+    target_id = next(iter(fake.targets_by_name[(FAKE_SOURCE_ORG, row.target_name)]))
+
+    # the first run deleted the first row's target before it was interrupted
+    journal = Journal(tmp_path / 'migration-journal.jsonl', FAKE_SOURCE_ORG)
+    journal.record_delete(row.target_name, target_id)
+    journal.close()
+    fake.delete_target(target_id)
+
+    result = run_cli(server, [
+        'migrate-projects', 'test-token', FAKE_GROUP_ID, FAKE_SOURCE_ORG,
+        '--csv-path', str(csv_path), '--resume', '--summary-json', 'summary.json'], tmp_path)
+    assert result.returncode == 0, result.stderr
+
+    summary = json.loads((tmp_path / 'summary.json').read_text())
+    assert summary['rows_resumed'] == 1
+    assert fake.stats()['calls']['move_project'] == 4
+    assert not fake.org_targets[FAKE_SOURCE_ORG]
+
+@pytest.mark.parametrize('backend', ['threads', 'pipeline', 'async'])
+def test_resume_deletes_emptied_targets(tmp_path, csv_path, fake, server, backend):
+    if backend == 'async':
+        pytest.importorskip('httpx')
+
+    fake.load_csv(csv_path)
+    args = ['migrate-projects', 'test-token', FAKE_GROUP_ID, FAKE_SOURCE_ORG, '--csv-path', str(csv_path), '--backend', backend]
+
+    # the first run moves every project but can't delete the targets
+    fake.fail('delete_target', 403)
+    result = run_cli(server, args, tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert len(fake.org_targets[FAKE_SOURCE_ORG]) == 3
+
+    fake.failures.clear()
+    fake.reset_stats()
+    result = run_cli(server, [*args, '--resume'], tmp_path)
+    assert result.returncode == 0, result.stderr
+
+    calls = fake.stats()['calls']
+    assert calls['delete_target'] == 3
+    assert 'move_project' not in calls
+    assert not fake.org_targets[FAKE_SOURCE_ORG]
+    assert Journal(tmp_path / 'migration-journal.jsonl', FAKE_SOURCE_ORG).load().deleted_targets == {row.target_name for row in read_rows(csv_path)}
@@ -0,0 +1,104 @@
+import asyncio
+import csv
+import json
+
+import pytest
+from conftest import run_cli
+
+from csv_to_json_api_import import migrate
+from csv_to_json_api_import.bench.fake_snyk import FAKE_GROUP_ID, FAKE_SOURCE_ORG
+from csv_to_json_api_import.constants import SNYK_API_ENDPOINTS
+from csv_to_json_api_import.journal import Journal
+from csv_to_json_api_import.rows import read_rows
+
+@pytest.fixture
+def migration(tmp_path, server):
+    journal = Journal(tmp_path / 'journal.jsonl', FAKE_SOURCE_ORG)
+    yield migrate.Migration(
+        group_id=FAKE_GROUP_ID, source_org=FAKE_SOURCE_ORG, dry_run=False, targets=None, orgs=None, journal=journal,
+        api_url=server.url)
+    journal.close()
+
+@pytest.fixture
+def row(csv_path, fake):
+    fake.page_size = 2
+    fake.load_csv(csv_path, projects_per_target=5)
+    return next(read_rows(csv_path))
+
+def _target_id(fake, row):
+    return next(iter(fake.targets_by_name[(FAKE_SOURCE_ORG, row.target_name)]))
+
+def test_migrate_row(fake, client, migration, row):
+    target_id = _target_id(fake, row)
+
+    assert migrate.migrate_row(client, migration, row, None) == (5, None)
+    assert target_id not in fake.targets
+    assert migration.journal.is_target_deleted(row.target_name)
+
+def test_incomplete_listing_keeps_target(fake, client, migration, row):
+    target_id = _target_id(fake, row)
+    # the first page lists fine, the second fails
+    fake.fail('list_projects', 500, offset=2)
+
+    assert migrate.migrate_row(client, migration, row, None) == (0, ("project listing failed", 500))
+    assert target_id in fake.targets
+    assert 'move_project' not in fake.stats()['calls']
+    assert 'delete_target' not in fake.stats()['calls']
+
+def test_incomplete_listing_keeps_target_pipelined(fake, client, migration, row):
+    target_id = _target_id(fake, row)
+    fake.fail('list_projects', 500, offset=2)
+    results = []
+
+    migrate.migrate_rows_pipelined(
+        client, migration, [row], {endpoint: 1 for endpoint in SNYK_API_ENDPOINTS},
+        lambda row, projects_migrated, failure: results.append((row.target_name, projects_migrated, failure)))
+
+    assert results == [(row.target_name, 0, ("project listing failed", 500))]
+    assert target_id in fake.targets
+    assert 'move_project' not in fake.stats()['calls']
+    assert 'delete_target' not in fake.stats()['calls']
+
+def test_incomplete_listing_keeps_target_async(fake, client, migration, row):
+    pytest.importorskip('httpx')
+
+    target_id = _target_id(fake, row)
+    fake.fail('list_projects', 500, offset=2)
+    results = []
+
+    asyncio.run(migrate.migrate_rows_async(
+        'test-token', migration, [row], 1, {endpoint: 1 for endpoint in SNYK_API_ENDPOINTS}, client,
+        lambda row, projects_migrated, failure: results.append((row.target_name, projects_migrated, failure))))
+
+    assert results == [(row.target_name, 0, ("project listing failed", 500))]
+    assert target_id in fake.targets
+    assert 'move_project' not in fake.stats()['calls']
+    assert 'delete_target' not in fake.stats()['calls']
+
+def test_dry_run_prints_moves(caplog, fake, client, migration, row):
+    migration.dry_run = True
+
+    with caplog.at_level('INFO'):
+        assert migrate.migrate_row(client, migration, row, None) == (0, ("dry run", None))
+
+    assert sum(record.getMessage().startswith("Would move project") for record in caplog.records) == 5
+    assert 'move_project' not in fake.stats()['calls']
+
+def test_deferred_delete_failures_are_counted(tmp_path, csv_path, fake, server):
+    fake.load_csv(csv_path)
+    fake.fail('delete_target', 403)
+
+    result = run_cli(server, [
+        'migrate-projects', 'test-token', FAKE_GROUP_ID, FAKE_SOURCE_ORG, '--csv-path', str(csv_path),
+        '--defer-deletes', '--concurrency', '4', '--output-csv-path', 'errored.csv', '--summary-json', 'summary.json'], tmp_path)
+    assert result.returncode == 0, result.stderr
+
+    summary = json.loads((tmp_path / 'summary.json').read_text())
+    assert (summary['rows'], summary['rows_failed'], summary['projects_migrated']) == (3, 3, 6)
+
+    with open(tmp_path / 'errored.csv', newline='', encoding='utf-8') as errored_file:
+        errored = list(csv.DictReader(errored_file))
+
+    assert sorted((row['Project Name'], row['Failure Reason'], row['HTTP Status']) for row in errored) == [
+        (row.target_name, 'target delete failed', '403') for row in read_rows(csv_path)
+    ]
@@ -0,0 +1,117 @@
+import csv
+
+import pytest
+from conftest import run_cli, write_csv
+
+from csv_to_json_api_import.bench.fake_snyk import FAKE_GROUP_ID, FAKE_SOURCE_ORG
+from csv_to_json_api_import.plan import Plan, PlanGroup, PlannedRow, write_plan
+
+HEADER = ['Tech Org', 'Asset ID', 'Asset Name', 'Repo URL', 'Project Name', 'Repo Count']
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'migration.plan'
+    groups = [
+        ('123_Test 1', 'org-1', [
+            ('org/repo-1', 'target-1', ['project-1', 'project-2'], ['', '123', 'Test 1', 'url-1', 'org/repo-1', '1']),
+            ('org/repo-2', 'target-2', ['project-3'], ['', '123', 'Test 1', 'url-2', 'org/repo-2', '1'])
+        ]),
+        # a missing org, target and a target without projects
+        ('456_Tëst 2', None, [
+            ('org/repo-3', None, [], ['', '456', 'Tëst 2', 'url-3', 'org/repo-3', '1']),
+            ('org/repo-4', 'target-4', [], ['', '456', 'Tëst 2', 'url-4', 'org/repo-4', ''])
+        ])
+    ]
+
+    write_plan(path, {'group_id': 'group', 'source_org': 'source'}, HEADER, groups)
+    plan = Plan(path)
+
+    try:
+        assert plan.meta['group_id'] == 'group' and plan.meta['source_org'] == 'source'
+        assert plan.header == HEADER
+        assert (plan.group_count, plan.row_count, plan.project_count) == (2, 4, 3)
+
+        assert list(plan.groups()) == [
+            PlanGroup('123_Test 1', 'org-1', 2, 3),
+            PlanGroup('456_Tëst 2', '', 2, 0)
+        ]
+        assert list(plan.rows()) == [
+            PlannedRow('123_Test 1', 'org-1', 'org/repo-1', 'target-1', ['project-1', 'project-2'], ['', '123', 'Test 1', 'url-1', 'org/repo-1', '1']),
+            PlannedRow('123_Test 1', 'org-1', 'org/repo-2', 'target-2', ['project-3'], ['', '123', 'Test 1', 'url-2', 'org/repo-2', '1']),
+            PlannedRow('456_Tëst 2', '', 'org/repo-3', '', [], ['', '456', 'Tëst 2', 'url-3', 'org/repo-3', '1']),
+            PlannedRow('456_Tëst 2', '', 'org/repo-4', 'target-4', [], ['', '456', 'Tëst 2', 'url-4', 'org/repo-4', ''])
+        ]
+    finally:
+        plan.close()
+
+def test_empty_plan(tmp_path):
+    path = tmp_path / 'migration.plan'
+    write_plan(path, {}, HEADER, [])
+    plan = Plan(path)
+
+    try:
+        assert plan.header == HEADER
+        assert list(plan.groups()) == [] and list(plan.rows()) == []
+    finally:
+        plan.close()
+
+def test_not_a_plan(tmp_path):
+    path = tmp_path / 'assets.csv'
+    path.write_text(','.join(HEADER) * 4)
+
+    with pytest.raises(ValueError, match='not a migration plan'):
+        Plan(path)
+
+def test_plan_run(tmp_path, csv_path, fake, server):
+    fake.load_csv(csv_path)
+
+    result = run_cli(server, ['plan', 'test-token', FAKE_GROUP_ID, FAKE_SOURCE_ORG, '--csv-path', str(csv_path)], tmp_path)
+    assert result.returncode == 0, result.stderr
+
+    plan = Plan(tmp_path / 'migration.plan')
+    try:
+        assert (plan.row_count, plan.project_count) == (3, 6)
+    finally:
+        plan.close()
+
+    # a project added after the plan was compiled isn't moved, so its target is kept
+    late_target = next(iter(fake.targets_by_name[(FAKE_SOURCE_ORG, 'example_org/example_repo_3')]))
+    late_project = fake.add_project(late_target)
+    fake.reset_stats()
+
+    result = run_cli(server, [
+        'migrate-projects', 'test-token', FAKE_GROUP_ID, FAKE_SOURCE_ORG,
+        '--plan', 'migration.plan', '--output-csv-path', 'errored.csv'], tmp_path)
+    assert result.returncode == 0, result.stderr
+
+    calls = fake.stats()['calls']
+    assert calls['move_project'] == 6
+    assert calls['delete_target'] == 2
+    assert 'list_targets' not in calls and 'list_orgs' not in calls
+
+    assert list(fake.org_targets[FAKE_SOURCE_ORG]) == [late_target]
+    assert fake.projects[late_project]['org'] == FAKE_SOURCE_ORG
+
+    with open(tmp_path / 'errored.csv', newline='', encoding='utf-8') as errored_file:
+        errored = list(csv.DictReader(errored_file))
+
+    assert [(row['Project Name'], row['Failure Reason']) for row in errored] == [
+        ('example_org/example_repo_3', 'target not empty after moves')
+    ]
+
+def test_plan_keeps_csv_order(tmp_path, fake, server):
+    # rows of three orgs, interleaved
+    rows = [['', str(index % 3), 'Asset', f'url-{index}', f'org/repo-{index}', '1'] for index in range(24)]
+    csv_path = write_csv(tmp_path / 'assets.csv', rows)
+    fake.load_csv(csv_path)
+    # random latency, so the listings complete out of order
+    fake.latency = 0.01
+
+    result = run_cli(server, ['plan', 'test-token', FAKE_GROUP_ID, FAKE_SOURCE_ORG, '--csv-path', str(csv_path), '--concurrency', '8'], tmp_path)
+    assert result.returncode == 0, result.stderr
+
+    plan = Plan(tmp_path / 'migration.plan')
+    try:
+        assert [group.org_name for group in plan.groups()] == ['0_Asset', '1_Asset', '2_Asset']
+        assert [row.target_name for row in plan.rows()] == [row[4] for org in range(3) for row in rows if row[1] == str(org)]
+    finally:
+        plan.close()
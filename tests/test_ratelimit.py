@@ -0,0 +1,88 @@
+from email.utils import formatdate
+from types import SimpleNamespace
+
+import pytest
+
+from csv_to_json_api_import import ratelimit
+from csv_to_json_api_import.constants import SNYK_API_RATE_LIMIT_BACKOFF_SECONDS
+from csv_to_json_api_import.ratelimit import RateLimiter, retry_after
+
+NOW = 1700000000.0
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return NOW
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    return clock
+
+def _response(**headers):
+    return SimpleNamespace(headers={name.replace('_', '-'): value for name, value in headers.items()})
+
+def test_retry_after_seconds(clock):
+    assert retry_after(_response(Retry_After='3')) == 3
+    assert retry_after(_response(Retry_After='1.5')) == 1.5
+
+def test_retry_after_epoch(clock):
+    assert retry_after(_response(X_RateLimit_Reset=str(int(NOW) + 7))) == 7
+    # already passed
+    assert retry_after(_response(RateLimit_Reset=str(int(NOW) - 7))) == 0
+
+def test_retry_after_http_date(clock):
+    assert retry_after(_response(Retry_After=formatdate(NOW + 12, usegmt=True))) == 12
+
+def test_retry_after_is_capped(clock):
+    assert retry_after(_response(Retry_After='100000')) == SNYK_API_RATE_LIMIT_BACKOFF_SECONDS
+
+def test_retry_after_header_order(clock):
+    assert retry_after(_response(Retry_After='2', RateLimit_Reset='5')) == 2
+    # an unreadable header falls through to the next one
+    assert retry_after(_response(Retry_After='soon', RateLimit_Reset='5')) == 5
+    assert retry_after(_response(Retry_After='soon')) is None
+    assert retry_after(_response()) is None
+
+def test_token_bucket(clock):
+    limiter = RateLimiter(2)
+
+    assert limiter._take() == 0
+    assert limiter._take() == 0
+    assert limiter._take() == 0.5
+
+    clock.now += 0.5
+    assert limiter._take() == 0
+
+def test_no_rate_limit(clock):
+    limiter = RateLimiter(0)
+
+    assert all(limiter._take() == 0 for _ in range(100))
+
+def test_backoff_pauses_the_bucket(clock):
+    limiter = RateLimiter(0)
+
+    assert limiter.backoff(_response(Retry_After='4'), 0) == 4
+    assert limiter._take() == 4
+
+    # a shorter backoff doesn't end the pause early
+    limiter.backoff(_response(Retry_After='1'), 0)
+    clock.now += 1
+    assert limiter._take() == 3
+
+    clock.now += 3
+    assert limiter._take() == 0
+
+def test_backoff_without_header(clock):
+    limiter = RateLimiter(0)
+
+    # a jittered exponential backoff, 0.5 to 1 times 2 ** attempt
+    delay = limiter.backoff(_response(), 2)
+    assert 2 <= delay <= 4
+    assert limiter._take() == delay
@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+
+import pytest
+
+from csv_to_json_api_import import retry
+from csv_to_json_api_import.ratelimit import RateLimiter
+from csv_to_json_api_import.retry import CircuitBreaker, RetryPolicy, failure_delay
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(retry, 'time', clock)
+    return clock
+
+def _client(**policy):
+    return SimpleNamespace(retry_policy=RetryPolicy(base_delay=0, **policy), breaker=CircuitBreaker(), rate_limiter=RateLimiter(0))
+
+def _response(status, headers=None):
+    return SimpleNamespace(status_code=status, headers=headers or {})
+
+def test_max_retries():
+    policy = RetryPolicy(max_retries=2)
+
+    assert policy.allow_retry(0) and policy.allow_retry(1)
+    assert not policy.allow_retry(2)
+
+def test_budget_refuses_retries():
+    policy = RetryPolicy(budget_min=2, budget_ratio=0.5)
+
+    assert policy.allow_retry(0) and policy.allow_retry(0)
+    assert not policy.allow_retry(0)
+
+    # the budget grows with the requests made
+    policy.record_request()
+    policy.record_request()
+    assert policy.allow_retry(0)
+    assert not policy.allow_retry(0)
+
+    # 429s are paced by the rate limiter, not the budget
+    assert policy.allow_retry(0, budgeted=False)
+
+    assert policy.stats() == {'requests': 2, 'retries': 4, 'refused': 2}
+
+def test_budget_refusal_gives_up():
+    client = _client(budget_min=0)
+
+    assert failure_delay(client, 0, "HTTP 500", _response(500)) is None
+    assert client.retry_policy.refused == 1
+
+def test_retryable_statuses():
+    client = _client()
+
+    assert failure_delay(client, 0, "HTTP 400", _response(400)) is None
+    assert failure_delay(client, 0, "HTTP 403", _response(403)) is None
+    assert failure_delay(client, 0, "HTTP 403", _response(403), retry_statuses=(403,)) == 0
+    assert failure_delay(client, 0, "HTTP 503", _response(503)) == 0
+    assert failure_delay(client, 0, "ConnectionError") == 0
+
+    # 403s aren't a sign of congestion, 5xx responses and transport errors are
+    assert client.retry_policy.congestion_events == 2
+
+def test_non_idempotent_requests():
+    client = _client()
+
+    # the API may have processed a request that failed with a 5xx or no response
+    assert failure_delay(client, 0, "HTTP 500", _response(500), idempotent=False) is None
+    assert failure_delay(client, 0, "ConnectionError", idempotent=False) is None
+    assert client.retry_policy.retries == 0
+
+    # but not one it refused with a 429
+    assert failure_delay(client, 0, "HTTP 429", _response(429, {'Retry-After': '2'}), idempotent=False) == 0
+    assert client.retry_policy.retries == 1
+    assert client.rate_limiter._take() > 0
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=10, max_cooldown=25)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.wait_seconds() == 0
+
+    # a success resets the count
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.wait_seconds() == 0
+
+    breaker.record_failure()
+    assert breaker.wait_seconds() == 10
+    assert breaker.opened == 1
+
+    # requests in flight when it opened don't count
+    breaker.record_failure()
+    clock.now += 4
+    assert breaker.wait_seconds() == 6
+    assert breaker.opened == 1
+
+def test_breaker_doubles_cooldown(clock):
+    breaker = CircuitBreaker(threshold=2, cooldown=10, max_cooldown=25)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.wait_seconds() == 10
+
+    # the first failure after the pause opens it again, for twice as long
+    clock.now += 10
+    breaker.record_failure()
+    assert breaker.wait_seconds() == 20
+
+    clock.now += 20
+    breaker.record_failure()
+    assert breaker.wait_seconds() == 25
+
+    # a success after the pause closes it and resets the cooldown
+    clock.now += 25
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.wait_seconds() == 0
+    breaker.record_failure()
+    assert breaker.wait_seconds() == 10
+    assert breaker.opened == 4
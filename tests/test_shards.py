@@ -0,0 +1,84 @@
+import csv
+
+import pytest
+import typer.main
+
+from csv_to_json_api_import import main
+from csv_to_json_api_import.rows import UNKNOWN_ORG_NAME, Row
+from csv_to_json_api_import.shards import COORDINATOR_OPTIONS, command_args, merge_csv_files, parse_shard, shard_of
+
+def _row(asset_id, asset_name='Asset', target_name='org/repo'):
+    return Row('', asset_id, asset_name, '', target_name, '', [])
+
+def _migrate_context(args):
+    command = typer.main.get_command(main.app).commands['migrate-projects']
+    return command.make_context('migrate-projects', ['token', 'group', 'source', *args])
+
+def test_parse_shard():
+    assert parse_shard('1/4') == (1, 4)
+    assert parse_shard('4/4') == (4, 4)
+
+    for value in ('0/4', '5/4', '1/0', '1', 'a/b'):
+        with pytest.raises(ValueError):
+            parse_shard(value)
+
+def test_shard_of_is_stable():
+    # CRC32 of the org name, the same in every process and on every machine
+    assert [shard_of(_row(asset_id), 4) for asset_id in ('1', '2', '3', '4', '5')] == [4, 3, 3, 1, 1]
+
+def test_shard_of_keeps_orgs_together():
+    assert shard_of(_row('1', target_name='org/a'), 8) == shard_of(_row('1', target_name='org/b'), 8)
+    # rows without an asset go to the same org
+    assert _row('').org_name == _row('1', '').org_name == UNKNOWN_ORG_NAME
+    assert shard_of(_row(''), 8) == shard_of(_row('1', ''), 8)
+
+    shards = {shard_of(_row(str(asset_id)), 4) for asset_id in range(100)}
+    assert shards == {1, 2, 3, 4}
+
+def test_command_args_round_trip():
+    ctx = _migrate_context([
+        '--csv-path', 'assets.csv', '--concurrency', '4', '--dry-run', '--backend', 'async',
+        '--endpoint-limit', 'move=8', '--endpoint-limit', 'delete=2', '--no-prefetch-orgs', '--verify-sample', '0.1'])
+
+    args = command_args(ctx)
+
+    assert _migrate_context(args).params == ctx.params
+    assert args[args.index('--backend') + 1] == 'async'
+    assert '--no-prefetch-orgs' in args
+
+def test_command_args_skip():
+    ctx = _migrate_context(['--csv-path', 'assets.csv', '--shards', '4', '--rate-limit', '10', '--summary-json', 'summary.json'])
+
+    args = command_args(ctx, skip=COORDINATOR_OPTIONS)
+
+    assert '--csv-path' in args
+    assert not {'--shards', '--rate-limit', '--summary-json'} & set(args)
+
+def _write(path, rows):
+    with open(path, 'w', newline='') as csv_file:
+        csv.writer(csv_file).writerows(rows)
+
+def _read(path):
+    with open(path, newline='') as csv_file:
+        return list(csv.reader(csv_file))
+
+def test_merge_csv_files(tmp_path):
+    output = tmp_path / 'errored.csv'
+    shard_1 = tmp_path / 'errored.csv.shard-1-of-3'
+    shard_3 = tmp_path / 'errored.csv.shard-3-of-3'
+
+    _write(shard_1, [['Project Name', 'Failure Reason'], ['a', 'x']])
+    _write(shard_3, [['Project Name', 'Failure Reason'], ['c', 'y'], ['d', 'z']])
+
+    # the second shard had no errored rows
+    merge_csv_files(output, [shard_1, tmp_path / 'errored.csv.shard-2-of-3', shard_3])
+
+    assert _read(output) == [['Project Name', 'Failure Reason'], ['a', 'x'], ['c', 'y'], ['d', 'z']]
+    assert not shard_1.exists() and not shard_3.exists()
+
+    # appending to an existing file doesn't repeat the header
+    _write(shard_1, [['Project Name', 'Failure Reason'], ['e', 'w']])
+    merge_csv_files(output, [shard_1])
+
+    assert _read(output)[-2:] == [['d', 'z'], ['e', 'w']]
+    assert _read(output).count(['Project Name', 'Failure Reason']) == 1